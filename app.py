@@ -1,20 +1,37 @@
-from fastapi import FastAPI, UploadFile, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, HTTPException, Depends, Header, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response
-from typing import Dict, Optional
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Dict, List, Optional, Sequence, Tuple, Union
 from pydantic import BaseModel
-from supabase import create_client
-from elevenlabs.client import ElevenLabs
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
+import asyncio
 import logging
 import traceback
 import soundfile as sf
+import numpy as np
+import hashlib
 import io
-import subprocess
 import json
-from profile_manager import ProfileManager
+import time
+import uuid
+from clients import PREWARM_CLIENTS, async_openai_client, elevenlabs_client, openai_client, close as close_clients, warm_up as warm_up_clients
+from profile_manager import CONVERSATION_EXPORT_BATCH_SIZE, CONVERSATION_PAGE_MAX, CONVERSATION_PAGE_SIZE, SEARCH_QUERY_MAX_LENGTH, ProfileManager, decode_cursor, encode_cursor
+from conversation import ChatContext, Turn
+from concurrency import request_slots, run_blocking, shutdown as shutdown_blocking_pool
+from extraction_queue import extraction_queue
+from conversation_journal import conversation_journal
+from idempotency import IDEMPOTENCY_KEY_MAX_LENGTH, IdempotencyConflict, fingerprint, idempotent_requests
+from profile_cache import transcript_cache
+from profile_prefilter import profile_prefilter
+from model_router import model_router
+from metrics import SERVER_TIMING, metrics, metrics_store, request_timings, server_timing_header, stage, timed
+from context_builder import HISTORY_FETCH_LIMIT, SUMMARY_BATCH_SIZE, build_context, summary_backlog_before, summary_due
+from memory_index import MEMORY_TOP_K, memory_index
+from speech_pipeline import split_sentences, synthesize_in_order
+from tts_cache import TTSCache, tts_cache
+from audio_ingest import TRANSCRIPTION_SAMPLE_RATE, encode_opus, prepare_audio, prepare_audio_async, resample, warm_up as warm_up_audio
+from voice_stream import MAX_STREAM_SAMPLE_RATE, MIN_STREAM_SAMPLE_RATE, UtteranceSegmenter, pcm16_to_float
 from datetime import datetime
 
 # Configure logging
@@ -24,22 +41,6 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Initialize API keys and clients
-elevenlabs_api_key = os.getenv("ELEVENLABS_API_KEY")
-openai_api_key = os.getenv("OPENAI_API_KEY")
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-
-if not openai_api_key:
-    raise ValueError("Missing OpenAI API key. Please check your .env file.")
-if not supabase_url or not supabase_key:
-    raise ValueError("Missing Supabase credentials. Please check your .env file")
-
-# Set up API clients
-elevenlabs_client = ElevenLabs(api_key=elevenlabs_api_key)
-openai_client = OpenAI()
-supabase = create_client(supabase_url, supabase_key)
-
 app = FastAPI()
 
 # Configure CORS
@@ -53,13 +54,31 @@ app.add_middleware(
     max_age=86400,
 )
 
+# Audio accepted by TherapistAI: a file path, raw bytes or a binary file object
+AudioInput = Union[str, bytes, BinaryIO]
+
 class ChatMessage(BaseModel):
     session_id: str
     message: str
 
+class SpeechRequest(BaseModel):
+    text: str
+
 class TherapistAI:
     def __init__(self):
         self.openai = openai_client
+        self.async_openai = async_openai_client
+        self.tts_params = {
+            "voice_id": "21m00Tcm4TlvDq8ikWAM",
+            "model_id": "eleven_multilingual_v2",
+            "output_format": "mp3_44100_128",
+            "voice_settings": {
+                "stability": 0.71,
+                "similarity_boost": 0.75,
+                "style": 0.35,
+                "use_speaker_boost": True
+            }
+        }
         self.system_prompt = """You are a licensed professional therapist with extensive experience in clinical psychology and counseling. 
         You have access to the client's profile information and conversation history, which you MUST use to provide personalized, contextual responses.
         
@@ -76,12 +95,10 @@ class TherapistAI:
            Goals:
            - [goal details]
            
-        2. Recent Conversation History follows the profile and is formatted as:
-           User: [previous message]
-           AI: [previous response]
+        2. Recent Conversation History follows the profile as the previous
+           user and assistant messages of this conversation.
            
-        3. The current message appears last as:
-           Current user message: [message]
+        3. The current message is the last user message.
            
         Memory Usage Instructions:
         - ALWAYS scan the provided User Profile Information for relevant context
@@ -118,18 +135,35 @@ class TherapistAI:
         Keep responses focused, professional, and therapeutically meaningful.
         Never deflect or redirect to other professionals unless absolutely necessary.
         Always maintain hope while acknowledging the reality of challenges."""
+        # Built once so every request shares the same prompt prefix
+        self._system_message = {"role": "system", "content": self.system_prompt}
 
-    def process_interaction(self, audio_path: str, context: str = "") -> Dict:
+    def process_interaction(self, audio: AudioInput, history: Optional[Sequence[Turn]] = None,
+                            filename: str = "audio.wav") -> Dict:
         try:
-            user_input = self.transcribe_audio(audio_path)
+            user_input = self.transcribe_audio(audio, filename)
             logger.info(f"Transcribed user input: {user_input}")
             
-            if context:
-                prompt = f"""Previous conversation:\n{context}\n\nCurrent user message: {user_input}\n\nTherapist:"""
-            else:
-                prompt = f"""User: {user_input}\n\nTherapist:"""
+            ai_response = self.generate_response(user_input, history)
+            logger.info(f"Generated AI response: {ai_response}")
             
-            ai_response = self.generate_response(prompt)
+            return {
+                "user_input": user_input,
+                "ai_response": ai_response,
+                "audio_available": False
+            }
+            
+        except Exception as e:
+            logger.error(f"Error in process_interaction: {str(e)}")
+            raise
+
+    async def process_interaction_async(self, audio: AudioInput, history: Optional[Sequence[Turn]] = None,
+                                        filename: str = "audio.wav") -> Dict:
+        try:
+            user_input = await self.transcribe_audio_async(audio, filename)
+            logger.info(f"Transcribed user input: {user_input}")
+            
+            ai_response = await self.generate_response_async(user_input, history)
             logger.info(f"Generated AI response: {ai_response}")
             
             return {
@@ -142,61 +176,120 @@ class TherapistAI:
             logger.error(f"Error in process_interaction: {str(e)}")
             raise
 
-    def transcribe_audio(self, audio_path: str) -> str:
+    def _transcription_file(self, audio: AudioInput, filename: str) -> Tuple[str, bytes]:
+        """Normalize a path, raw bytes or file-like object into an upload tuple"""
+        if isinstance(audio, str):
+            if not os.path.exists(audio):
+                raise FileNotFoundError(f"Audio file not found: {audio}")
+            with open(audio, "rb") as audio_file:
+                return os.path.basename(audio), audio_file.read()
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            return filename, bytes(audio)
+        name = getattr(audio, "name", None)
+        return os.path.basename(name) if isinstance(name, str) else filename, audio.read()
+
+    @staticmethod
+    def _cached_transcript(data: bytes) -> Tuple[str, Optional[str]]:
+        """Cache key for uploaded audio and its transcript, if it was transcribed before"""
+        key = f"whisper-1:en:{hashlib.sha256(data).hexdigest()}"
+        return key, transcript_cache.get(key)
+
+    def transcribe_audio(self, audio: AudioInput, filename: str = "audio.wav") -> str:
         try:
-            if not os.path.exists(audio_path):
-                raise FileNotFoundError(f"Audio file not found: {audio_path}")
-                
-            with open(audio_path, "rb") as audio_file:
+            filename, data = self._transcription_file(audio, filename)
+            key, cached = self._cached_transcript(data)
+            if cached is not None:
+                return cached
+            payload = prepare_audio(data, filename)
+            with stage("whisper"):
                 transcript = self.openai.audio.transcriptions.create(
                     model="whisper-1",
-                    file=audio_file,
+                    file=(payload.filename, payload.data),
                     language="en"
                 )
-                return transcript.text
+            transcript_cache.set(key, transcript.text)
+            return transcript.text
         except Exception as e:
             logger.error(f"Error transcribing audio: {str(e)}")
             raise
 
-    def generate_response(self, prompt: str) -> str:
+    async def transcribe_audio_async(self, audio: AudioInput, filename: str = "audio.wav") -> str:
         try:
-            # Split the prompt into parts if it contains conversation history
-            messages = [{"role": "system", "content": self.system_prompt}]
-            
-            # Check if prompt contains conversation history
-            if "Previous conversation:" in prompt:
-                # Extract conversation history and current message
-                parts = prompt.split("Current user message:")
-                if len(parts) == 2:
-                    history_text = parts[0].replace("Previous conversation:\n", "").strip()
-                    current_message = parts[1].replace("\n\nTherapist:", "").strip()
-                    
-                    # Parse conversation history into message format
-                    history_exchanges = history_text.split("\n")
-                    for i in range(0, len(history_exchanges), 2):
-                        if i + 1 < len(history_exchanges):
-                            user_msg = history_exchanges[i].replace("User: ", "").strip()
-                            ai_msg = history_exchanges[i + 1].replace("AI: ", "").strip()
-                            messages.append({"role": "user", "content": user_msg})
-                            messages.append({"role": "assistant", "content": ai_msg})
-                    
-                    # Add current message
-                    messages.append({"role": "user", "content": current_message})
-                else:
-                    messages.append({"role": "user", "content": prompt})
+            if isinstance(audio, str):
+                filename, data = await run_blocking(self._transcription_file, audio, filename)
             else:
-                # If no history, just add the current message
-                messages.append({"role": "user", "content": prompt.replace("User: ", "").replace("\n\nTherapist:", "")})
+                filename, data = self._transcription_file(audio, filename)
+            key, cached = await run_blocking(self._cached_transcript, data)
+            if cached is not None:
+                return cached
+            payload = await prepare_audio_async(data, filename)
+            with stage("whisper"):
+                transcript = await self.async_openai.audio.transcriptions.create(
+                    model="whisper-1",
+                    file=(payload.filename, payload.data),
+                    language="en"
+                )
+            await run_blocking(transcript_cache.set, key, transcript.text)
+            return transcript.text
+        except Exception as e:
+            logger.error(f"Error transcribing audio: {str(e)}")
+            raise
+
+    async def transcribe_pcm_async(self, samples: np.ndarray, sample_rate: int) -> str:
+        """Transcribe a chunk of mono float samples captured from a live stream"""
+        try:
+            if sample_rate != TRANSCRIPTION_SAMPLE_RATE:
+                samples = await run_blocking(resample, samples, sample_rate)
+            data = await run_blocking(encode_opus, samples, TRANSCRIPTION_SAMPLE_RATE)
+            with stage("whisper"):
+                transcript = await self.async_openai.audio.transcriptions.create(
+                    model="whisper-1",
+                    file=("chunk.ogg", data),
+                    language="en"
+                )
+            return transcript.text
+        except Exception as e:
+            logger.error(f"Error transcribing audio chunk: {str(e)}")
+            raise
+
+    def build_messages(self, user_message: str, history: Optional[Sequence[Turn]] = None,
+                       profile_context: str = "") -> List[Dict]:
+        """Assemble chat messages: the fixed system prompt, the profile, past turns, then the new message"""
+        messages = [self._system_message]
+        if profile_context:
+            messages.append({"role": "system", "content": f"User Profile Information:\n{profile_context}"})
+        if history:
+            messages.extend(turn.to_message() for turn in history)
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    # Sampling settings for replies; the model and max_tokens come from the "chat" route
+    completion_params = {
+        "temperature": 0.5,  # Lower temperature for more consistent, professional responses
+        "presence_penalty": 0.3,  # Moderate presence penalty to maintain focus
+        "frequency_penalty": 0.3,  # Prevent repetition while maintaining consistency
+        "top_p": 0.9  # Focus on more likely/professional responses
+    }
+
+    @timed("chat_completion")
+    def generate_response(self, user_message: str, history: Optional[Sequence[Turn]] = None,
+                          profile_context: str = "") -> str:
+        try:
+            messages = self.build_messages(user_message, history, profile_context)
+            response = model_router.complete(self.openai, "chat", messages, **self.completion_params)
             
-            response = self.openai.chat.completions.create(
-                model="gpt-4-0125-preview",
-                messages=messages,
-                max_tokens=500,
-                temperature=0.5,  # Lower temperature for more consistent, professional responses
-                presence_penalty=0.3,  # Moderate presence penalty to maintain focus
-                frequency_penalty=0.3,  # Prevent repetition while maintaining consistency
-                top_p=0.9  # Focus on more likely/professional responses
-            )
+            return response.choices[0].message.content
+            
+        except Exception as e:
+            logger.error(f"Error generating response: {str(e)}")
+            raise
+
+    @timed("chat_completion")
+    async def generate_response_async(self, user_message: str, history: Optional[Sequence[Turn]] = None,
+                                      profile_context: str = "") -> str:
+        try:
+            messages = self.build_messages(user_message, history, profile_context)
+            response = await model_router.complete_async(self.async_openai, "chat", messages, **self.completion_params)
             
             return response.choices[0].message.content
             
@@ -204,43 +297,137 @@ class TherapistAI:
             logger.error(f"Error generating response: {str(e)}")
             raise
 
-    def text_to_speech(self, text):
+    @timed("chat_stream")
+    async def stream_response(self, user_message: str, history: Optional[Sequence[Turn]] = None,
+                              profile_context: str = "") -> AsyncIterator[str]:
+        """Yield response tokens as they arrive from the completion stream"""
+        try:
+            messages = self.build_messages(user_message, history, profile_context)
+            started = time.perf_counter()
+            first_token = True
+            async for token in model_router.stream(self.async_openai, "chat", messages, **self.completion_params):
+                if first_token:
+                    logger.info(f"Time to first token: {time.perf_counter() - started:.2f}s")
+                    first_token = False
+                yield token
+                
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            raise
+
+    def text_to_speech(self, text) -> Optional[Union[bytes, memoryview]]:
         try:
             if not text or not isinstance(text, str):
                 raise ValueError("Invalid text input")
+            
+            cache_key = TTSCache.make_key(text, **self.tts_params)
+            cached = tts_cache.get(cache_key)
+            if cached is not None:
+                return cached
                 
-            audio = elevenlabs_client.text_to_speech.convert(
-                text=text,
-                voice_id="21m00Tcm4TlvDq8ikWAM",
-                model_id="eleven_multilingual_v2",
-                output_format="mp3_44100_128",
-                voice_settings={
-                    "stability": 0.71,
-                    "similarity_boost": 0.75,
-                    "style": 0.35,
-                    "use_speaker_boost": True
-                }
-            )
+            # The SDK returns a lazy chunk iterator; consume it here so
+            # quota errors raised mid-stream are handled below
+            with stage("tts"):
+                audio = b"".join(elevenlabs_client.text_to_speech.convert(
+                    text=text,
+                    **self.tts_params
+                ))
+            tts_cache.put(cache_key, audio)
             return audio
         except Exception as e:
             if "quota_exceeded" in str(e):
+                # Another worker may have synthesized the same text meanwhile
+                cached = tts_cache.get(cache_key)
+                if cached is not None:
+                    logger.warning("ElevenLabs quota exceeded. Serving cached audio.")
+                    return cached
                 logger.warning("ElevenLabs quota exceeded. Returning without audio.")
                 return None
             logger.error(f"Error converting text to speech: {str(e)}")
             raise
 
+    async def text_to_speech_async(self, text: str) -> Optional[Union[bytes, memoryview]]:
+        return await run_blocking(self.text_to_speech, text)
+
 # Initialize TherapistAI
 therapist = TherapistAI()
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Time every HTTP request and optionally report its stages in a Server-Timing header"""
+    started = time.perf_counter()
+    timings = [] if SERVER_TIMING else None
+    token = request_timings.set(timings)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        request_timings.reset(token)
+        route = request.scope.get("route")
+        elapsed = time.perf_counter() - started
+        metrics.observe_request(getattr(route, "path", "unmatched"), elapsed, status)
+    if timings is not None:
+        response.headers["Server-Timing"] = server_timing_header(timings + [("total", elapsed)])
+    return response
+
+@app.on_event("startup")
+async def startup_event():
+    extraction_queue.start()
+    conversation_journal.start()
+    if metrics_store is not None:
+        metrics_store.start()
+    if PREWARM_CLIENTS:
+        await asyncio.gather(warm_up_clients(), warm_up_audio())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await extraction_queue.drain()
+    await conversation_journal.drain()
+    if metrics_store is not None:
+        await metrics_store.stop()
+    shutdown_blocking_pool()
+    await close_clients()
+
 @app.options("/process-interaction")
 async def options_process_interaction():
     return Response(status_code=200)
 
+def is_session_id(session_id: str) -> bool:
+    """Session ids are user UUIDs; anything else could never be stored"""
+    try:
+        uuid.UUID(session_id)
+        return True
+    except (TypeError, ValueError, AttributeError):
+        return False
+
+def require_session_id(session_id: str):
+    if not is_session_id(session_id):
+        raise HTTPException(status_code=400, detail="session_id must be a UUID")
+
+async def run_idempotent(idempotency_key: Optional[str], scope: str, request_fingerprint: str,
+                         compute: Callable[[], Awaitable[Dict]]) -> JSONResponse:
+    """Run a request once per Idempotency-Key, giving retries the same response"""
+    if not idempotency_key:
+        return JSONResponse(content=await compute())
+    if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+    try:
+        response, replayed = await idempotent_requests.run(
+            f"{scope}:{idempotency_key}",
+            request_fingerprint,
+            compute
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return JSONResponse(content=response, headers={"Idempotent-Replayed": "true"} if replayed else None)
+
 @app.post("/process-interaction")
 async def process_interaction(
     audio: UploadFile,
-    conversation_history: Optional[str] = None
-) -> Dict:
+    conversation_history: Optional[str] = None,
+    idempotency_key: Optional[str] = Header(None)
+) -> JSONResponse:
     logger.info("Received audio processing request")
     logger.info(f"Audio file name: {audio.filename}")
     logger.info(f"Content type: {audio.content_type}")
@@ -248,52 +435,50 @@ async def process_interaction(
     if not audio:
         raise HTTPException(status_code=400, detail="No audio file provided")
     
+    with stage("upload"):
+        content = await audio.read()
+    
+    return await run_idempotent(
+        idempotency_key,
+        "process-interaction",
+        fingerprint(content, conversation_history or ""),
+        lambda: respond_to_interaction(content, audio.filename, conversation_history)
+    )
+
+async def respond_to_interaction(content: bytes, filename: Optional[str],
+                                 conversation_history: Optional[str]) -> Dict:
     try:
-        logger.info(f"Processing audio file: {audio.filename}")
+        logger.info(f"Processing audio file: {filename}")
         
-        history_context = ""
+        history = []
         if conversation_history:
             try:
-                history = json.loads(conversation_history)
-                history_context = "\n".join([
-                    f"User: {msg['user_message']}\nAI: {msg['ai_response']}"
-                    for msg in history
-                ])
+                # Client-supplied history gets the same budget as stored history
+                client_context, _ = build_context({}, json.loads(conversation_history), "", "")
+                history = client_context.history
                 logger.info("Added conversation history for context")
             except Exception as e:
                 logger.warning(f"Failed to parse conversation history: {e}")
         
-        content = await audio.read()
+        logger.info("Processing interaction with TherapistAI")
+        async with request_slots():
+            result = await therapist.process_interaction_async(
+                content,
+                history=history,
+                filename=filename or "audio.webm"
+            )
         
-        temp_webm = "temp_recording.webm"
-        temp_wav = "temp_recording.wav"
-        try:
-            with open(temp_webm, "wb") as buffer:
-                buffer.write(content)
-            
-            if not convert_webm_to_wav(temp_webm, temp_wav):
-                raise ValueError("Failed to convert audio file")
-            
-            logger.info("Processing interaction with TherapistAI")
-            result = therapist.process_interaction(temp_wav, context=history_context)
-            
-            if not result or "user_input" not in result or "ai_response" not in result:
-                raise ValueError("Invalid response from TherapistAI")
-            
-            response_data = {
-                "transcription": result["user_input"],
-                "response": result["ai_response"],
-                "audioAvailable": result.get("audio_available", False)
-            }
-            
-            logger.info("Successfully processed interaction")
-            return JSONResponse(content=response_data)
-            
-        finally:
-            for temp_file in [temp_webm, temp_wav]:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                    logger.info(f"Cleaned up temporary file: {temp_file}")
+        if not result or "user_input" not in result or "ai_response" not in result:
+            raise ValueError("Invalid response from TherapistAI")
+        
+        response_data = {
+            "transcription": result["user_input"],
+            "response": result["ai_response"],
+            "audioAvailable": result.get("audio_available", False)
+        }
+        
+        logger.info("Successfully processed interaction")
+        return response_data
     
     except Exception as e:
         logger.error(f"Error processing interaction: {str(e)}")
@@ -307,36 +492,72 @@ async def process_interaction(
             }
         )
 
+@timed("context")
+async def build_chat_context(session_id: str, user_message: str) -> ChatContext:
+    """Fetch the user's profile, recent and relevant conversations and fit them into the prompt budget.
+
+    Conversations that no longer fit are queued for the user's rolling summary.
+    """
+    # Fetch the profile with recent conversations and search older ones concurrently.
+    # Extra matches make up for those that turn out to be in the recent history.
+    (profile, previous_conversations), memories = await asyncio.gather(
+        run_blocking(ProfileManager.get_chat_context, session_id, HISTORY_FETCH_LIMIT + SUMMARY_BATCH_SIZE),
+        run_blocking(
+            ProfileManager.search_conversations,
+            session_id,
+            user_message,
+            MEMORY_TOP_K + HISTORY_FETCH_LIMIT
+        )
+    )
+    # Reads the profile cache, which may go to the shared backend
+    profile_context = await run_blocking(ProfileManager.get_profile_context, session_id, profile)
+    # Conversations come newest first; those beyond the window only count towards the summary
+    recent = previous_conversations[:HISTORY_FETCH_LIMIT]
+    older = previous_conversations[HISTORY_FETCH_LIMIT:]
+    context, overflow = build_context(profile, recent, user_message, profile_context, memories)
+    
+    pending = summary_due(profile, overflow, older)
+    if pending:
+        extraction_queue.submit_summary(session_id, pending, summary_backlog_before(profile, previous_conversations))
+    
+    return context
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.post("/chat")
-async def chat(message: ChatMessage) -> Dict:
+async def chat(message: ChatMessage, idempotency_key: Optional[str] = Header(None)) -> JSONResponse:
+    """Reply to a chat message.
+
+    Clients that retry should send the same Idempotency-Key header, so a
+    retry gets the original reply instead of generating and storing another.
+    """
+    require_session_id(message.session_id)
+    return await run_idempotent(
+        idempotency_key,
+        f"chat:{message.session_id}",
+        fingerprint(message.session_id, message.message),
+        lambda: respond_to_chat(message)
+    )
+
+async def respond_to_chat(message: ChatMessage) -> Dict:
     try:
         logger.info(f"Received chat message from session {message.session_id}")
         
-        # Get user profile context
-        profile_context = ProfileManager.get_profile_context(message.session_id)
-        
-        # Build context from previous conversations
-        previous_conversations = ProfileManager.get_session_conversations(message.session_id)
-        conv_context = "\n".join([
-            f"User: {conv['user_message']}\nAI: {conv['ai_response']}"
-            for conv in previous_conversations[-5:]  # Get last 5 conversations for context
-        ])
-        
-        # Generate prompt with both profile and conversation context
-        prompt = f"""User Profile Information:\n{profile_context}\n\n"""
-        if conv_context:
-            prompt += f"""Recent Conversation History:\n{conv_context}\n\n"""
-        prompt += f"""Current user message: {message.message}\n\nTherapist:"""
+        context = await build_chat_context(message.session_id, message.message)
         
         # Generate AI response with context
-        ai_response = therapist.generate_response(prompt)
+        async with request_slots():
+            ai_response = await therapist.generate_response_async(
+                message.message,
+                context.history,
+                context.profile_context
+            )
         logger.info("Generated AI response")
         
-        # Update user profile with any new information from the message
-        ProfileManager.update_profile_from_message(message.session_id, message.message)
-        
         # Store the conversation
-        conversation = ProfileManager.store_conversation(
+        conversation = await run_blocking(
+            ProfileManager.store_conversation,
             message.session_id,
             message.message,
             ai_response
@@ -345,6 +566,9 @@ async def chat(message: ChatMessage) -> Dict:
         if not conversation:
             raise ValueError("Failed to store conversation")
         
+        # Update user profile with any new information from the message in the background
+        extraction_queue.submit(message.session_id, message.message, context.profile)
+        
         return {"response": ai_response}
         
     except Exception as e:
@@ -359,10 +583,366 @@ async def chat(message: ChatMessage) -> Dict:
             }
         )
 
+@app.post("/chat/stream")
+async def chat_stream(message: ChatMessage):
+    """Stream the therapist reply as Server-Sent Events.
+
+    Emits a "token" event per chunk, then "done" with the full reply once it
+    has been stored, or "error" if generation or storage fails.
+    """
+    require_session_id(message.session_id)
+    try:
+        logger.info(f"Received streaming chat message from session {message.session_id}")
+        context = await build_chat_context(message.session_id, message.message)
+    except Exception as e:
+        logger.error(f"Error in chat stream endpoint: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "error": "Failed to process chat message",
+                "message": str(e),
+                "type": type(e).__name__
+            }
+        )
+    
+    async def event_stream():
+        try:
+            parts = []
+            async with request_slots():
+                stream = therapist.stream_response(message.message, context.history, context.profile_context)
+                async for token in stream:
+                    parts.append(token)
+                    yield sse_event("token", {"token": token})
+            ai_response = "".join(parts)
+            logger.info("Streamed AI response")
+            
+            conversation = await run_blocking(
+                ProfileManager.store_conversation,
+                message.session_id,
+                message.message,
+                ai_response
+            )
+            if not conversation:
+                raise ValueError("Failed to store conversation")
+            
+            extraction_queue.submit(message.session_id, message.message, context.profile)
+            yield sse_event("done", {"response": ai_response})
+            
+        except Exception as e:
+            logger.error(f"Error streaming chat response: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield sse_event("error", {
+                "error": "Failed to process chat message",
+                "message": str(e),
+                "type": type(e).__name__
+            })
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/chat/voice")
+async def chat_voice(message: ChatMessage):
+    """Stream the therapist reply as MP3 audio.
+
+    The completion is split at sentence boundaries and each sentence is
+    synthesized as soon as it is complete, so audio starts playing while the
+    rest of the reply is still being generated.
+    """
+    require_session_id(message.session_id)
+    try:
+        logger.info(f"Received voice chat message from session {message.session_id}")
+        context = await build_chat_context(message.session_id, message.message)
+    except Exception as e:
+        logger.error(f"Error in chat voice endpoint: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "error": "Failed to process chat message",
+                "message": str(e),
+                "type": type(e).__name__
+            }
+        )
+    
+    async def audio_stream():
+        parts = []
+        
+        async def tokens():
+            async with request_slots():
+                stream = therapist.stream_response(message.message, context.history, context.profile_context)
+                async for token in stream:
+                    parts.append(token)
+                    yield token
+        
+        try:
+            async for audio in synthesize_in_order(split_sentences(tokens()), therapist.text_to_speech_async):
+                yield audio
+            ai_response = "".join(parts)
+            logger.info("Streamed AI voice response")
+            
+            conversation = await run_blocking(
+                ProfileManager.store_conversation,
+                message.session_id,
+                message.message,
+                ai_response
+            )
+            if not conversation:
+                logger.error("Failed to store conversation")
+            
+            extraction_queue.submit(message.session_id, message.message, context.profile)
+            
+        except Exception as e:
+            # Headers are already sent, so the client sees a truncated stream
+            logger.error(f"Error streaming voice response: {str(e)}")
+            logger.error(traceback.format_exc())
+    
+    return StreamingResponse(
+        audio_stream(),
+        media_type="audio/mpeg",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def respond_to_utterance(websocket: WebSocket, session_id: str, chunk_tasks: List[asyncio.Task]):
+    """Join the chunk transcripts of a finished utterance and stream the reply"""
+    transcripts = await asyncio.gather(*chunk_tasks)
+    user_input = " ".join(text.strip() for text in transcripts if text and text.strip())
+    await websocket.send_json({"type": "transcription", "text": user_input})
+    if not user_input:
+        return
+    logger.info(f"Transcribed user input: {user_input}")
+    
+    context = await build_chat_context(session_id, user_input)
+    parts = []
+    async with request_slots():
+        async for token in therapist.stream_response(user_input, context.history, context.profile_context):
+            parts.append(token)
+            await websocket.send_json({"type": "token", "token": token})
+    ai_response = "".join(parts)
+    logger.info("Streamed AI voice response")
+    
+    await websocket.send_json({
+        "type": "response",
+        "transcription": user_input,
+        "response": ai_response
+    })
+    
+    conversation = await run_blocking(
+        ProfileManager.store_conversation,
+        session_id,
+        user_input,
+        ai_response
+    )
+    if not conversation:
+        logger.error("Failed to store conversation")
+    extraction_queue.submit(session_id, user_input, context.profile)
+
+@app.websocket("/ws/voice")
+async def voice_socket(websocket: WebSocket, session_id: str, sample_rate: int = TRANSCRIPTION_SAMPLE_RATE):
+    """Voice conversation over a WebSocket.
+
+    The client streams binary frames of 16-bit little-endian mono PCM at
+    sample_rate while the user speaks. Audio is transcribed in chunks at
+    short pauses, and the reply starts as soon as a longer pause ends the
+    utterance. The client can also send {"type": "end_of_utterance"} to end
+    it explicitly. The server replies with "transcription", "token" and
+    "response" JSON messages, or "error".
+    """
+    await websocket.accept()
+    if not MIN_STREAM_SAMPLE_RATE <= sample_rate <= MAX_STREAM_SAMPLE_RATE:
+        await websocket.close(
+            code=1008,
+            reason=f"sample_rate must be between {MIN_STREAM_SAMPLE_RATE} and {MAX_STREAM_SAMPLE_RATE}"
+        )
+        return
+    if not is_session_id(session_id):
+        await websocket.close(code=1008, reason="session_id must be a UUID")
+        return
+    logger.info(f"Opened voice stream for session {session_id}")
+    segmenter = UtteranceSegmenter(sample_rate)
+    chunk_tasks: List[asyncio.Task] = []
+    
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            
+            if message.get("bytes"):
+                events = segmenter.feed(pcm16_to_float(message["bytes"]))
+            elif message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                except ValueError:
+                    continue
+                if control.get("type") != "end_of_utterance":
+                    continue
+                events = segmenter.flush()
+            else:
+                continue
+            
+            for kind, samples in events:
+                if len(samples):
+                    # Transcribe while the user keeps talking
+                    chunk_tasks.append(asyncio.create_task(
+                        therapist.transcribe_pcm_async(samples, sample_rate)
+                    ))
+                if kind == "end":
+                    tasks, chunk_tasks = chunk_tasks, []
+                    try:
+                        await respond_to_utterance(websocket, session_id, tasks)
+                    except WebSocketDisconnect:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Error processing voice utterance: {str(e)}")
+                        logger.error(traceback.format_exc())
+                        await websocket.send_json({
+                            "type": "error",
+                            "error": "Failed to process interaction",
+                            "message": str(e),
+                            "error_type": type(e).__name__
+                        })
+    
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in chunk_tasks:
+            task.cancel()
+        logger.info(f"Closed voice stream for session {session_id}")
+
+@app.post("/text-to-speech")
+async def text_to_speech(request: SpeechRequest):
+    """Synthesize text to MP3, serving repeated requests straight from the cache file"""
+    cache_key = TTSCache.make_key(request.text, **therapist.tts_params)
+    path = tts_cache.get_path(cache_key)
+    if path is None:
+        try:
+            audio = await therapist.text_to_speech_async(request.text)
+        except Exception as e:
+            logger.error(f"Error in text-to-speech endpoint: {str(e)}")
+            raise HTTPException(
+                status_code=500,
+                detail={
+                    "error": "Failed to synthesize speech",
+                    "message": str(e),
+                    "type": type(e).__name__
+                }
+            )
+        if audio is None:
+            raise HTTPException(status_code=503, detail="Speech synthesis unavailable")
+        path = tts_cache.get_path(cache_key)
+        if path is None:
+            return Response(content=bytes(audio), media_type="audio/mpeg")
+    return FileResponse(path, media_type="audio/mpeg")
+
+def collect_cache_stats() -> Dict:
+    stats = ProfileManager.cache_stats()
+    stats["tts"] = tts_cache.stats()
+    stats["memory"] = memory_index.stats()
+    stats["transcripts"] = transcript_cache.stats()
+    stats["idempotency"] = idempotent_requests.stats()
+    return stats
+
+@app.get("/cache-stats")
+async def cache_stats():
+    # The journal depth is a SQLite query
+    return await run_blocking(collect_cache_stats)
+
+@app.get("/extraction-stats")
+async def extraction_stats():
+    return {
+        "queue": extraction_queue.stats(),
+        "prefilter": profile_prefilter.stats()
+    }
+
+@app.get("/model-stats")
+async def model_stats():
+    return model_router.stats()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Metrics of every worker on the host, added up"""
+    if metrics_store is None:
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+    try:
+        body = await run_blocking(metrics_store.render)
+    except Exception as e:
+        # One worker's numbers alone would look like counters going backwards
+        logger.error(f"Error aggregating worker metrics: {str(e)}")
+        raise HTTPException(status_code=503, detail="Metrics unavailable")
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+async def export_conversations(session_id: str, before: Optional[Tuple[str, str]]) -> AsyncIterator[str]:
+    """Stream a user's history from a cursor on as NDJSON, one page in memory at a time"""
+    while True:
+        page = await run_blocking(
+            ProfileManager.get_conversation_page,
+            session_id,
+            CONVERSATION_EXPORT_BATCH_SIZE,
+            before
+        )
+        if page is None:
+            # Headers are already sent, so report the failure in-band with a cursor to resume from
+            resume = encode_cursor({'created_at': before[0], 'id': before[1]}) if before else None
+            yield json.dumps({"error": "Failed to load conversations", "cursor": resume}) + "\n"
+            return
+        for conversation in page:
+            yield json.dumps(conversation, default=str) + "\n"
+        if len(page) < CONVERSATION_EXPORT_BATCH_SIZE:
+            return
+        before = (page[-1]['created_at'], page[-1]['id'])
+
 @app.get("/conversations/{session_id}")
-async def get_conversations(session_id: str):
-    conversations = ProfileManager.get_session_conversations(session_id)
-    return {"conversations": conversations}
+async def get_conversations(
+    session_id: str,
+    limit: int = CONVERSATION_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    output_format: str = Query("json", alias="format")
+):
+    """A user's conversations, newest first.
+
+    Pass next_cursor back as cursor to get the following page. With
+    format=ndjson the whole history from the cursor on is streamed instead,
+    one conversation per line.
+    """
+    require_session_id(session_id)
+    try:
+        before = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    if output_format == "ndjson":
+        return StreamingResponse(export_conversations(session_id, before), media_type="application/x-ndjson")
+    
+    limit = max(1, min(limit, CONVERSATION_PAGE_MAX))
+    conversations = await run_blocking(ProfileManager.get_conversation_page, session_id, limit, before)
+    if conversations is None:
+        raise HTTPException(status_code=503, detail="Failed to load conversations")
+    next_cursor = encode_cursor(conversations[-1]) if len(conversations) == limit else None
+    return {"conversations": conversations, "next_cursor": next_cursor}
+
+@app.get("/conversations/{session_id}/search")
+async def search_conversation_text(session_id: str, q: str, limit: int = CONVERSATION_PAGE_SIZE, offset: int = 0):
+    """A page of a user's conversations matching q, best match first.
+
+    q takes web search syntax, e.g. "mom Sarah" for an exact phrase. Pass
+    next_offset back as offset to get the following page.
+    """
+    require_session_id(session_id)
+    q = q.strip()
+    if not q or len(q) > SEARCH_QUERY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail=f"q must be 1 to {SEARCH_QUERY_MAX_LENGTH} characters")
+    
+    limit = max(1, min(limit, CONVERSATION_PAGE_MAX))
+    offset = max(0, offset)
+    results = await run_blocking(ProfileManager.full_text_search, session_id, q, limit, offset)
+    if results is None:
+        raise HTTPException(status_code=503, detail="Failed to search conversations")
+    next_offset = offset + limit if len(results) == limit else None
+    return {"results": results, "next_offset": next_offset}
 
 if __name__ == "__main__":
     import uvicorn
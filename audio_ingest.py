@@ -0,0 +1,214 @@
+import asyncio
+import io
+import logging
+import os
+import time
+from typing import NamedTuple, Tuple
+
+import numpy as np
+import soundfile as sf
+
+from concurrency import CPU_WORKER_PROCESSES, run_in_process
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Whisper resamples everything to 16 kHz mono, so anything more is wasted upload
+TRANSCRIPTION_SAMPLE_RATE = int(os.getenv("TRANSCRIPTION_SAMPLE_RATE", "16000"))
+
+# Frames quieter than this, relative to the loudest frame, count as silence
+SILENCE_THRESHOLD_DB = float(os.getenv("SILENCE_THRESHOLD_DB", "-40"))
+SILENCE_FRAME_MS = 20
+SILENCE_PADDING_MS = 200
+SILENCE_MIN_RMS = 1e-4
+
+
+class AudioPayload(NamedTuple):
+    """Audio ready to be sent for transcription"""
+    filename: str
+    data: bytes
+
+
+class PreprocessStats(NamedTuple):
+    input_bytes: int
+    output_bytes: int
+    input_seconds: float
+    output_seconds: float
+    elapsed_ms: float
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.input_bytes - self.output_bytes
+
+
+def decode_audio(data: bytes) -> Tuple[np.ndarray, int]:
+    """Decode audio bytes into float32 samples shaped (frames, channels).
+
+    WAV, FLAC and OGG are decoded by libsndfile. Browser formats such as
+    WebM/Opus and MP4 need PyAV.
+    """
+    try:
+        samples, sample_rate = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+        return samples, sample_rate
+    except Exception as sf_error:
+        try:
+            import av
+        except ImportError:
+            raise ValueError(f"Unsupported audio format: {sf_error}")
+
+    with av.open(io.BytesIO(data)) as container:
+        stream = container.streams.audio[0]
+        # Normalize every frame to planar float32: (channels, samples)
+        resampler = av.AudioResampler(format="fltp")
+        frames = [
+            resampled.to_ndarray()
+            for frame in container.decode(stream)
+            for resampled in resampler.resample(frame)
+        ]
+        frames.extend(resampled.to_ndarray() for resampled in resampler.resample(None))
+        if not frames:
+            raise ValueError("Audio contains no frames")
+        samples = np.concatenate(frames, axis=1).T.astype(np.float32, copy=False)
+        return samples, stream.rate
+
+
+def downmix(samples: np.ndarray) -> np.ndarray:
+    """Average (frames, channels) samples down to a mono signal"""
+    if samples.ndim == 1:
+        return samples
+    return samples.mean(axis=1, dtype=np.float32)
+
+
+def resample(samples: np.ndarray, src_rate: int, dst_rate: int = TRANSCRIPTION_SAMPLE_RATE) -> np.ndarray:
+    """Resample a mono signal with a windowed-sinc low-pass and linear interpolation"""
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+    ratio = dst_rate / src_rate
+    if ratio < 1:
+        # Filter out everything above the new Nyquist frequency to avoid aliasing
+        cutoff = 0.45 * ratio
+        taps = np.arange(-32, 33)
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hanning(len(taps))
+        kernel /= kernel.sum()
+        samples = np.convolve(samples, kernel.astype(np.float32), mode="same")
+    out_length = int(round(len(samples) * ratio))
+    positions = np.arange(out_length, dtype=np.float64) / ratio
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def trim_silence(samples: np.ndarray, sample_rate: int,
+                 threshold_db: float = SILENCE_THRESHOLD_DB) -> np.ndarray:
+    """Cut leading and trailing silence using per-frame RMS energy"""
+    frame = int(sample_rate * SILENCE_FRAME_MS / 1000)
+    frame_count = len(samples) // frame
+    if frame_count == 0:
+        return samples
+
+    frames = samples[:frame_count * frame].reshape(frame_count, frame)
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+    threshold = max(rms.max() * 10 ** (threshold_db / 20), SILENCE_MIN_RMS)
+    voiced = np.flatnonzero(rms > threshold)
+    if voiced.size == 0:
+        # Nothing but silence; let Whisper decide what to make of it
+        return samples
+
+    padding = SILENCE_PADDING_MS // SILENCE_FRAME_MS
+    start = max(voiced[0] - padding, 0) * frame
+    end = len(samples) if voiced[-1] + padding >= frame_count - 1 else (voiced[-1] + padding + 1) * frame
+    return samples[start:end]
+
+
+def encode_wav(samples: np.ndarray, sample_rate: int) -> bytes:
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def encode_opus(samples: np.ndarray, sample_rate: int) -> bytes:
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format="OGG", subtype="OPUS")
+    return buffer.getvalue()
+
+
+def preprocess_for_transcription(data: bytes, filename: str = "audio.webm") -> Tuple[AudioPayload, PreprocessStats]:
+    """Shrink a recording before it is uploaded to Whisper.
+
+    Downmixes to mono, resamples to 16 kHz, trims leading and trailing
+    silence and encodes as Ogg/Opus. The original is kept if the processed
+    audio doesn't come out smaller.
+    """
+    started = time.perf_counter()
+    samples, sample_rate = decode_audio(data)
+    input_seconds = len(samples) / sample_rate
+
+    mono = resample(downmix(samples), sample_rate)
+    trimmed = trim_silence(mono, TRANSCRIPTION_SAMPLE_RATE)
+    encoded = encode_opus(trimmed, TRANSCRIPTION_SAMPLE_RATE)
+
+    if len(encoded) < len(data):
+        payload = AudioPayload("audio.ogg", encoded)
+        output_seconds = len(trimmed) / TRANSCRIPTION_SAMPLE_RATE
+    else:
+        payload = AudioPayload(os.path.basename(filename or "audio.webm"), data)
+        output_seconds = input_seconds
+
+    stats = PreprocessStats(
+        input_bytes=len(data),
+        output_bytes=len(payload.data),
+        input_seconds=input_seconds,
+        output_seconds=output_seconds,
+        elapsed_ms=(time.perf_counter() - started) * 1000
+    )
+    return payload, stats
+
+
+def log_preprocess_stats(stats: PreprocessStats):
+    logger.info(
+        f"Preprocessed audio: {stats.input_bytes} -> {stats.output_bytes} bytes "
+        f"({stats.bytes_saved} saved), {stats.input_seconds:.1f}s -> {stats.output_seconds:.1f}s "
+        f"in {stats.elapsed_ms:.0f}ms"
+    )
+
+
+@timed("audio_preprocess")
+def prepare_audio(data: bytes, filename: str = "audio.webm") -> AudioPayload:
+    """Preprocess audio inline, falling back to the original upload on failure"""
+    if not data:
+        raise ValueError("Empty audio upload")
+    try:
+        payload, stats = preprocess_for_transcription(data, filename)
+        log_preprocess_stats(stats)
+        return payload
+    except Exception as e:
+        logger.warning(f"Could not preprocess {filename}, sending as-is: {str(e)}")
+        return AudioPayload(os.path.basename(filename or "audio.webm"), data)
+
+
+@timed("audio_preprocess")
+async def prepare_audio_async(data: bytes, filename: str = "audio.webm") -> AudioPayload:
+    """Preprocess audio on the process pool so it doesn't hold the event loop or the GIL.
+
+    If the upload can't be decoded locally it is passed through unchanged,
+    since Whisper accepts the common browser formats directly.
+    """
+    if not data:
+        raise ValueError("Empty audio upload")
+    try:
+        payload, stats = await run_in_process(preprocess_for_transcription, data, filename)
+        log_preprocess_stats(stats)
+        return payload
+    except Exception as e:
+        logger.warning(f"Could not preprocess {filename}, sending as-is: {str(e)}")
+        return AudioPayload(os.path.basename(filename or "audio.webm"), data)
+
+
+async def warm_up():
+    """Start the process pool and load the decoders in it before the first upload arrives"""
+    silence = encode_wav(np.zeros(TRANSCRIPTION_SAMPLE_RATE // 10, dtype=np.float32), TRANSCRIPTION_SAMPLE_RATE)
+    try:
+        await asyncio.gather(*(
+            run_in_process(preprocess_for_transcription, silence)
+            for _ in range(CPU_WORKER_PROCESSES)
+        ))
+    except Exception as e:
+        logger.warning(f"Could not pre-warm audio preprocessing: {str(e)}")
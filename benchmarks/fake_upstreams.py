@@ -0,0 +1,349 @@
+"""Local stand-ins for OpenAI, ElevenLabs and Supabase PostgREST.
+
+Serves just enough of each API for app.py to run against it, with a
+configurable simulated latency per upstream, so load tests don't touch
+paid services:
+
+    /openai/v1/...       chat completions (plain, streamed, JSON mode), Whisper, models
+    /elevenlabs/v1/...   text-to-speech, user
+    /supabase/rest/v1/...  user_profiles, conversations and the app's RPCs
+
+Usage:
+    python benchmarks/fake_upstreams.py --port 8100 --chat-latency 800 --jitter 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+app = FastAPI()
+
+# Simulated latency in milliseconds per upstream call, and relative jitter
+latency = {
+    "chat": 800.0,
+    "extraction": 400.0,
+    "whisper": 300.0,
+    "tts": 250.0,
+    "db": 15.0,
+    "first_token": 250.0,
+}
+jitter = 0.25
+
+profiles: Dict[str, Dict] = {}
+conversations: Dict[str, List[Dict]] = {}
+
+REPLY = (
+    "That sounds really difficult, and it makes sense that you feel this way. "
+    "Let's take a moment to look at what happened. What felt hardest about it for you?"
+)
+
+
+async def simulate(kind: str, scale: float = 1.0):
+    base = latency[kind] * scale
+    await asyncio.sleep(max(0.0, random.uniform(base * (1 - jitter), base * (1 + jitter))) / 1000)
+
+
+def now() -> str:
+    return datetime.utcnow().isoformat() + "+00:00"
+
+
+def new_profile(user_id: str) -> Dict:
+    return {
+        "user_id": user_id,
+        "personal_info": {},
+        "relationships": {},
+        "important_events": [],
+        "preferences": {},
+        "goals": [],
+        "conversation_summary": "",
+        "summarized_through": None,
+        "created_at": now(),
+        "updated_at": now(),
+    }
+
+
+def usage(prompt: str, completion: str) -> Dict:
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(completion) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+# Benchmark control
+
+@app.post("/_bench/seed")
+async def seed(request: Request):
+    """Give users a profile and a number of past conversations"""
+    body = await request.json()
+    started = datetime.utcnow() - timedelta(days=30)
+    for user_id in body["users"]:
+        profile = new_profile(user_id)
+        profile["relationships"] = {"Sam": {"role": "partner", "details": "supportive"}}
+        profile["goals"] = ["sleep better", "manage stress at work"]
+        profiles[user_id] = profile
+        conversations[user_id] = [
+            {
+                "id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "user_message": f"Message {i} about work stress, sleep and my partner Sam.",
+                "ai_response": REPLY,
+                "created_at": (started + timedelta(minutes=i)).isoformat() + "+00:00",
+                "metadata": {},
+            }
+            for i in range(body.get("history", 0))
+        ]
+    return {"users": len(body["users"])}
+
+
+@app.post("/_bench/reset")
+async def reset():
+    profiles.clear()
+    conversations.clear()
+    return {}
+
+
+# OpenAI
+
+@app.get("/openai/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "gpt-4-0125-preview", "object": "model"}]}
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "gpt-4-0125-preview")
+    prompt = json.dumps(body.get("messages", []))
+    created = int(time.time())
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        await simulate("extraction")
+        content = json.dumps({"goals": ["feel calmer"]})
+    else:
+        content = REPLY
+
+    if not body.get("stream"):
+        if (body.get("response_format") or {}).get("type") != "json_object":
+            await simulate("chat")
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage(prompt, content),
+        }
+
+    async def events():
+        await simulate("first_token")
+        words = content.split(" ")
+        per_word = max(0.0, latency["chat"] - latency["first_token"]) / max(len(words), 1) / 1000
+        for i, word in enumerate(words):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(per_word)
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        yield f"data: {json.dumps(final)}\n\n"
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield f"data: {json.dumps(dict(final, choices=[], usage=usage(prompt, content)))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/openai/v1/audio/transcriptions")
+async def transcriptions(request: Request):
+    await request.body()
+    await simulate("whisper")
+    return {"text": "I've been feeling stressed about work and I can't sleep."}
+
+
+# ElevenLabs
+
+@app.get("/elevenlabs/v1/user")
+async def elevenlabs_user():
+    return {"subscription": {"tier": "bench"}}
+
+
+@app.post("/elevenlabs/v1/text-to-speech/{voice_id}")
+@app.post("/elevenlabs/v1/text-to-speech/{voice_id}/stream")
+async def text_to_speech(voice_id: str, request: Request):
+    body = await request.json()
+    await simulate("tts", scale=max(1.0, len(body.get("text", "")) / 200))
+    # Roughly 1 KB of 128 kbps MP3 per 15 characters of speech
+    return Response(os.urandom(max(1024, len(body.get("text", "")) * 70)), media_type="audio/mpeg")
+
+
+# Supabase PostgREST
+
+def _filters(request: Request):
+    filters = {}
+    for key, value in request.query_params.items():
+        if key not in ("select", "order", "limit", "offset", "on_conflict", "columns") and value.startswith("eq."):
+            filters[key] = value[3:]
+    return filters
+
+
+def _respond(request: Request, rows: List[Dict], status: int = 200):
+    if "vnd.pgrst.object" in request.headers.get("accept", ""):
+        if len(rows) != 1:
+            return JSONResponse({"code": "PGRST116", "message": "JSON object requested, multiple (or no) rows returned"}, status_code=406)
+        return JSONResponse(rows[0], status_code=status)
+    return JSONResponse(rows, status_code=status)
+
+
+# The keyset filter sent by ProfileManager.get_conversation_page
+KEYSET = re.compile(r'^\(created_at\.lt\."([^"]+)",and\(created_at\.eq\."[^"]+",id\.lt\.([^)]+)\)\)$')
+
+
+def _select(request: Request, rows: List[Dict]) -> List[Dict]:
+    for column, value in request.query_params.multi_items():
+        if value.startswith("lt."):
+            rows = [row for row in rows if (row.get(column) or "") < value[3:]]
+        elif value.startswith("gt."):
+            rows = [row for row in rows if (row.get(column) or "") > value[3:]]
+    keyset = KEYSET.match(request.query_params.get("or", ""))
+    if keyset:
+        before = (keyset.group(1), keyset.group(2))
+        rows = [row for row in rows if (row["created_at"], row["id"]) < before]
+    # Sort by the last order column first, so earlier columns take precedence
+    for term in reversed([term for term in request.query_params.get("order", "").split(",") if term]):
+        column, _, direction = term.partition(".")
+        rows = sorted(rows, key=lambda row: row.get(column) or "", reverse=direction.startswith("desc"))
+    offset = int(request.query_params.get("offset", 0))
+    limit = request.query_params.get("limit")
+    rows = rows[offset:offset + int(limit) if limit else None]
+    select = request.query_params.get("select", "*")
+    if select != "*":
+        columns = [column.strip() for column in select.split(",")]
+        rows = [{column: row.get(column) for column in columns} for row in rows]
+    return rows
+
+
+@app.get("/supabase/rest/v1/{table}")
+async def select_rows(table: str, request: Request):
+    await simulate("db")
+    filters = _filters(request)
+    if table == "user_profiles":
+        rows = [profiles[filters["user_id"]]] if filters.get("user_id") in profiles else []
+    else:
+        rows = list(conversations.get(filters.get("user_id"), []))
+    return _respond(request, _select(request, rows))
+
+
+@app.post("/supabase/rest/v1/rpc/{function}")
+async def rpc(function: str, request: Request):
+    await simulate("db")
+    body = await request.json()
+    user_id = body.get("p_user_id")
+    profile = profiles.setdefault(user_id, new_profile(user_id))
+    if function == "get_chat_context":
+        rows = sorted(conversations.get(user_id, []), key=lambda row: row["created_at"], reverse=True)
+        return {"profile": profile, "conversations": rows[:body.get("p_limit", 5)]}
+    if function == "search_conversations_fts":
+        # Word-count ranking stands in for ts_rank_cd
+        terms = [term for term in re.findall(r"\w+", body.get("p_query", "").lower())]
+        matches = []
+        for row in conversations.get(user_id, []):
+            words = re.findall(r"\w+", (row["user_message"] + " " + row["ai_response"]).lower())
+            rank = sum(words.count(term) for term in terms)
+            if rank:
+                matches.append(dict(row, rank=float(rank), headline=row["user_message"][:80]))
+        matches.sort(key=lambda row: (row["rank"], row["created_at"], row["id"]), reverse=True)
+        offset = body.get("p_offset", 0)
+        return matches[offset:offset + body.get("p_limit", 20)]
+    if function == "merge_user_profile":
+        for field, data in (body.get("p_delta") or {}).items():
+            if isinstance(data, list):
+                current = profile.get(field) or []
+                profile[field] = current + [item for item in data if item not in current]
+            elif isinstance(data, dict):
+                profile[field] = {**profile.get(field, {}), **data}
+        profile["updated_at"] = now()
+        return profile
+    return JSONResponse({"message": f"Unknown function {function}"}, status_code=404)
+
+
+@app.post("/supabase/rest/v1/{table}")
+async def insert_rows(table: str, request: Request):
+    await simulate("db")
+    body = await request.json()
+    rows = body if isinstance(body, list) else [body]
+    prefer = request.headers.get("prefer", "")
+    inserted = []
+    for row in rows:
+        if table == "conversations" and "ignore-duplicates" in prefer and any(
+            existing["id"] == row.get("id") for existing in conversations.get(row["user_id"], [])
+        ):
+            continue
+        if table == "user_profiles":
+            row = {**new_profile(row["user_id"]), **row}
+            profiles[row["user_id"]] = row
+        else:
+            row = {"id": str(uuid.uuid4()), "created_at": now(), "metadata": {}, **row}
+            conversations.setdefault(row["user_id"], []).append(row)
+        inserted.append(row)
+    if "return=minimal" in prefer:
+        return Response(status_code=201)
+    return _respond(request, inserted, status=201)
+
+
+@app.patch("/supabase/rest/v1/{table}")
+async def update_rows(table: str, request: Request):
+    await simulate("db")
+    body = await request.json()
+    user_id = _filters(request).get("user_id")
+    if table == "user_profiles" and user_id in profiles:
+        profiles[user_id].update(body)
+        return _respond(request, [profiles[user_id]])
+    return _respond(request, [])
+
+
+def main():
+    global jitter
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--jitter", type=float, default=jitter, help="relative latency jitter, e.g. 0.25 for +/-25%%")
+    for kind, value in latency.items():
+        parser.add_argument(f"--{kind.replace('_', '-')}-latency", type=float, default=value, help=f"{kind} latency in ms")
+    args = parser.parse_args()
+
+    jitter = args.jitter
+    for kind in latency:
+        latency[kind] = getattr(args, f"{kind}_latency")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""Offline load test for the hot paths of app.py.
+
+Starts benchmarks/fake_upstreams.py and the app under uvicorn, pointed at
+the fakes, then drives /chat, /process-interaction, a page of
+/conversations/{session_id}, a full NDJSON export of it and a full-text
+search at each concurrency level and history size.
+Reports p50/p95/p99 latency and requests per second per run.
+
+Usage:
+    python benchmarks/load_test.py --concurrency 1,8,32 --history 0,50 --duration 15
+    python benchmarks/load_test.py --json results.json
+    python benchmarks/load_test.py --compare results.json --tolerance 0.15
+
+With --compare the run fails if any p95 grew, or requests/sec dropped, by
+more than the tolerance against the baseline file.
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from typing import List, NamedTuple
+
+import httpx
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_UPSTREAMS = os.path.join(ROOT, "benchmarks", "fake_upstreams.py")
+
+# Any JWT-shaped string passes the Supabase client's key check
+FAKE_SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark"
+
+SCENARIOS = ("chat", "process-interaction", "conversations", "conversations-export", "search")
+MESSAGES = (
+    "I couldn't sleep again last night, work keeps going round in my head.",
+    "Sam and I had another argument about chores.",
+    "ok",
+    "I want to start running in the mornings.",
+    "Thanks, that helps.",
+)
+
+
+class RunResult(NamedTuple):
+    scenario: str
+    concurrency: int
+    history: int
+    requests: int
+    errors: int
+    rps: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+
+    def key(self) -> str:
+        return f"{self.scenario}/c{self.concurrency}/h{self.history}"
+
+
+def speech_wav(seconds: float = 2.0, sample_rate: int = 44100) -> bytes:
+    """A stereo 44.1 kHz tone with silence around it, like a browser recording"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        frames = bytearray()
+        total = int(seconds * sample_rate)
+        for i in range(total):
+            voiced = 0.2 * total < i < 0.8 * total
+            value = int(8000 * math.sin(2 * math.pi * 220 * i / sample_rate)) if voiced else 0
+            frames += struct.pack("<hh", value, value)
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+def start_upstreams(args) -> subprocess.Popen:
+    command = [
+        sys.executable, FAKE_UPSTREAMS,
+        "--port", str(args.upstream_port),
+        "--jitter", str(args.jitter),
+        "--chat-latency", str(args.chat_latency),
+        "--extraction-latency", str(args.extraction_latency),
+        "--whisper-latency", str(args.whisper_latency),
+        "--tts-latency", str(args.tts_latency),
+        "--db-latency", str(args.db_latency),
+    ]
+    process = subprocess.Popen(command, cwd=ROOT)
+    wait_until_ready(f"http://127.0.0.1:{args.upstream_port}/openai/v1/models", process)
+    return process
+
+
+def start_app(args, scratch: str) -> subprocess.Popen:
+    upstream = f"http://127.0.0.1:{args.upstream_port}"
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="benchmark",
+        OPENAI_BASE_URL=f"{upstream}/openai/v1",
+        ELEVENLABS_API_KEY="benchmark",
+        ELEVENLABS_BASE_URL=f"{upstream}/elevenlabs",
+        SUPABASE_URL=f"{upstream}/supabase",
+        SUPABASE_SERVICE_ROLE_KEY=FAKE_SUPABASE_KEY,
+        SHARED_CACHE_URL=f"sqlite:///{os.path.join(scratch, 'cache.sqlite3')}",
+        TTS_CACHE_DIR=os.path.join(scratch, "tts"),
+        CONVERSATION_JOURNAL_PATH=os.path.join(scratch, "journal.sqlite3"),
+    )
+    command = [
+        sys.executable, "-m", "uvicorn", "app:app",
+        "--port", str(args.app_port),
+        "--workers", str(args.workers),
+        "--log-level", "warning",
+    ]
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    wait_until_ready(f"http://127.0.0.1:{args.app_port}/metrics", process)
+    return process
+
+
+def seed(args, users: List[str], history: int):
+    upstream = f"http://127.0.0.1:{args.upstream_port}/_bench"
+    httpx.post(f"{upstream}/reset", timeout=30).raise_for_status()
+    httpx.post(f"{upstream}/seed", json={"users": users, "history": history}, timeout=60).raise_for_status()
+
+
+def client_history(history: int) -> str:
+    rows = [
+        {"user_message": f"Message {i} about work stress.", "ai_response": "That sounds hard.", "created_at": f"2024-01-01T00:{i % 60:02d}:00+00:00"}
+        for i in range(history)
+    ]
+    return json.dumps(rows)
+
+
+async def send(client: httpx.AsyncClient, scenario: str, user: str, audio: bytes, history: str) -> httpx.Response:
+    if scenario == "chat":
+        return await client.post("/chat", json={"session_id": user, "message": random.choice(MESSAGES)})
+    if scenario == "process-interaction":
+        params = {"conversation_history": history} if history != "[]" else None
+        return await client.post(
+            "/process-interaction",
+            params=params,
+            files={"audio": ("recording.wav", audio, "audio/wav")}
+        )
+    if scenario == "search":
+        return await client.get(f"/conversations/{user}/search", params={"q": "partner Sam"})
+    if scenario == "conversations-export":
+        return await client.get(f"/conversations/{user}", params={"format": "ndjson"})
+    return await client.get(f"/conversations/{user}")
+
+
+async def run_load(args, scenario: str, concurrency: int, history: int, users: List[str], audio: bytes) -> RunResult:
+    latencies: List[float] = []
+    errors = 0
+    history_json = client_history(min(history, 50))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.app_port}", limits=limits, timeout=120) as client:
+        async def worker(deadline: float, record: bool):
+            nonlocal errors
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await send(client, scenario, random.choice(users), audio, history_json)
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if not record:
+                    continue
+                if ok:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                else:
+                    errors += 1
+
+        # Warm caches and connections before measuring
+        if args.warmup > 0:
+            deadline = time.monotonic() + args.warmup
+            await asyncio.gather(*(worker(deadline, False) for _ in range(concurrency)))
+
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(*(worker(deadline, True) for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    samples = np.array(latencies) if latencies else np.zeros(1)
+    return RunResult(
+        scenario=scenario,
+        concurrency=concurrency,
+        history=history,
+        requests=len(latencies),
+        errors=errors,
+        rps=len(latencies) / elapsed,
+        p50_ms=float(np.percentile(samples, 50)),
+        p95_ms=float(np.percentile(samples, 95)),
+        p99_ms=float(np.percentile(samples, 99)),
+    )
+
+
+def print_table(results: List[RunResult]):
+    header = f"{'scenario':<22}{'conc':>6}{'hist':>6}{'reqs':>8}{'errs':>6}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r.scenario:<22}{r.concurrency:>6}{r.history:>6}{r.requests:>8}{r.errors:>6}"
+            f"{r.rps:>9.1f}{r.p50_ms:>10.1f}{r.p95_ms:>10.1f}{r.p99_ms:>10.1f}"
+        )
+
+
+def compare(results: List[RunResult], baseline_path: str, tolerance: float) -> List[str]:
+    """Describe every run that regressed against the baseline beyond the tolerance"""
+    with open(baseline_path) as f:
+        baseline = {RunResult(**row).key(): RunResult(**row) for row in json.load(f)}
+    regressions = []
+    for result in results:
+        base = baseline.get(result.key())
+        if base is None:
+            continue
+        if result.p95_ms > base.p95_ms * (1 + tolerance):
+            regressions.append(f"{result.key()}: p95 {base.p95_ms:.1f} -> {result.p95_ms:.1f} ms")
+        if result.rps < base.rps * (1 - tolerance):
+            regressions.append(f"{result.key()}: {base.rps:.1f} -> {result.rps:.1f} req/s")
+        if result.errors > base.errors:
+            regressions.append(f"{result.key()}: errors {base.errors} -> {result.errors}")
+    return regressions
+
+
+def parse_ints(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=parse_ints, default=[1, 8, 32])
+    parser.add_argument("--history", type=parse_ints, default=[0, 50], help="past conversations per user")
+    parser.add_argument("--duration", type=float, default=15, help="seconds measured per run")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before each run")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the app")
+    parser.add_argument("--app-port", type=int, default=8200)
+    parser.add_argument("--upstream-port", type=int, default=8100)
+    parser.add_argument("--jitter", type=float, default=0.25)
+    parser.add_argument("--chat-latency", type=float, default=800)
+    parser.add_argument("--extraction-latency", type=float, default=400)
+    parser.add_argument("--whisper-latency", type=float, default=300)
+    parser.add_argument("--tts-latency", type=float, default=250)
+    parser.add_argument("--db-latency", type=float, default=15)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="baseline results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    scenarios = [scenario for scenario in args.scenarios.split(",") if scenario]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    audio = speech_wav()
+    results: List[RunResult] = []
+    processes: List[subprocess.Popen] = []
+    with tempfile.TemporaryDirectory() as scratch:
+        try:
+            processes.append(start_upstreams(args))
+            processes.append(start_app(args, scratch))
+            for history in args.history:
+                # Fresh users per history size so cached profiles don't carry over
+                users = [f"bench-{history}-{i}" for i in range(args.users)]
+                seed(args, users, history)
+                for scenario in scenarios:
+                    for concurrency in args.concurrency:
+                        result = asyncio.run(run_load(args, scenario, concurrency, history, users, audio))
+                        print(f"{result.key()}: {result.rps:.1f} req/s, p95 {result.p95_ms:.1f} ms", file=sys.stderr)
+                        results.append(result)
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([result._asdict() for result in results], f, indent=2)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print("\nRegressions beyond tolerance:")
+            for regression in regressions:
+                print(f"- {regression}")
+            return 1
+        print("\nNo regressions beyond tolerance")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+
+import httpx
+from dotenv import load_dotenv
+from elevenlabs.client import ElevenLabs
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+from supabase import ClientOptions, create_client
+
+from concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Connection pool limits for each upstream (OpenAI, ElevenLabs, Supabase)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+
+# Open connections to every upstream at startup so the first request doesn't pay for them
+PREWARM_CLIENTS = os.getenv("PREWARM_CLIENTS", "true").lower() in ("1", "true", "yes")
+PREWARM_TIMEOUT = float(os.getenv("PREWARM_TIMEOUT", "10"))
+
+elevenlabs_api_key = os.getenv("ELEVENLABS_API_KEY")
+# Overrides the ElevenLabs API address, e.g. to point at benchmarks/fake_upstreams.py
+elevenlabs_base_url = os.getenv("ELEVENLABS_BASE_URL") or None
+openai_api_key = os.getenv("OPENAI_API_KEY")
+supabase_url = os.getenv("SUPABASE_URL")
+supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+if not openai_api_key:
+    raise ValueError("Missing OpenAI API key. Please check your .env file.")
+if not supabase_url or not supabase_key:
+    raise ValueError("Missing Supabase credentials. Please check your .env file")
+
+
+def pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+
+
+def pool_timeout(read: float) -> httpx.Timeout:
+    return httpx.Timeout(read, connect=HTTP_CONNECT_TIMEOUT)
+
+
+# One pooled client per upstream, shared by every module in this worker
+openai_client = OpenAI(
+    api_key=openai_api_key,
+    http_client=DefaultHttpxClient(limits=pool_limits(), timeout=pool_timeout(600))
+)
+async_openai_client = AsyncOpenAI(
+    api_key=openai_api_key,
+    http_client=DefaultAsyncHttpxClient(limits=pool_limits(), timeout=pool_timeout(600))
+)
+_elevenlabs_http = httpx.Client(limits=pool_limits(), timeout=pool_timeout(240), follow_redirects=True)
+elevenlabs_client = ElevenLabs(api_key=elevenlabs_api_key, base_url=elevenlabs_base_url, httpx_client=_elevenlabs_http)
+_supabase_http = httpx.Client(limits=pool_limits(), timeout=pool_timeout(120))
+supabase = create_client(supabase_url, supabase_key, options=ClientOptions(httpx_client=_supabase_http))
+
+
+def _warm_openai():
+    openai_client.with_options(timeout=PREWARM_TIMEOUT, max_retries=0).models.list()
+
+
+def _warm_elevenlabs():
+    elevenlabs_client.user.get(request_options={"timeout_in_seconds": int(PREWARM_TIMEOUT), "max_retries": 0})
+
+
+def _warm_supabase():
+    supabase.table('user_profiles').select('user_id').limit(1).execute()
+
+
+async def _warm_async_openai():
+    await async_openai_client.with_options(timeout=PREWARM_TIMEOUT, max_retries=0).models.list()
+
+
+async def warm_up():
+    """Open a connection to each upstream with a cheap request.
+
+    Failures are only logged: any response, even an error, has already
+    paid for DNS, TCP and TLS on the pooled connection.
+    """
+    names = ["openai", "openai (async)", "elevenlabs", "supabase"]
+    results = await asyncio.gather(
+        run_blocking(_warm_openai),
+        _warm_async_openai(),
+        run_blocking(_warm_elevenlabs),
+        run_blocking(_warm_supabase),
+        return_exceptions=True
+    )
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not pre-warm {name} client: {str(result)}")
+    warmed = sum(not isinstance(result, Exception) for result in results)
+    logger.info(f"Pre-warmed {warmed}/{len(names)} API clients")
+
+
+async def close():
+    """Close the pooled connections of every client"""
+    openai_client.close()
+    await async_openai_client.close()
+    _elevenlabs_http.close()
+    _supabase_http.close()
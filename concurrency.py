@@ -0,0 +1,66 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of requests a single worker keeps in flight against the upstream APIs
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "64"))
+
+# Size of the thread pool used for blocking calls (Supabase client, audio conversion)
+BLOCKING_IO_THREADS = int(os.getenv("BLOCKING_IO_THREADS", "32"))
+
+# Size of the process pool used for CPU-bound work such as audio decoding
+CPU_WORKER_PROCESSES = int(os.getenv("CPU_WORKER_PROCESSES", "2"))
+
+_executor = ThreadPoolExecutor(
+    max_workers=BLOCKING_IO_THREADS,
+    thread_name_prefix="thera-io"
+)
+_process_pool: Optional[ProcessPoolExecutor] = None
+_request_slots: Optional[asyncio.Semaphore] = None
+
+
+def request_slots() -> asyncio.Semaphore:
+    """Get the semaphore limiting concurrent upstream work in this worker.
+
+    Created lazily so it binds to the running event loop rather than
+    whatever loop existed at import time.
+    """
+    global _request_slots
+    if _request_slots is None:
+        _request_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return _request_slots
+
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking callable on the bounded I/O thread pool, in the caller's context"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+async def run_in_process(func: Callable[..., Any], *args) -> Any:
+    """Run a CPU-bound, picklable callable on the worker process pool"""
+    global _process_pool
+    if _process_pool is None:
+        # Spawn rather than fork: the server process has threads running
+        _process_pool = ProcessPoolExecutor(
+            max_workers=CPU_WORKER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_process_pool, func, *args)
+
+
+def shutdown():
+    """Wait for outstanding blocking calls and release the worker pools"""
+    logger.info("Shutting down blocking I/O thread pool")
+    _executor.shutdown(wait=True)
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True)
@@ -0,0 +1,160 @@
+import logging
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from conversation import ChatContext, chronological, history_from_rows, parse_timestamp
+from memory_index import MEMORY_TOP_K
+from profile_manager import PROFILE_SECTION_MAX_ITEMS, ProfileManager
+
+logger = logging.getLogger(__name__)
+
+# Tokens available for profile, summary, history and the new message combined
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+
+# Share of the budget the profile may take before its sections are trimmed further
+PROFILE_TOKEN_SHARE = float(os.getenv("PROFILE_TOKEN_SHARE", "0.35"))
+
+# Share of what's left after the profile that relevant past exchanges may use
+MEMORY_TOKEN_SHARE = float(os.getenv("MEMORY_TOKEN_SHARE", "0.3"))
+
+# Conversations fetched per turn; those that don't fit are folded into the summary
+HISTORY_FETCH_LIMIT = int(os.getenv("HISTORY_FETCH_LIMIT", "10"))
+
+# Unsummarized conversations collected before the summary is updated. This many more than
+# HISTORY_FETCH_LIMIT are fetched, so the rows collecting beyond the window are seen without another read
+SUMMARY_BATCH_SIZE = max(1, int(os.getenv("SUMMARY_BATCH_SIZE", "5")))
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Count tokens with tiktoken when available, otherwise ~4 characters per token"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def _profile_context_within(profile: Dict, cached_context: str, budget: int) -> str:
+    context = cached_context
+    max_items = PROFILE_SECTION_MAX_ITEMS
+    while estimate_tokens(context) > budget and max_items > 1:
+        max_items //= 2
+        context = ProfileManager.format_profile_context(profile, max_items)
+    return context
+
+
+def _format_memories(memories: Sequence[Dict], budget: int) -> str:
+    lines = []
+    for memory in memories:
+        line = (
+            f"- {(memory.get('created_at') or '')[:10]} User: {memory.get('user_message') or ''}\n"
+            f"  You: {memory.get('ai_response') or ''}"
+        )
+        cost = estimate_tokens(line)
+        if cost > budget:
+            continue
+        budget -= cost
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def build_context(profile: Dict, rows: List[Dict], user_message: str,
+                  profile_context: str, memories: Sequence[Dict] = (),
+                  budget: int = PROMPT_TOKEN_BUDGET) -> Tuple[ChatContext, List[Dict]]:
+    """Fit profile, rolling summary, relevant past exchanges and recent turns into a token budget.
+
+    The newest exchanges are kept whole for as long as they fit; rows
+    without timestamps, like a client's history, are taken to be oldest
+    first. The profile is trimmed to its most recent entries. Memories are searched
+    past conversations, best first; those already in the recent history
+    are skipped. Returns the context and the conversation rows that didn't
+    fit, oldest first, so they can be folded into the summary.
+    """
+    remaining = budget - estimate_tokens(user_message)
+
+    summary = profile.get('conversation_summary') or ""
+    if summary:
+        remaining -= estimate_tokens(summary)
+
+    profile_context = _profile_context_within(
+        profile,
+        profile_context,
+        max(0, int(remaining * PROFILE_TOKEN_SHARE))
+    )
+    remaining -= estimate_tokens(profile_context)
+
+    if summary:
+        profile_context = f"{profile_context}\n\nSummary of Earlier Conversations:\n{summary}".strip()
+
+    memory_budget = max(0, int(remaining * MEMORY_TOKEN_SHARE))
+    remaining -= memory_budget
+
+    # Newest first, so the budget goes to the latest exchanges
+    rows = chronological(rows)[::-1]
+    included = 0
+    for row in rows:
+        cost = estimate_tokens(row.get('user_message') or "") + estimate_tokens(row.get('ai_response') or "")
+        if cost > remaining:
+            break
+        remaining -= cost
+        included += 1
+
+    recent_ids = {row.get('id') for row in rows[:included]}
+    relevant = _format_memories(
+        [memory for memory in memories if memory.get('id') not in recent_ids][:MEMORY_TOP_K],
+        memory_budget
+    )
+    if relevant:
+        profile_context = f"{profile_context}\n\nRelevant Past Conversations:\n{relevant}".strip()
+
+    history = history_from_rows(rows[:included][::-1])
+    overflow = list(reversed(rows[included:]))
+    return ChatContext(history, profile_context, profile), overflow
+
+
+def unsummarized(profile: Dict, rows: List[Dict]) -> List[Dict]:
+    """Rows that haven't been folded into the user's rolling summary yet"""
+    through = parse_timestamp(profile.get('summarized_through'))
+    return [
+        row for row in rows
+        if row.get('created_at') and (through is None or parse_timestamp(row['created_at']) > through)
+    ]
+
+
+def summary_due(profile: Dict, overflow: List[Dict], older: List[Dict],
+                batch_size: int = SUMMARY_BATCH_SIZE) -> List[Dict]:
+    """Unsummarized rows that overflowed the budget or fell out of the window, once enough have collected.
+
+    older is the fetched rows beyond the window, newest first, and overflow
+    is build_context's, oldest first; the result is oldest first. Each
+    summary update costs a completion and a profile write, so with fewer
+    than batch_size rows waiting nothing is returned.
+    """
+    pending = unsummarized(profile, list(reversed(older)) + list(overflow))
+    return pending if len(pending) >= batch_size else []
+
+
+def summary_backlog_before(profile: Dict, rows: List[Dict],
+                           fetch_limit: int = HISTORY_FETCH_LIMIT + SUMMARY_BATCH_SIZE) -> Optional[str]:
+    """created_at of the oldest fetched row if older rows may still need summarizing.
+
+    Once the fetch is full, every new turn pushes the oldest row out of it,
+    whether or not it overflowed the budget. Those rows are no longer
+    fetched, so they have to be read back to be folded into the summary.
+    """
+    if len(rows) < fetch_limit:
+        return None
+    oldest = min(
+        (row for row in rows if row.get('created_at')),
+        key=lambda row: parse_timestamp(row['created_at']),
+        default=None
+    )
+    if oldest is None or not unsummarized(profile, [oldest]):
+        return None
+    return oldest['created_at']
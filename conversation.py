@@ -0,0 +1,74 @@
+import re
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+_FRACTION = re.compile(r"\.(\d+)")
+_SHORT_OFFSET = re.compile(r"([+-]\d{2})$")
+
+
+class Turn:
+    """A single chat message in a conversation history"""
+
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+
+    def to_message(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+    def __repr__(self) -> str:
+        return f"Turn({self.role!r}, {self.content!r})"
+
+
+class ChatContext(NamedTuple):
+    """Everything needed to generate a reply for one user turn"""
+    history: List[Turn]
+    profile_context: str
+    profile: Dict
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parse a timestamp from the database or the journal as an aware UTC datetime.
+
+    Handles what Postgres returns but fromisoformat doesn't accept, such as
+    fractions shorter than 6 digits and +00 offsets. Naive values are UTC.
+    """
+    if not value:
+        return None
+    text = value.strip().replace(" ", "T", 1).replace("Z", "+00:00")
+    text = _FRACTION.sub(lambda m: "." + m.group(1)[:6].ljust(6, "0"), text, count=1)
+    text = _SHORT_OFFSET.sub(r"\1:00", text)
+    parsed = datetime.fromisoformat(text)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def chronological(rows: Iterable[Dict]) -> List[Dict]:
+    """Conversations rows, oldest first.
+
+    Rows are sorted by created_at when every row has a valid one, since the
+    database returns them newest first. Otherwise, as with history sent by
+    a client, they are taken to be in chronological order already.
+    """
+    rows = list(rows)
+    try:
+        times = [parse_timestamp(row.get('created_at')) for row in rows]
+    except (AttributeError, TypeError, ValueError):
+        return rows
+    if not all(times):
+        return rows
+    return [row for _, row in sorted(zip(times, rows), key=lambda pair: pair[0])]
+
+
+def history_from_rows(rows: Iterable[Dict]) -> List[Turn]:
+    """Build chronological turns from conversations rows"""
+    history = []
+    for row in chronological(rows):
+        if row.get('user_message'):
+            history.append(Turn("user", row['user_message']))
+        if row.get('ai_response'):
+            history.append(Turn("assistant", row['ai_response']))
+    return history
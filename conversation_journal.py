@@ -0,0 +1,323 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from postgrest.exceptions import APIError
+
+from clients import supabase
+from concurrency import run_blocking
+from conversation import parse_timestamp
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Local SQLite file holding conversation turns until they are written to Supabase
+CONVERSATION_JOURNAL_PATH = os.getenv(
+    "CONVERSATION_JOURNAL_PATH",
+    os.path.join(tempfile.gettempdir(), "thera_ai_journal.sqlite3")
+)
+# Pending turns are inserted in one request once this many are journaled, or after the interval
+CONVERSATION_FLUSH_BATCH_SIZE = int(os.getenv("CONVERSATION_FLUSH_BATCH_SIZE", "50"))
+CONVERSATION_FLUSH_INTERVAL_MS = int(os.getenv("CONVERSATION_FLUSH_INTERVAL_MS", "500"))
+CONVERSATION_FLUSH_DRAIN_TIMEOUT = float(os.getenv("CONVERSATION_FLUSH_DRAIN_TIMEOUT", "30"))
+
+
+def is_data_error(error: Exception) -> bool:
+    """Whether the database refused the rows themselves, so retrying them can't succeed.
+
+    Covers Postgres data exceptions (class 22, such as a malformed UUID) and
+    integrity constraint violations (class 23, such as an unknown user).
+    """
+    return isinstance(error, APIError) and (error.code or "")[:2] in ("22", "23")
+
+
+def merge_pending(rows: List[Dict], pending: List[Dict], limit: int) -> List[Dict]:
+    """Combine database rows with journaled ones, newest first and without duplicates"""
+    if not pending:
+        return rows[:limit]
+    merged = {row['id']: row for row in rows if row.get('id')}
+    merged.update((row['id'], row) for row in pending)
+    merged_rows = list(merged.values()) + [row for row in rows if not row.get('id')]
+    # Database and journal timestamps differ in precision, so compare them as times
+    oldest = datetime.min.replace(tzinfo=timezone.utc)
+    merged_rows.sort(
+        key=lambda row: (parse_timestamp(row.get('created_at')) or oldest, row.get('id') or ''),
+        reverse=True
+    )
+    return merged_rows[:limit]
+
+
+class ConversationJournal:
+    """Write-behind store for conversation turns.
+
+    Turns are committed to a local SQLite journal and acknowledged straight
+    away, then a background task inserts them into Supabase in multi-row
+    batches. Every worker on the host shares the journal: a worker claims a
+    batch with a lease before inserting it, so batches left behind by a
+    crashed worker are retried once their lease runs out. Turns carry their
+    own id and inserts ignore ids already present, so a batch that was
+    inserted but not yet removed from the journal is never duplicated.
+
+    When the database rejects a batch because of its data, the rows are
+    retried one at a time and those it still refuses are moved to a
+    dead-letter table, so one bad row can't hold up everyone else's.
+    """
+
+    CLAIM_LEASE = 30
+
+    def __init__(self, path: str = CONVERSATION_JOURNAL_PATH,
+                 batch_size: int = CONVERSATION_FLUSH_BATCH_SIZE,
+                 interval_ms: int = CONVERSATION_FLUSH_INTERVAL_MS):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.interval = interval_ms / 1000
+        self.flushed = 0
+        self.batches = 0
+        self.errors = 0
+        self._appended = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pending_conversations (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    row TEXT NOT NULL,
+                    claimed_until REAL NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS pending_conversations_user
+                ON pending_conversations (user_id, created_at)
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS failed_conversations (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    row TEXT NOT NULL,
+                    error TEXT NOT NULL,
+                    failed_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Acknowledged turns must survive a crash, so sync every commit
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def append(self, user_id: str, user_message: str, ai_response: str) -> Dict:
+        """Journal a conversation turn and return it as it will be stored"""
+        conversation = {
+            'id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'user_message': user_message,
+            'ai_response': ai_response,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'metadata': {}
+        }
+        self._connect().execute(
+            "INSERT INTO pending_conversations (id, user_id, created_at, row) VALUES (?, ?, ?, ?)",
+            (conversation['id'], user_id, conversation['created_at'], json.dumps(conversation))
+        )
+        with self._lock:
+            self._appended += 1
+            full = self._appended >= self.batch_size
+        if full and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        return conversation
+
+    def pending(self, user_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """A user's turns not yet written to the database, newest first"""
+        try:
+            rows = self._connect().execute(
+                "SELECT row FROM pending_conversations WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+                (user_id, -1 if limit is None else limit)
+            ).fetchall()
+            return [json.loads(row[0]) for row in rows]
+        except Exception as e:
+            logger.error(f"Error reading conversation journal: {str(e)}")
+            return []
+
+    def depth(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM pending_conversations").fetchone()[0]
+
+    def _claim(self) -> List[Tuple[str, Dict]]:
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, row FROM pending_conversations WHERE claimed_until < ? ORDER BY created_at LIMIT ?",
+                (now, self.batch_size)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE pending_conversations SET claimed_until = ? WHERE id = ?",
+                [(now + self.CLAIM_LEASE, row_id) for row_id, _ in rows]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [(row_id, json.loads(row)) for row_id, row in rows]
+
+    def _release(self, ids: List[str], delete: bool):
+        placeholders = ",".join("?" * len(ids))
+        if delete:
+            sql = f"DELETE FROM pending_conversations WHERE id IN ({placeholders})"
+        else:
+            sql = f"UPDATE pending_conversations SET claimed_until = 0 WHERE id IN ({placeholders})"
+        self._connect().execute(sql, ids)
+
+    def _dead_letter(self, row_id: str, error: str):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO failed_conversations (id, user_id, created_at, row, error, failed_at)
+                SELECT id, user_id, created_at, row, ?, ? FROM pending_conversations WHERE id = ?
+                """,
+                (error, time.time(), row_id)
+            )
+            conn.execute("DELETE FROM pending_conversations WHERE id = ?", (row_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _insert(self, rows: List[Dict]):
+        with stage("conversation_flush"):
+            supabase.table('conversations')\
+                .upsert(rows, on_conflict='id', ignore_duplicates=True, returning='minimal')\
+                .execute()
+
+    def _insert_each(self, claimed: List[Tuple[str, Dict]]) -> Tuple[int, bool]:
+        """Insert a rejected batch row by row, dead-lettering the rows the database refuses.
+
+        Returns how many rows were inserted and whether the whole batch was
+        dealt with; a failure that isn't about the data releases the rest.
+        """
+        inserted = 0
+        for index, (row_id, row) in enumerate(claimed):
+            try:
+                self._insert([row])
+            except Exception as e:
+                if not is_data_error(e):
+                    logger.error(f"Error flushing journaled conversation: {str(e)}")
+                    self._release([rest_id for rest_id, _ in claimed[index:]], delete=False)
+                    return inserted, False
+                logger.error(f"Moving conversation {row_id} to the dead-letter table: {str(e)}")
+                self._dead_letter(row_id, str(e))
+                continue
+            self._release([row_id], delete=True)
+            inserted += 1
+        return inserted, True
+
+    def flush(self) -> int:
+        """Insert every unclaimed journaled turn into the database, one batch at a time"""
+        with self._lock:
+            self._appended = 0
+        flushed = 0
+        while True:
+            try:
+                claimed = self._claim()
+            except Exception as e:
+                logger.error(f"Error claiming journaled conversations: {str(e)}")
+                return flushed
+            if not claimed:
+                return flushed
+            ids = [row_id for row_id, _ in claimed]
+            try:
+                self._insert([row for _, row in claimed])
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error flushing {len(claimed)} journaled conversations: {str(e)}")
+                if not is_data_error(e):
+                    self._release(ids, delete=False)
+                    return flushed
+                inserted, complete = self._insert_each(claimed)
+                flushed += inserted
+                self.flushed += inserted
+                if not complete:
+                    return flushed
+                continue
+            self._release(ids, delete=True)
+            flushed += len(claimed)
+            self.flushed += len(claimed)
+            self.batches += 1
+
+    def start(self):
+        """Start flushing in the background, beginning with anything left from a previous run"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        leftover = self.depth()
+        if leftover:
+            logger.info(f"Replaying {leftover} journaled conversations")
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await run_blocking(self.flush)
+            except Exception as e:
+                logger.error(f"Error flushing conversation journal: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def drain(self, timeout: float = CONVERSATION_FLUSH_DRAIN_TIMEOUT):
+        """Stop the background task and write out every pending turn"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._loop = None
+        logger.info(f"Flushing conversation journal ({self.depth()} pending)")
+        try:
+            await asyncio.wait_for(run_blocking(self.flush), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Conversation journal did not flush within {timeout}s")
+        remaining = self.depth()
+        if remaining:
+            logger.warning(f"{remaining} conversations left in the journal for the next start")
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "pending": self.depth(),
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "errors": self.errors,
+            "dead_lettered": self._connect().execute("SELECT COUNT(*) FROM failed_conversations").fetchone()[0],
+            "rows_per_batch": self.flushed / self.batches if self.batches else 0.0
+        }
+
+
+conversation_journal = ConversationJournal()
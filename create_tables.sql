@@ -16,6 +16,19 @@ CREATE TABLE IF NOT EXISTS conversations (
     metadata JSONB DEFAULT '{}'::jsonb
 );
 
+-- Each user's history newest first, and keyset pagination on (created_at, id)
+CREATE INDEX IF NOT EXISTS conversations_user_created_at_idx
+    ON conversations (user_id, created_at DESC, id DESC);
+
+-- Full-text search over both sides of each conversation; the user's own words rank higher
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(user_message, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(ai_response, '')), 'B')
+    ) STORED;
+CREATE INDEX IF NOT EXISTS conversations_search_idx
+    ON conversations USING GIN (search_vector);
+
 -- Create user_profiles table
 CREATE TABLE IF NOT EXISTS user_profiles (
     user_id UUID REFERENCES auth.users(id) ON DELETE CASCADE PRIMARY KEY,
@@ -24,10 +37,16 @@ CREATE TABLE IF NOT EXISTS user_profiles (
     important_events JSONB DEFAULT '[]'::jsonb,
     preferences JSONB DEFAULT '{}'::jsonb,
     goals JSONB DEFAULT '[]'::jsonb,
+    conversation_summary TEXT DEFAULT '',
+    summarized_through TIMESTAMP WITH TIME ZONE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT timezone('utc'::text, now()),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT timezone('utc'::text, now())
 );
 
+-- Rolling summary of conversations that no longer fit in the prompt
+ALTER TABLE user_profiles ADD COLUMN IF NOT EXISTS conversation_summary TEXT DEFAULT '';
+ALTER TABLE user_profiles ADD COLUMN IF NOT EXISTS summarized_through TIMESTAMP WITH TIME ZONE;
+
 -- Create function to automatically update updated_at timestamp
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
@@ -44,6 +63,194 @@ CREATE TRIGGER update_user_profiles_updated_at
     FOR EACH ROW
     EXECUTE FUNCTION update_updated_at_column();
 
+-- Fetch a user's profile and most recent conversations in a single round trip,
+-- creating an empty profile first if the user doesn't have one yet
+CREATE OR REPLACE FUNCTION get_chat_context(p_user_id UUID, p_limit INTEGER DEFAULT 5)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_profile JSONB;
+    v_conversations JSONB;
+BEGIN
+    SELECT to_jsonb(p) INTO v_profile
+    FROM public.user_profiles p
+    WHERE p.user_id = p_user_id;
+
+    IF v_profile IS NULL THEN
+        INSERT INTO public.user_profiles (user_id)
+        VALUES (p_user_id)
+        ON CONFLICT (user_id) DO NOTHING;
+
+        SELECT to_jsonb(p) INTO v_profile
+        FROM public.user_profiles p
+        WHERE p.user_id = p_user_id;
+    END IF;
+
+    SELECT COALESCE(jsonb_agg(to_jsonb(c) - 'search_vector' ORDER BY c.created_at DESC), '[]'::jsonb)
+    INTO v_conversations
+    FROM (
+        SELECT *
+        FROM public.conversations
+        WHERE user_id = p_user_id
+        ORDER BY created_at DESC
+        LIMIT p_limit
+    ) c;
+
+    RETURN jsonb_build_object(
+        'profile', v_profile,
+        'conversations', v_conversations
+    );
+END;
+$$;
+
+-- Ranked full-text search of one user's conversations, best match first.
+-- p_query takes web search syntax: "quoted phrases", OR and -excluded words.
+-- Only the requested page gets a highlighted headline.
+-- Named apart from ProfileManager.search_conversations, which is the embedding recall.
+DROP FUNCTION IF EXISTS search_conversations(UUID, TEXT, INTEGER, INTEGER);
+CREATE OR REPLACE FUNCTION search_conversations_fts(
+    p_user_id UUID,
+    p_query TEXT,
+    p_limit INTEGER DEFAULT 20,
+    p_offset INTEGER DEFAULT 0
+)
+RETURNS TABLE (
+    id UUID,
+    user_message TEXT,
+    ai_response TEXT,
+    created_at TIMESTAMP WITH TIME ZONE,
+    rank REAL,
+    headline TEXT
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT m.id, m.user_message, m.ai_response, m.created_at, m.rank,
+           ts_headline('english', m.user_message || ' ' || m.ai_response, m.query,
+                       'MaxFragments=2, MaxWords=20, MinWords=5')
+    FROM (
+        SELECT c.id, c.user_message, c.ai_response, c.created_at, q.query,
+               ts_rank_cd(c.search_vector, q.query) AS rank
+        FROM public.conversations c,
+             websearch_to_tsquery('english', p_query) AS q(query)
+        WHERE c.user_id = p_user_id
+          AND c.search_vector @@ q.query
+        ORDER BY rank DESC, c.created_at DESC, c.id DESC
+        LIMIT p_limit
+        OFFSET p_offset
+    ) m
+    ORDER BY m.rank DESC, m.created_at DESC, m.id DESC;
+$$;
+
+-- Append the items of p_new that aren't already in p_current
+CREATE OR REPLACE FUNCTION jsonb_array_union(p_current JSONB, p_new JSONB)
+RETURNS JSONB
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(p_new) IS DISTINCT FROM 'array' THEN COALESCE(p_current, '[]'::jsonb)
+        ELSE COALESCE(p_current, '[]'::jsonb) || COALESCE((
+            SELECT jsonb_agg(n.item ORDER BY n.ord)
+            FROM (
+                SELECT item, ord, row_number() OVER (PARTITION BY item ORDER BY ord) AS rn
+                FROM jsonb_array_elements(p_new) WITH ORDINALITY AS t(item, ord)
+            ) n
+            WHERE n.rn = 1
+              AND NOT EXISTS (
+                  SELECT 1
+                  FROM jsonb_array_elements(COALESCE(p_current, '[]'::jsonb)) AS c(item)
+                  WHERE c.item = n.item
+              )
+        ), '[]'::jsonb)
+    END;
+$$;
+
+-- Merge p_new into p_current: nested objects are merged, nested lists are
+-- unioned and any other value is replaced
+CREATE OR REPLACE FUNCTION jsonb_merge_object(p_current JSONB, p_new JSONB)
+RETURNS JSONB
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(p_new) IS DISTINCT FROM 'object' THEN COALESCE(p_current, '{}'::jsonb)
+        ELSE COALESCE(p_current, '{}'::jsonb) || COALESCE((
+            SELECT jsonb_object_agg(
+                n.key,
+                CASE
+                    WHEN jsonb_typeof(p_current -> n.key) = 'object' AND jsonb_typeof(n.value) = 'object'
+                        THEN (p_current -> n.key) || n.value
+                    WHEN jsonb_typeof(p_current -> n.key) = 'array'
+                        THEN jsonb_array_union(p_current -> n.key, n.value)
+                    ELSE n.value
+                END
+            )
+            FROM jsonb_each(p_new) n
+        ), '{}'::jsonb)
+    END;
+$$;
+
+-- Merge relationship details, keeping replaced details in previous_details
+-- and stamping every mentioned person with last_discussed
+CREATE OR REPLACE FUNCTION jsonb_merge_relationships(p_current JSONB, p_new JSONB)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(p_new) IS DISTINCT FROM 'object' THEN COALESCE(p_current, '{}'::jsonb)
+        ELSE COALESCE(p_current, '{}'::jsonb) || COALESCE((
+            SELECT jsonb_object_agg(
+                n.key,
+                CASE
+                    WHEN jsonb_typeof(p_current -> n.key) = 'object' THEN
+                        (p_current -> n.key) || n.value || CASE
+                            WHEN n.value ? 'details'
+                                 AND (p_current -> n.key) ? 'details'
+                                 AND (p_current -> n.key -> 'details') <> (n.value -> 'details')
+                            THEN jsonb_build_object('previous_details', jsonb_array_union(
+                                p_current -> n.key -> 'previous_details',
+                                jsonb_build_array(p_current -> n.key -> 'details')
+                            ))
+                            ELSE '{}'::jsonb
+                        END
+                    ELSE n.value
+                END || jsonb_build_object('last_discussed', timezone('utc'::text, now()))
+            )
+            FROM jsonb_each(p_new) n
+            WHERE jsonb_typeof(n.value) = 'object'
+        ), '{}'::jsonb)
+    END;
+$$;
+
+-- Apply an extracted profile delta in a single atomic UPDATE. Concurrent
+-- merges for the same user serialize on the row lock, so none are lost.
+CREATE OR REPLACE FUNCTION merge_user_profile(p_user_id UUID, p_delta JSONB)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_profile JSONB;
+BEGIN
+    INSERT INTO public.user_profiles (user_id)
+    VALUES (p_user_id)
+    ON CONFLICT (user_id) DO NOTHING;
+
+    UPDATE public.user_profiles p
+    SET personal_info = jsonb_merge_object(p.personal_info, p_delta -> 'personal_info'),
+        relationships = jsonb_merge_relationships(p.relationships, p_delta -> 'relationships'),
+        important_events = jsonb_array_union(p.important_events, p_delta -> 'important_events'),
+        preferences = jsonb_merge_object(p.preferences, p_delta -> 'preferences'),
+        goals = jsonb_array_union(p.goals, p_delta -> 'goals')
+    WHERE p.user_id = p_user_id
+    RETURNING to_jsonb(p) INTO v_profile;
+
+    RETURN v_profile;
+END;
+$$;
+
 -- Set up row level security (RLS)
 ALTER TABLE public.conversations ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.user_profiles ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from concurrency import run_blocking
+from profile_manager import ProfileManager
+
+logger = logging.getLogger(__name__)
+
+PROFILE_EXTRACTION_WORKERS = int(os.getenv("PROFILE_EXTRACTION_WORKERS", "4"))
+PROFILE_EXTRACTION_QUEUE_DEPTH = int(os.getenv("PROFILE_EXTRACTION_QUEUE_DEPTH", "1000"))
+PROFILE_EXTRACTION_DRAIN_TIMEOUT = float(os.getenv("PROFILE_EXTRACTION_DRAIN_TIMEOUT", "30"))
+
+# A user's messages are collected for this long, or up to the batch size, before one extraction
+PROFILE_EXTRACTION_BATCH_WINDOW_MS = int(os.getenv("PROFILE_EXTRACTION_BATCH_WINDOW_MS", "2000"))
+PROFILE_EXTRACTION_BATCH_SIZE = int(os.getenv("PROFILE_EXTRACTION_BATCH_SIZE", "8"))
+
+
+class ProfileExtractionQueue:
+    """Background pipeline that updates user profiles from chat messages.
+
+    Jobs are sharded across workers by user_id, so each user's profile
+    updates and summaries run one at a time and in the order they were
+    submitted. Consecutive messages from a user are batched into a single
+    extraction within a short window; summary jobs queued in between run
+    without closing the batch.
+    """
+
+    def __init__(self, num_workers: int = PROFILE_EXTRACTION_WORKERS,
+                 max_depth: int = PROFILE_EXTRACTION_QUEUE_DEPTH,
+                 batch_window_ms: int = PROFILE_EXTRACTION_BATCH_WINDOW_MS,
+                 batch_size: int = PROFILE_EXTRACTION_BATCH_SIZE):
+        self.num_workers = max(1, num_workers)
+        self.max_depth = max(self.num_workers, max_depth)
+        self.batch_window = batch_window_ms / 1000
+        self.batch_size = max(1, batch_size)
+        self.batches = 0
+        self.batched_messages = 0
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+        self._accepting = False
+
+    def start(self):
+        """Create the shard queues and worker tasks on the running event loop"""
+        if self._workers:
+            return
+        shard_depth = self.max_depth // self.num_workers
+        self._queues = [asyncio.Queue(maxsize=shard_depth) for _ in range(self.num_workers)]
+        self._workers = [
+            asyncio.create_task(self._worker(i, queue))
+            for i, queue in enumerate(self._queues)
+        ]
+        self._accepting = True
+        logger.info(f"Started {self.num_workers} profile extraction workers")
+
+    def _enqueue(self, user_id: str, job: Callable[..., bool], *args) -> bool:
+        if not self._accepting:
+            logger.warning("Profile extraction queue is not running, dropping job")
+            return False
+        queue = self._queues[zlib.crc32(user_id.encode()) % self.num_workers]
+        try:
+            queue.put_nowait((user_id, job, args))
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"Profile extraction queue full, dropping {job.__name__} for {user_id}")
+            return False
+
+    def submit(self, user_id: str, message: str, current_profile: Optional[Dict] = None) -> bool:
+        """Queue a message for profile extraction without waiting for it.
+
+        Passing the profile already fetched for this turn saves the worker
+        another round trip.
+        """
+        return self._enqueue(user_id, ProfileManager.update_profile_from_message, message, current_profile)
+
+    def submit_summary(self, user_id: str, conversations: List[Dict], before: Optional[str] = None) -> bool:
+        """Queue conversations that no longer fit in the prompt for the rolling summary.
+
+        With before, unsummarized conversations older than it are read back
+        from the database and folded in too.
+        """
+        return self._enqueue(user_id, ProfileManager.update_conversation_summary, conversations, before)
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def drain(self, timeout: float = PROFILE_EXTRACTION_DRAIN_TIMEOUT):
+        """Stop accepting messages and finish everything already queued"""
+        if not self._workers:
+            return
+        self._accepting = False
+        logger.info(f"Draining profile extraction queue ({self.depth()} pending)")
+        for queue in self._queues:
+            await queue.put(None)
+        try:
+            await asyncio.wait_for(asyncio.gather(*self._workers), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Profile extraction queue did not drain within {timeout}s")
+            for worker in self._workers:
+                worker.cancel()
+        self._workers = []
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "depth": self.depth(),
+            "batches": self.batches,
+            "messages": self.batched_messages,
+            "messages_per_batch": self.batched_messages / self.batches if self.batches else 0.0
+        }
+
+    async def _run(self, index: int, user_id: str, job: Callable[..., bool], *args):
+        try:
+            success = await run_blocking(job, user_id, *args)
+            if not success:
+                logger.warning(f"Profile job {job.__name__} failed for {user_id}")
+        except Exception as e:
+            logger.error(f"Error in profile extraction worker {index}: {str(e)}")
+
+    async def _flush(self, index: int, user_id: str, batches: Dict[str, Tuple[float, List[str], Optional[Dict]]]):
+        _, messages, current_profile = batches.pop(user_id)
+        self.batches += 1
+        self.batched_messages += len(messages)
+        await self._run(index, user_id, ProfileManager.update_profile_from_messages, messages, current_profile)
+
+    async def _worker(self, index: int, queue: asyncio.Queue):
+        # user_id -> (deadline, messages, newest profile snapshot), in arrival order
+        batches: Dict[str, Tuple[float, List[str], Optional[Dict]]] = {}
+        while True:
+            timeout = None
+            if batches:
+                timeout = max(0.0, min(deadline for deadline, _, _ in batches.values()) - time.monotonic())
+            try:
+                item: Optional[Tuple[str, Callable[..., bool], tuple]] = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                # A batch window elapsed with nothing new queued
+                item = ()
+            
+            if item is None:
+                queue.task_done()
+                for user_id in list(batches):
+                    await self._flush(index, user_id, batches)
+                return
+            
+            if item:
+                user_id, job, args = item
+                if job is ProfileManager.update_profile_from_message:
+                    message, current_profile = args
+                    deadline, messages, snapshot = batches.get(user_id, (time.monotonic() + self.batch_window, [], None))
+                    messages.append(message)
+                    batches[user_id] = (deadline, messages, current_profile if current_profile is not None else snapshot)
+                    if len(messages) >= self.batch_size:
+                        await self._flush(index, user_id, batches)
+                else:
+                    # Keep the user's jobs in order: extract pending messages first. Summaries
+                    # write their own columns and don't depend on extraction, so they leave
+                    # the batch open
+                    if user_id in batches and job is not ProfileManager.update_conversation_summary:
+                        await self._flush(index, user_id, batches)
+                    await self._run(index, user_id, job, *args)
+                queue.task_done()
+            
+            now = time.monotonic()
+            for user_id in [user_id for user_id, (deadline, _, _) in batches.items() if deadline <= now]:
+                await self._flush(index, user_id, batches)
+
+extraction_queue = ProfileExtractionQueue()
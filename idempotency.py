@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from concurrency import run_blocking
+from profile_cache import TTLCache
+from shared_cache import TieredCache, shared_cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds a completed response is replayed for a repeated Idempotency-Key
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "600"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused for a different request"""
+
+
+def fingerprint(*parts: Any) -> str:
+    """Hash of the parts of a request that must match for a key to be replayed"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class IdempotentRequests:
+    """Run each Idempotency-Key's request once.
+
+    A duplicate that arrives while the first request is still running waits
+    for the same result. The work runs in its own task, so a client that
+    gives up and retries picks up the original call rather than cancelling
+    it. Successful responses are kept for IDEMPOTENCY_TTL in the cache
+    shared by all workers, and replayed for later retries; failures aren't
+    kept, so a retry after an error runs again. Coalescing in-flight
+    requests is per worker.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL):
+        self.results = TieredCache(TTLCache(ttl=ttl), shared_cache, "idempotency")
+        self._in_flight: Dict[str, Tuple[str, asyncio.Task]] = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.replayed = 0
+
+    async def run(self, key: str, request_fingerprint: str,
+                  compute: Callable[[], Awaitable[Dict]]) -> Tuple[Dict, bool]:
+        """Return compute()'s result for this key and whether it was replayed"""
+        cached = await run_blocking(self.results.get, key)
+        if cached is not None:
+            if cached['fingerprint'] != request_fingerprint:
+                raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+            self.replayed += 1
+            return cached['response'], True
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            running_fingerprint, task = in_flight
+            if running_fingerprint != request_fingerprint:
+                raise IdempotencyConflict("Idempotency-Key is in use by a different request")
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(self._execute(key, request_fingerprint, compute))
+        # Mark a failure as retrieved even if every waiter has gone away
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._in_flight[key] = (request_fingerprint, task)
+        self.executed += 1
+        return await asyncio.shield(task), False
+
+    async def _execute(self, key: str, request_fingerprint: str,
+                       compute: Callable[[], Awaitable[Dict]]) -> Dict:
+        try:
+            response = await compute()
+            try:
+                await run_blocking(self.results.set, key, {
+                    'fingerprint': request_fingerprint,
+                    'response': response
+                })
+            except Exception as e:
+                logger.error(f"Error caching idempotent response: {str(e)}")
+            return response
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._in_flight),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "replayed": self.replayed
+        }
+
+
+idempotent_requests = IdempotentRequests()
@@ -0,0 +1,212 @@
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# sentence-transformers model name; the hashed bag-of-words fallback is used when unset
+MEMORY_EMBEDDING_MODEL = os.getenv("MEMORY_EMBEDDING_MODEL", "")
+MEMORY_EMBEDDING_DIM = int(os.getenv("MEMORY_EMBEDDING_DIM", "1024"))
+
+# Past exchanges injected per turn, and the similarity below which they are left out
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "3"))
+MEMORY_MIN_SCORE = float(os.getenv("MEMORY_MIN_SCORE", "0.2"))
+
+MEMORY_INDEX_MAX_USERS = int(os.getenv("MEMORY_INDEX_MAX_USERS", "64"))
+MEMORY_INDEX_MAX_ROWS = int(os.getenv("MEMORY_INDEX_MAX_ROWS", "1000"))
+
+# Indexes are rebuilt after this long to pick up rows stored by other workers
+MEMORY_INDEX_TTL = int(os.getenv("MEMORY_INDEX_TTL", "600"))
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+STOPWORDS = frozenset("""
+a about after again all am an and any are as at be because been before being but by can could
+did do does doing don't for from had has have having he her here hers him his how i i'm if in
+into is it it's its just me more most my no not now of on once only or other our out over own
+same she should so some such than that the their them then there these they this those through
+to too under until up very was we were what when where which while who why will with would you
+your yours yeah really like get got feel feeling think know
+""".split())
+
+
+def conversation_text(row: Dict) -> str:
+    return f"{row.get('user_message') or ''}\n{row.get('ai_response') or ''}"
+
+
+class HashedEmbedder:
+    """Bag-of-words and bigram features hashed into a fixed-size vector.
+
+    Needs no model download, so it works offline. Counts are damped with
+    log1p and the vectors are L2-normalized, so a dot product is the
+    cosine similarity.
+    """
+
+    def __init__(self, dim: int = MEMORY_EMBEDDING_DIM):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        tokens = [
+            token for token in TOKEN_PATTERN.findall(text.lower())
+            if len(token) > 1 and token not in STOPWORDS
+        ]
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            features = self._features(text)
+            if not features:
+                continue
+            hashes = np.fromiter(
+                (zlib.crc32(feature.encode()) for feature in features),
+                dtype=np.uint32,
+                count=len(features)
+            )
+            # High bit picks the sign so colliding features tend to cancel out
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[i], hashes % self.dim, signs)
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class ModelEmbedder:
+    """Embeddings from a local sentence-transformers model"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def create_embedder():
+    if MEMORY_EMBEDDING_MODEL:
+        try:
+            return ModelEmbedder(MEMORY_EMBEDDING_MODEL)
+        except Exception as e:
+            logger.warning(f"Could not load embedding model {MEMORY_EMBEDDING_MODEL}, using hashed embeddings: {str(e)}")
+    return HashedEmbedder()
+
+
+class ConversationIndex:
+    """Embedded conversations of a single user, stored as one contiguous matrix"""
+
+    def __init__(self, dim: int):
+        self.rows: List[Dict] = []
+        self.ids = set()
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.loaded_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def add(self, rows: List[Dict], vectors: np.ndarray):
+        keep = [i for i, row in enumerate(rows) if row.get('id') not in self.ids]
+        if not keep:
+            return
+        size = len(self.rows)
+        needed = size + len(keep)
+        if needed > len(self.vectors):
+            # Grow geometrically so a stream of single inserts stays amortized O(1)
+            grown = np.zeros((max(needed, 2 * len(self.vectors), 16), self.vectors.shape[1]), dtype=np.float32)
+            grown[:size] = self.vectors[:size]
+            self.vectors = grown
+        self.vectors[size:needed] = vectors[keep]
+        for i in keep:
+            self.rows.append(rows[i])
+            self.ids.add(rows[i].get('id'))
+
+    def search(self, query: np.ndarray, k: int, min_score: float) -> List[Tuple[float, Dict]]:
+        size = len(self.rows)
+        if size == 0 or k <= 0:
+            return []
+        scores = self.vectors[:size] @ query
+        k = min(k, size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.rows[i]) for i in top if scores[i] >= min_score]
+
+
+class MemoryIndex:
+    """Per-user vector indexes over past conversations, kept for the busiest users.
+
+    Indexes are built from the database on first use and updated in place
+    as new conversations are stored.
+    """
+
+    def __init__(self, embedder=None, max_users: int = MEMORY_INDEX_MAX_USERS,
+                 ttl: int = MEMORY_INDEX_TTL):
+        self.embedder = embedder or create_embedder()
+        self.max_users = max_users
+        self.ttl = ttl
+        self._indexes: "OrderedDict[str, ConversationIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, user_id: str) -> Optional[ConversationIndex]:
+        index = self._indexes.get(user_id)
+        if index is None:
+            return None
+        if time.monotonic() - index.loaded_at > self.ttl:
+            del self._indexes[user_id]
+            return None
+        self._indexes.move_to_end(user_id)
+        return index
+
+    def is_loaded(self, user_id: str) -> bool:
+        with self._lock:
+            return self._get(user_id) is not None
+
+    def load(self, user_id: str, rows: Iterable[Dict]):
+        """Build a user's index from their stored conversations"""
+        rows = list(rows)
+        index = ConversationIndex(self.embedder.dim)
+        if rows:
+            index.add(rows, self.embedder.embed([conversation_text(row) for row in rows]))
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+
+    def add(self, user_id: str, row: Dict):
+        """Index a newly stored conversation if the user's index is in memory"""
+        with self._lock:
+            if self._get(user_id) is None:
+                return
+        vector = self.embedder.embed([conversation_text(row)])
+        with self._lock:
+            index = self._get(user_id)
+            if index is not None:
+                index.add([row], vector)
+
+    def search(self, user_id: str, query: str, k: int = MEMORY_TOP_K,
+               min_score: float = MEMORY_MIN_SCORE) -> List[Dict]:
+        """Most similar past conversations for a loaded user, best first"""
+        vector = self.embedder.embed([query])[0]
+        with self._lock:
+            index = self._get(user_id)
+            if index is None:
+                return []
+            results = index.search(vector, k, min_score)
+        return [dict(row, score=score) for score, row in results]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "users": len(self._indexes),
+                "conversations": sum(len(index) for index in self._indexes.values()),
+                "dim": self.embedder.dim
+            }
+
+
+memory_index = MemoryIndex()
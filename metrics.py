@@ -0,0 +1,329 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# Add a Server-Timing header with the stages of each HTTP request
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+
+# SQLite file where every worker on the host publishes its metrics for /metrics to add up;
+# "none" reports only the worker that answers the scrape
+METRICS_STORE_PATH = os.getenv(
+    "METRICS_STORE_PATH",
+    os.path.join(tempfile.gettempdir(), "thera_ai_metrics.sqlite3")
+)
+METRICS_PUBLISH_INTERVAL_MS = int(os.getenv("METRICS_PUBLISH_INTERVAL_MS", "5000"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stages completed while handling the current request, when Server-Timing is enabled
+request_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+    def merge(self, snapshot: Dict[str, Any]):
+        self.counts = [a + b for a, b in zip(self.counts, snapshot["counts"])]
+        self.sum += snapshot["sum"]
+        self.count += snapshot["count"]
+
+    def render(self, name: str, labels: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+def _label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Per-stage latencies, error counts and token usage for this worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_latency: Dict[str, Histogram] = {}
+        self.stage_errors: Dict[str, int] = {}
+        self.request_latency: Dict[str, Histogram] = {}
+        self.responses: Dict[Tuple[str, int], int] = {}
+        self.tokens: Dict[Tuple[str, str], int] = {}
+
+    def observe_stage(self, stage: str, seconds: float, error: bool = False):
+        with self._lock:
+            self.stage_latency.setdefault(stage, Histogram()).observe(seconds)
+            if error:
+                self.stage_errors[stage] = self.stage_errors.get(stage, 0) + 1
+
+    def count_error(self, stage: str):
+        """Count a stage failure that was handled rather than raised"""
+        with self._lock:
+            self.stage_errors[stage] = self.stage_errors.get(stage, 0) + 1
+
+    def observe_request(self, path: str, seconds: float, status: int):
+        with self._lock:
+            self.request_latency.setdefault(path, Histogram()).observe(seconds)
+            self.responses[(path, status)] = self.responses.get((path, status), 0) + 1
+
+    def record_usage(self, model: str, usage: Any):
+        """Add the token counts from an OpenAI usage object"""
+        if usage is None:
+            return
+        with self._lock:
+            for kind in ("prompt_tokens", "completion_tokens"):
+                count = getattr(usage, kind, None) or 0
+                key = (model, kind.split("_")[0])
+                self.tokens[key] = self.tokens.get(key, 0) + count
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Every metric as JSON-serializable data, for adding up across workers"""
+        with self._lock:
+            return {
+                "stage_latency": {stage: h.snapshot() for stage, h in self.stage_latency.items()},
+                "stage_errors": dict(self.stage_errors),
+                "request_latency": {path: h.snapshot() for path, h in self.request_latency.items()},
+                "responses": [[path, status, count] for (path, status), count in self.responses.items()],
+                "tokens": [[model, kind, count] for (model, kind), count in self.tokens.items()]
+            }
+
+    def merge(self, snapshot: Dict[str, Any]):
+        """Add another worker's snapshot to these metrics"""
+        with self._lock:
+            for stage, data in snapshot["stage_latency"].items():
+                self.stage_latency.setdefault(stage, Histogram()).merge(data)
+            for stage, count in snapshot["stage_errors"].items():
+                self.stage_errors[stage] = self.stage_errors.get(stage, 0) + count
+            for path, data in snapshot["request_latency"].items():
+                self.request_latency.setdefault(path, Histogram()).merge(data)
+            for path, status, count in snapshot["responses"]:
+                self.responses[(path, status)] = self.responses.get((path, status), 0) + count
+            for model, kind, count in snapshot["tokens"]:
+                self.tokens[(model, kind)] = self.tokens.get((model, kind), 0) + count
+
+    def render(self) -> str:
+        """Format every metric in the Prometheus text exposition format"""
+        with self._lock:
+            lines = [
+                "# HELP thera_stage_duration_seconds Time spent in each stage of handling a turn",
+                "# TYPE thera_stage_duration_seconds histogram"
+            ]
+            for stage, histogram in sorted(self.stage_latency.items()):
+                lines.extend(histogram.render("thera_stage_duration_seconds", f'stage="{_label(stage)}"'))
+
+            lines.append("# HELP thera_stage_errors_total Failed stages")
+            lines.append("# TYPE thera_stage_errors_total counter")
+            for stage, count in sorted(self.stage_errors.items()):
+                lines.append(f'thera_stage_errors_total{{stage="{_label(stage)}"}} {count}')
+
+            lines.append("# HELP thera_request_duration_seconds Time until the response starts, per route")
+            lines.append("# TYPE thera_request_duration_seconds histogram")
+            for path, histogram in sorted(self.request_latency.items()):
+                lines.extend(histogram.render("thera_request_duration_seconds", f'path="{_label(path)}"'))
+
+            lines.append("# HELP thera_responses_total HTTP responses per route and status code")
+            lines.append("# TYPE thera_responses_total counter")
+            for (path, status), count in sorted(self.responses.items()):
+                lines.append(f'thera_responses_total{{path="{_label(path)}",status="{status}"}} {count}')
+
+            lines.append("# HELP thera_openai_tokens_total Tokens reported in OpenAI usage fields")
+            lines.append("# TYPE thera_openai_tokens_total counter")
+            for (model, kind), count in sorted(self.tokens.items()):
+                lines.append(f'thera_openai_tokens_total{{model="{_label(model)}",kind="{kind}"}} {count}')
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class MetricsStore:
+    """Cumulative metrics of every worker process on the host, in a SQLite file.
+
+    Under gunicorn each scrape reaches one worker, so every worker
+    publishes a snapshot of its own metrics in the background and the
+    worker answering the scrape adds them all up. Snapshots of workers
+    that have exited are kept, so totals don't drop when a worker is
+    replaced; a worker's last few seconds are lost if it dies without
+    shutting down.
+    """
+
+    def __init__(self, path: str = METRICS_STORE_PATH,
+                 interval_ms: int = METRICS_PUBLISH_INTERVAL_MS,
+                 registry: Metrics = metrics):
+        self.path = path
+        self.interval = interval_ms / 1000
+        self.registry = registry
+        self._local = threading.local()
+        self._worker_id: Optional[Tuple[int, str]] = None
+        self._task: Optional[asyncio.Task] = None
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS worker_metrics (
+                    worker_id TEXT PRIMARY KEY,
+                    snapshot TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def worker_id(self) -> str:
+        # Unique per process even when a pid is reused
+        if self._worker_id is None or self._worker_id[0] != os.getpid():
+            self._worker_id = (os.getpid(), f"{os.getpid()}-{uuid.uuid4().hex[:12]}")
+        return self._worker_id[1]
+
+    def publish(self):
+        """Replace this worker's snapshot with its current metrics"""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO worker_metrics (worker_id, snapshot, updated_at) VALUES (?, ?, ?)",
+            (self.worker_id(), json.dumps(self.registry.snapshot()), time.time())
+        )
+
+    def render(self) -> str:
+        """Every worker's metrics added up, in the Prometheus text exposition format"""
+        self.publish()
+        combined = Metrics()
+        for (snapshot,) in self._connect().execute("SELECT snapshot FROM worker_metrics"):
+            combined.merge(json.loads(snapshot))
+        return combined.render()
+
+    def start(self):
+        """Publish this worker's metrics every interval on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await run_blocking(self.publish)
+            except Exception as e:
+                logger.error(f"Error publishing worker metrics: {str(e)}")
+
+    async def stop(self):
+        """Stop publishing and record this worker's final metrics"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            self.publish()
+        except Exception as e:
+            logger.error(f"Error publishing worker metrics: {str(e)}")
+
+
+def create_metrics_store(path: str = METRICS_STORE_PATH) -> Optional[MetricsStore]:
+    """Build the store configured by METRICS_STORE_PATH, or None to report per worker"""
+    if not path or path.lower() == "none":
+        return None
+    try:
+        return MetricsStore(path)
+    except Exception as e:
+        logger.error(f"Failed to set up the metrics store, reporting per worker: {str(e)}")
+        return None
+
+
+metrics_store = create_metrics_store()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as a named stage, counting it as failed if it raises"""
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe_stage(name, elapsed, error)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def timed(name: str) -> Callable:
+    """Decorator form of stage() for functions, coroutines and async generators"""
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args, **kwargs):
+                with stage(name):
+                    async for item in func(*args, **kwargs):
+                        yield item
+            return async_gen_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing_header(timings: List[Tuple[str, float]]) -> str:
+    """Format stage timings as a Server-Timing header; repeated stages are summed"""
+    totals: Dict[str, float] = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
@@ -0,0 +1,227 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, NamedTuple
+
+import numpy as np
+from openai import APITimeoutError
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LATENCY_SAMPLES = 1024
+
+
+class ModelRoute(NamedTuple):
+    """Model settings for one kind of completion"""
+    model: str
+    fallback_model: str
+    timeout: float
+    max_tokens: int
+
+
+def route_from_env(task: str, model: str, fallback_model: str, timeout: float, max_tokens: int) -> ModelRoute:
+    """Read a task's route from <TASK>_MODEL, <TASK>_FALLBACK_MODEL, <TASK>_TIMEOUT and <TASK>_MAX_TOKENS"""
+    prefix = task.upper()
+    return ModelRoute(
+        model=os.getenv(f"{prefix}_MODEL", model),
+        fallback_model=os.getenv(f"{prefix}_FALLBACK_MODEL", fallback_model),
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT", str(timeout))),
+        max_tokens=int(os.getenv(f"{prefix}_MAX_TOKENS", str(max_tokens)))
+    )
+
+
+ROUTES = {
+    # The therapist's reply
+    "chat": route_from_env("chat", "gpt-4-0125-preview", "gpt-4o-mini", 30, 500),
+    # Structured JSON extraction of profile facts; a batch of messages can yield a long object,
+    # and JSON cut off at the cap can't be parsed
+    "extraction": route_from_env("extraction", "gpt-4o-mini", "gpt-4-0125-preview", 15, 1500),
+    # Rolling conversation summaries
+    "summary": route_from_env("summary", "gpt-4o-mini", "gpt-4-0125-preview", 20, 300),
+}
+
+
+class ModelStats:
+    """Call counts and recent latencies for one model"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.fallbacks = 0
+        self.truncations = 0
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.first_token_latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def snapshot(self) -> Dict[str, float]:
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        first_token = np.array(self.first_token_latencies) if self.first_token_latencies else np.zeros(1)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "fallbacks": self.fallbacks,
+            "truncations": self.truncations,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "max_ms": float(latencies.max()),
+            "first_token_p50_ms": float(np.percentile(first_token, 50)),
+            "first_token_p95_ms": float(np.percentile(first_token, 95))
+        }
+
+
+class ModelRouter:
+    """Pick the model for each task and fall back to a second model on errors.
+
+    The primary model gets the route's timeout and no client-side retries,
+    so a slow or failing call moves on to the fallback model quickly.
+    """
+
+    def __init__(self, routes: Dict[str, ModelRoute] = ROUTES):
+        self.routes = routes
+        self._stats: Dict[str, ModelStats] = {}
+        self._lock = threading.Lock()
+
+    def route(self, task: str) -> ModelRoute:
+        return self.routes[task]
+
+    def _attempts(self, task: str) -> List[str]:
+        route = self.route(task)
+        models = [route.model]
+        if route.fallback_model and route.fallback_model != route.model:
+            models.append(route.fallback_model)
+        return models
+
+    def _request(self, task: str, model: str, messages: List[Dict], params: Dict) -> Dict[str, Any]:
+        return {
+            "model": model,
+            "messages": messages,
+            "max_tokens": self.route(task).max_tokens,
+            **params
+        }
+
+    def _record(self, model: str, started: float, error: Exception = None, fallback: bool = False):
+        with self._lock:
+            stats = self._stats.setdefault(model, ModelStats())
+            stats.calls += 1
+            if fallback:
+                stats.fallbacks += 1
+            if error is None:
+                stats.latencies.append((time.perf_counter() - started) * 1000)
+            else:
+                stats.errors += 1
+                if isinstance(error, APITimeoutError):
+                    stats.timeouts += 1
+
+    def _record_first_token(self, model: str, started: float):
+        with self._lock:
+            stats = self._stats.setdefault(model, ModelStats())
+            stats.first_token_latencies.append((time.perf_counter() - started) * 1000)
+
+    def _check_truncation(self, task: str, model: str, response):
+        """Count and log a completion that stopped at the route's max_tokens"""
+        choices = getattr(response, "choices", None) or []
+        if not choices or getattr(choices[0], "finish_reason", None) != "length":
+            return
+        with self._lock:
+            self._stats.setdefault(model, ModelStats()).truncations += 1
+        logger.warning(
+            f"{task} completion with {model} was truncated at max_tokens={self.route(task).max_tokens}; "
+            f"raise {task.upper()}_MAX_TOKENS"
+        )
+
+    def _log_failure(self, task: str, model: str, error: Exception, fallback_model: str):
+        logger.warning(f"{task} completion with {model} failed, falling back to {fallback_model}: {str(error)}")
+
+    def complete(self, client, task: str, messages: List[Dict], **params):
+        """Create a chat completion for a task with the synchronous client"""
+        models = self._attempts(task)
+        timeout = self.route(task).timeout
+        for attempt, model in enumerate(models):
+            started = time.perf_counter()
+            try:
+                response = client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+                    **self._request(task, model, messages, params)
+                )
+                self._record(model, started, fallback=attempt > 0)
+                metrics.record_usage(model, getattr(response, "usage", None))
+                self._check_truncation(task, model, response)
+                return response
+            except Exception as e:
+                self._record(model, started, e, fallback=attempt > 0)
+                if attempt == len(models) - 1:
+                    raise
+                self._log_failure(task, model, e, models[attempt + 1])
+
+    async def complete_async(self, client, task: str, messages: List[Dict], **params):
+        """Create a chat completion for a task with the async client"""
+        models = self._attempts(task)
+        timeout = self.route(task).timeout
+        for attempt, model in enumerate(models):
+            started = time.perf_counter()
+            try:
+                response = await client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+                    **self._request(task, model, messages, params)
+                )
+                self._record(model, started, fallback=attempt > 0)
+                metrics.record_usage(model, getattr(response, "usage", None))
+                self._check_truncation(task, model, response)
+                return response
+            except Exception as e:
+                self._record(model, started, e, fallback=attempt > 0)
+                if attempt == len(models) - 1:
+                    raise
+                self._log_failure(task, model, e, models[attempt + 1])
+
+    async def stream(self, client, task: str, messages: List[Dict], **params) -> AsyncIterator[str]:
+        """Stream completion tokens for a task.
+
+        Falls back only if the primary model fails before its first token,
+        since the tokens already sent can't be taken back.
+        """
+        models = self._attempts(task)
+        timeout = self.route(task).timeout
+        for attempt, model in enumerate(models):
+            started = time.perf_counter()
+            first_token = True
+            try:
+                stream = await client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+                    **self._request(task, model, messages, params),
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                async for chunk in stream:
+                    # The last chunk carries the usage and no choices
+                    if getattr(chunk, "usage", None) is not None:
+                        metrics.record_usage(model, chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    token = chunk.choices[0].delta.content
+                    if not token:
+                        continue
+                    if first_token:
+                        self._record_first_token(model, started)
+                        first_token = False
+                    yield token
+            except Exception as e:
+                self._record(model, started, e, fallback=attempt > 0)
+                if not first_token or attempt == len(models) - 1:
+                    raise
+                self._log_failure(task, model, e, models[attempt + 1])
+                continue
+            self._record(model, started, fallback=attempt > 0)
+            return
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                "routes": {task: route._asdict() for task, route in self.routes.items()},
+                "models": {model: stats.snapshot() for model, stats in self._stats.items()}
+            }
+
+
+model_router = ModelRouter()
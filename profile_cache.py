@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from shared_cache import TieredCache, shared_cache
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "1024"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+CONVERSATION_CACHE_TTL = float(os.getenv("CONVERSATION_CACHE_TTL", "60"))
+TRANSCRIPT_CACHE_TTL = float(os.getenv("TRANSCRIPT_CACHE_TTL", "3600"))
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a fixed TTL"""
+
+    def __init__(self, max_size: int = PROFILE_CACHE_SIZE, ttl: float = PROFILE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+# {'profile': dict, 'context': str} entries keyed by user_id
+profile_cache = TieredCache(TTLCache(), shared_cache, "profile")
+
+# Most recent conversations (newest first) keyed by user_id
+conversation_cache = TieredCache(TTLCache(ttl=CONVERSATION_CACHE_TTL), shared_cache, "conversations")
+
+# Whisper transcripts keyed by a hash of the uploaded audio, so retried uploads skip transcription
+transcript_cache = TieredCache(TTLCache(ttl=TRANSCRIPT_CACHE_TTL), shared_cache, "transcripts")
@@ -1,15 +1,105 @@
-from supabase_client import supabase
+from clients import openai_client, supabase
+from conversation import parse_timestamp
+from conversation_journal import conversation_journal, merge_pending
+from profile_cache import profile_cache, conversation_cache
+from memory_index import MEMORY_INDEX_MAX_ROWS, MEMORY_TOP_K, memory_index
+from profile_prefilter import profile_prefilter
+from model_router import model_router
+from metrics import metrics, timed
+import base64
 import json
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 import logging
-from datetime import datetime
+import os
+import re
+import uuid
 
 logger = logging.getLogger(__name__)
 
+PROFILE_FIELDS = ('personal_info', 'relationships', 'important_events', 'preferences', 'goals')
+
+# Most recent entries rendered per profile list; older ones live on in the database
+PROFILE_SECTION_MAX_ITEMS = int(os.getenv("PROFILE_SECTION_MAX_ITEMS", "8"))
+PREVIOUS_DETAILS_MAX_ITEMS = 2
+
+# Conversations per page of GET /conversations, and per database read of an NDJSON export
+CONVERSATION_PAGE_SIZE = int(os.getenv("CONVERSATION_PAGE_SIZE", "20"))
+CONVERSATION_PAGE_MAX = int(os.getenv("CONVERSATION_PAGE_MAX", "100"))
+CONVERSATION_EXPORT_BATCH_SIZE = int(os.getenv("CONVERSATION_EXPORT_BATCH_SIZE", "500"))
+
+# Oldest unsummarized conversations folded into the summary per update; a backlog catches up over several turns
+SUMMARY_BACKLOG_LIMIT = int(os.getenv("SUMMARY_BACKLOG_LIMIT", "20"))
+
+# Every conversations column except the generated search_vector
+CONVERSATION_COLUMNS = 'id, user_id, user_message, ai_response, created_at, metadata'
+
+# Longest full-text search query accepted
+SEARCH_QUERY_MAX_LENGTH = 200
+
+TIMESTAMP = re.compile(r"^[0-9T:.+\- ]+$")
+
+
+def encode_cursor(conversation: Dict) -> str:
+    """Opaque cursor pointing just past a conversation"""
+    key = json.dumps([conversation['created_at'], conversation['id']])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """The (created_at, id) key of a cursor; raises ValueError if it is malformed"""
+    try:
+        created_at, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    # Both end up in a PostgREST filter, so only accept what they can legitimately contain
+    if not isinstance(created_at, str) or not TIMESTAMP.match(created_at):
+        raise ValueError("Invalid cursor")
+    try:
+        parse_timestamp(created_at)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    return created_at, str(uuid.UUID(str(conversation_id)))
+
+
 class ProfileManager:
+    @staticmethod
+    def _cache_profile(user_id: str, profile: Dict) -> Dict:
+        """Cache a profile together with its rendered context string"""
+        entry = {
+            'profile': profile,
+            'context': ProfileManager.format_profile_context(profile)
+        }
+        profile_cache.set(user_id, entry)
+        return entry
+
+    @staticmethod
+    def _cache_conversations(user_id: str, conversations: List[Dict], limit: int):
+        """Cache recent conversations, noting whether they are the user's full history"""
+        conversation_cache.set(user_id, {
+            'rows': conversations,
+            'complete': len(conversations) < limit
+        })
+
+    @staticmethod
+    def invalidate_profile(user_id: str):
+        """Drop a user's cached profile after it was written"""
+        profile_cache.invalidate(user_id)
+
+    @staticmethod
+    def cache_stats() -> Dict[str, Dict[str, int]]:
+        return {
+            "profiles": profile_cache.stats(),
+            "conversations": conversation_cache.stats(),
+            "journal": conversation_journal.stats()
+        }
+
     @staticmethod
     def get_user_profile(user_id: str) -> Dict:
         """Get user profile information"""
+        cached = profile_cache.get(user_id)
+        if cached is not None:
+            return cached['profile']
+        
         try:
             result = supabase.table('user_profiles')\
                 .select('*')\
@@ -18,6 +108,7 @@ class ProfileManager:
                 .execute()
             
             if result.data:
+                ProfileManager._cache_profile(user_id, result.data)
                 return result.data
             
             # Create profile if it doesn't exist
@@ -33,7 +124,9 @@ class ProfileManager:
                 .insert(new_profile)\
                 .execute()
             
-            return result.data[0] if result.data else new_profile
+            profile = result.data[0] if result.data else new_profile
+            ProfileManager._cache_profile(user_id, profile)
+            return profile
         except Exception as e:
             logger.error(f"Error getting user profile: {str(e)}")
             return {}
@@ -46,53 +139,216 @@ class ProfileManager:
                 .update({field: data})\
                 .eq('user_id', user_id)\
                 .execute()
+            ProfileManager.invalidate_profile(user_id)
             return bool(result.data)
         except Exception as e:
             logger.error(f"Error updating profile field: {str(e)}")
             return False
 
     @staticmethod
-    def get_session_conversations(user_id: str) -> List[Dict]:
-        """Get all conversations for user"""
+    def get_session_conversations(user_id: str, limit: int = 5) -> List[Dict]:
+        """Get all conversations for user, including ones not yet flushed from the journal"""
+        # Read the journal first: a turn flushed meanwhile is then in the database result
+        pending = conversation_journal.pending(user_id, limit)
+        cached = conversation_cache.get(user_id)
+        if cached is not None and (len(cached['rows']) >= limit or cached['complete']):
+            return merge_pending(cached['rows'], pending, limit)
+        
         try:
             result = supabase.table('conversations')\
-                .select('*')\
+                .select(CONVERSATION_COLUMNS)\
                 .eq('user_id', user_id)\
                 .order('created_at', desc=True)\
-                .limit(5)\
+                .limit(limit)\
                 .execute()
             
-            return result.data if result.data else []
+            conversations = result.data if result.data else []
+            # Only cache what will stay true once the pending turns are flushed
+            if not pending:
+                ProfileManager._cache_conversations(user_id, conversations, limit)
+            return merge_pending(conversations, pending, limit)
         except Exception as e:
             logger.error(f"Error getting conversations: {str(e)}")
             return []
 
     @staticmethod
-    def store_conversation(user_id: str, user_message: str, ai_response: str) -> Optional[Dict]:
-        """Store new conversation"""
+    def get_unsummarized_conversations(user_id: str, after: Optional[str], before: str,
+                                       limit: int = SUMMARY_BACKLOG_LIMIT) -> List[Dict]:
+        """Get the oldest conversations between the summary's end and before, oldest first"""
+        try:
+            query = supabase.table('conversations')\
+                .select(CONVERSATION_COLUMNS)\
+                .eq('user_id', user_id)\
+                .lt('created_at', before)
+            if after:
+                query = query.gt('created_at', after)
+            result = query\
+                .order('created_at')\
+                .limit(limit)\
+                .execute()
+            
+            return result.data or []
+        except Exception as e:
+            logger.error(f"Error getting unsummarized conversations: {str(e)}")
+            return []
+
+    @staticmethod
+    @timed("conversation_page")
+    def get_conversation_page(user_id: str, limit: int = CONVERSATION_PAGE_SIZE,
+                              before: Optional[Tuple[str, str]] = None) -> Optional[List[Dict]]:
+        """Get up to limit conversations older than the (created_at, id) key, newest first.
+
+        Uses the conversations (user_id, created_at, id) index, so a page
+        costs the same however deep into the history it is. Returns None
+        if the database can't be read, to tell an error from the end of
+        the history.
+        """
+        pending = [
+            row for row in conversation_journal.pending(user_id)
+            if before is None
+            or (parse_timestamp(row['created_at']), row['id']) < (parse_timestamp(before[0]), before[1])
+        ]
+        try:
+            query = supabase.table('conversations')\
+                .select(CONVERSATION_COLUMNS)\
+                .eq('user_id', user_id)
+            if before is not None:
+                created_at, conversation_id = before
+                query = query.or_(
+                    f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{conversation_id})'
+                )
+            result = query\
+                .order('created_at', desc=True)\
+                .order('id', desc=True)\
+                .limit(limit)\
+                .execute()
+            
+            return merge_pending(result.data or [], pending, limit)
+        except Exception as e:
+            metrics.count_error("conversation_page")
+            logger.error(f"Error getting conversation page: {str(e)}")
+            return None
+
+    @staticmethod
+    @timed("conversation_search")
+    def full_text_search(user_id: str, query: str, limit: int = CONVERSATION_PAGE_SIZE,
+                         offset: int = 0) -> Optional[List[Dict]]:
+        """Find a user's conversations matching a search query, best match first.
+
+        Matching and ranking run in the database, which returns only the
+        requested page of matches with a highlighted headline. Turns still
+        in the journal become searchable once they are flushed. Returns None
+        if the database can't be read.
+        """
+        try:
+            result = supabase.rpc('search_conversations_fts', {
+                'p_user_id': user_id,
+                'p_query': query,
+                'p_limit': limit,
+                'p_offset': offset
+            }).execute()
+            
+            return result.data or []
+        except Exception as e:
+            metrics.count_error("conversation_search")
+            logger.error(f"Error searching conversation text: {str(e)}")
+            return None
+
+    @staticmethod
+    def find_mentions(user_id: str, phrase: str, limit: int = CONVERSATION_PAGE_SIZE) -> Optional[List[Dict]]:
+        """Find conversations mentioning an exact phrase, such as a person's name"""
+        return ProfileManager.full_text_search(user_id, '"' + phrase.replace('"', ' ') + '"', limit)
+
+    @staticmethod
+    @timed("profile_fetch")
+    def get_chat_context(user_id: str, limit: int = 5) -> Tuple[Dict, List[Dict]]:
+        """Get user profile and recent conversations in a single round trip.
+
+        Creates an empty profile if the user doesn't have one yet. When the
+        profile is cached only the conversations are fetched.
+        """
+        cached = profile_cache.get(user_id)
+        if cached is not None:
+            return cached['profile'], ProfileManager.get_session_conversations(user_id, limit)
+        
+        pending = conversation_journal.pending(user_id, limit)
+        try:
+            result = supabase.rpc('get_chat_context', {
+                'p_user_id': user_id,
+                'p_limit': limit
+            }).execute()
+            
+            data = result.data or {}
+            profile = data.get('profile') or {}
+            conversations = data.get('conversations') or []
+            if profile:
+                ProfileManager._cache_profile(user_id, profile)
+                if not pending:
+                    ProfileManager._cache_conversations(user_id, conversations, limit)
+            return profile, merge_pending(conversations, pending, limit)
+        except Exception as e:
+            metrics.count_error("profile_fetch")
+            logger.error(f"Error getting chat context: {str(e)}")
+            return {}, []
+
+    @staticmethod
+    def get_conversation_history(user_id: str, limit: int = MEMORY_INDEX_MAX_ROWS) -> List[Dict]:
+        """Get a user's most recent conversations for the memory index"""
+        pending = conversation_journal.pending(user_id, limit)
         try:
             result = supabase.table('conversations')\
-                .insert({
-                    'user_id': user_id,
-                    'user_message': user_message,
-                    'ai_response': ai_response,
-                    'created_at': datetime.utcnow().isoformat(),
-                    'metadata': {}
-                })\
+                .select('id, user_message, ai_response, created_at')\
+                .eq('user_id', user_id)\
+                .order('created_at', desc=True)\
+                .limit(limit)\
                 .execute()
             
-            return result.data[0] if result.data else None
+            return merge_pending(result.data or [], pending, limit)
         except Exception as e:
+            logger.error(f"Error getting conversation history: {str(e)}")
+            return []
+
+    @staticmethod
+    @timed("memory_search")
+    def search_conversations(user_id: str, query: str, k: int = MEMORY_TOP_K) -> List[Dict]:
+        """Find the past conversations most relevant to a message.
+
+        The user's index is built from the database on first use and
+        kept up to date by store_conversation.
+        """
+        try:
+            if not memory_index.is_loaded(user_id):
+                memory_index.load(user_id, ProfileManager.get_conversation_history(user_id))
+            return memory_index.search(user_id, query, k)
+        except Exception as e:
+            metrics.count_error("memory_search")
+            logger.error(f"Error searching conversations: {str(e)}")
+            return []
+
+    @staticmethod
+    @timed("conversation_store")
+    def store_conversation(user_id: str, user_message: str, ai_response: str) -> Optional[Dict]:
+        """Store new conversation.
+
+        The turn is written to the local journal and inserted into the
+        database in the background with other pending turns.
+        """
+        try:
+            conversation = conversation_journal.append(user_id, user_message, ai_response)
+            conversation_cache.invalidate(user_id)
+            memory_index.add(user_id, conversation)
+            return conversation
+        except Exception as e:
+            metrics.count_error("conversation_store")
             logger.error(f"Error storing conversation: {str(e)}")
             return None
 
     @staticmethod
+    @timed("profile_extraction")
     def extract_personal_info(message: str, current_info: Dict) -> Dict:
         """Extract personal information from user messages"""
         try:
             # Use OpenAI to extract relevant information
-            from thera_ai import therapist
-            
             prompt = f"""
             Given the user's message and their current stored information, extract any new personal information mentioned.
             Pay special attention to:
@@ -103,9 +359,9 @@ class ProfileManager:
             5. Important life events, preferences, and goals
             
             Current stored information:
-            {json.dumps(current_info, indent=2)}
+            {json.dumps(current_info, separators=(',', ':'), default=str)}
             
-            User message:
+            User message (several messages are separated by blank lines, oldest first):
             {message}
             
             Return ONLY a JSON object with the following structure (only include fields where new information was found):
@@ -145,9 +401,10 @@ class ProfileManager:
             }}
             """
             
-            response = therapist.openai.chat.completions.create(
-                model="gpt-4-0125-preview",
-                messages=[
+            response = model_router.complete(
+                openai_client,
+                "extraction",
+                [
                     {"role": "system", "content": "You are an AI designed to extract personal information from conversations. Only return valid JSON."},
                     {"role": "user", "content": prompt}
                 ],
@@ -158,106 +415,264 @@ class ProfileManager:
             new_info = json.loads(response.choices[0].message.content)
             return new_info
         except Exception as e:
+            metrics.count_error("profile_extraction")
             logger.error(f"Error extracting personal info: {str(e)}")
             return {}
 
     @staticmethod
-    def update_profile_from_message(user_id: str, message: str) -> bool:
-        """Update user profile based on new message content"""
+    @timed("profile_merge")
+    def merge_profile(user_id: str, delta: Dict) -> Optional[Dict]:
+        """Deep-merge extracted profile information in a single atomic write.
+
+        The merge runs server-side in the merge_user_profile function, so
+        concurrent updates for the same user can't overwrite each other.
+        """
+        try:
+            result = supabase.rpc('merge_user_profile', {
+                'p_user_id': user_id,
+                'p_delta': delta
+            }).execute()
+            
+            ProfileManager.invalidate_profile(user_id)
+            if result.data:
+                ProfileManager._cache_profile(user_id, result.data)
+            return result.data or None
+        except Exception as e:
+            ProfileManager.invalidate_profile(user_id)
+            metrics.count_error("profile_merge")
+            logger.error(f"Error merging profile: {str(e)}")
+            return None
+
+    @staticmethod
+    def _extraction_context(profile: Dict, sections) -> Dict:
+        """The profile sections relevant to a message, without relationship history"""
+        context = {}
+        for section in sections:
+            data = profile.get(section)
+            if section == 'relationships' and isinstance(data, dict):
+                data = {
+                    person: {k: v for k, v in details.items() if k not in ('previous_details', 'last_discussed')}
+                    if isinstance(details, dict) else details
+                    for person, details in data.items()
+                }
+            context[section] = data
+        return context
+
+    @staticmethod
+    def _extract_delta(message: str, current_profile: Dict, sections) -> Dict:
+        """Extract new information, showing the model only the sections it may update"""
+        new_info = ProfileManager.extract_personal_info(
+            message,
+            ProfileManager._extraction_context(current_profile, sorted(sections))
+        )
+        # Drop empty and unknown fields
+        return {
+            field: data for field, data in new_info.items()
+            if field in PROFILE_FIELDS and data
+        }
+
+    @staticmethod
+    def update_profile_from_messages(user_id: str, messages: List[str], current_profile: Optional[Dict] = None) -> bool:
+        """Update user profile from a batch of a user's consecutive messages.
+
+        Messages the local prefilter finds nothing in are left out, apart
+        from a small audited share. The rest go to the extractor in a single
+        call and are written with a single merge.
+        """
         try:
-            # Get current profile
-            current_profile = ProfileManager.get_user_profile(user_id)
+            relevant, audited, sections = [], [], set()
+            for message in messages:
+                found = profile_prefilter.sections(message)
+                if found:
+                    relevant.append(message)
+                    sections.update(found)
+                elif profile_prefilter.should_audit():
+                    audited.append(message)
+            if not relevant and not audited:
+                return True
             
-            # Extract new information
-            new_info = ProfileManager.extract_personal_info(message, current_profile)
+            # Get current profile unless the caller already fetched it
+            if current_profile is None:
+                current_profile = ProfileManager.get_user_profile(user_id)
             
-            # Update each field if new information exists
-            for field, data in new_info.items():
-                if not data:  # Skip empty updates
-                    continue
-                    
-                current_data = current_profile.get(field, {} if isinstance(data, dict) else [])
-                
-                if field == 'relationships':
-                    # Special handling for relationships to preserve history
-                    for person_name, new_details in data.items():
-                        if person_name in current_data:
-                            # Update existing relationship
-                            current_data[person_name].update(new_details)
-                            # Preserve old details if not overwritten
-                            if 'details' in new_details and 'previous_details' not in current_data[person_name]:
-                                current_data[person_name]['previous_details'] = [current_data[person_name]['details']]
-                            elif 'details' in new_details:
-                                current_data[person_name]['previous_details'].append(current_data[person_name]['details'])
-                        else:
-                            # Add new relationship
-                            current_data[person_name] = new_details
-                            
-                        # Always update last_discussed
-                        current_data[person_name]['last_discussed'] = datetime.utcnow().isoformat()
-                        
-                elif isinstance(data, dict):
-                    # Merge dictionaries, preserving existing data
-                    for key, value in data.items():
-                        if key in current_data and isinstance(current_data[key], (dict, list)):
-                            # If the field is itself a complex type, do a deep merge
-                            if isinstance(current_data[key], dict):
-                                current_data[key].update(value)
-                            else:  # list
-                                current_data[key].extend(value)
-                        else:
-                            current_data[key] = value
-                elif isinstance(data, list):
-                    # Add new items while avoiding duplicates
-                    current_data.extend([item for item in data if item not in current_data])
-                
-                # Update the field in the profile
-                success = ProfileManager.update_profile_field(user_id, field, current_data)
-                if not success:
-                    logger.error(f"Failed to update field {field}")
-                    return False
+            success = True
+            if relevant:
+                delta = ProfileManager._extract_delta("\n\n".join(relevant), current_profile, sections)
+                if delta and ProfileManager.merge_profile(user_id, delta) is None:
+                    logger.error(f"Failed to merge profile fields {list(delta)}")
+                    success = False
             
-            return True
+            # Audited messages are extracted on their own so false skips can be counted
+            if audited:
+                delta = ProfileManager._extract_delta("\n\n".join(audited), current_profile, PROFILE_FIELDS)
+                profile_prefilter.record_audit(delta)
+                if delta and ProfileManager.merge_profile(user_id, delta) is None:
+                    logger.error(f"Failed to merge profile fields {list(delta)}")
+                    success = False
+            
+            return success
         except Exception as e:
-            logger.error(f"Error updating profile from message: {str(e)}")
+            logger.error(f"Error updating profile from messages: {str(e)}")
             return False
 
     @staticmethod
-    def get_profile_context(user_id: str) -> str:
-        """Get formatted context string from user profile"""
+    def update_profile_from_message(user_id: str, message: str, current_profile: Optional[Dict] = None) -> bool:
+        """Update user profile based on new message content"""
+        return ProfileManager.update_profile_from_messages(user_id, [message], current_profile)
+
+    @staticmethod
+    def get_profile_context(user_id: str, profile: Optional[Dict] = None) -> str:
+        """Get formatted context string from user profile.
+
+        The rendered string is cached with the profile. Pass a profile that
+        was already fetched to avoid a round trip on a cache miss.
+        """
         try:
-            profile = ProfileManager.get_user_profile(user_id)
+            cached = profile_cache.get(user_id)
+            if cached is not None:
+                return cached['context']
+            
+            if profile is None:
+                profile = ProfileManager.get_user_profile(user_id)
             if not profile:
                 return ""
             
-            context_parts = []
-            
-            if profile.get('personal_info'):
-                context_parts.append("Personal Information:")
-                for k, v in profile['personal_info'].items():
-                    context_parts.append(f"- {k}: {v}")
-            
-            if profile.get('relationships'):
-                context_parts.append("\nRelationships:")
-                for person, details in profile['relationships'].items():
-                    context_parts.append(f"- {person}: {details}")
-            
-            if profile.get('important_events'):
-                context_parts.append("\nImportant Life Events:")
-                for event in profile['important_events']:
-                    context_parts.append(f"- {event}")
+            return ProfileManager._cache_profile(user_id, profile)['context']
+        except Exception as e:
+            logger.error(f"Error getting profile context: {str(e)}")
+            return ""
+
+    @staticmethod
+    def summarize_conversations(summary: str, conversations: List[Dict]) -> str:
+        """Fold conversations into the user's rolling summary"""
+        exchanges = "\n\n".join(
+            f"User: {c.get('user_message') or ''}\nTherapist: {c.get('ai_response') or ''}"
+            for c in conversations
+        )
+        prompt = f"""
+        Below is a summary of earlier therapy conversations with a user, followed by newer exchanges.
+        Rewrite the summary so it also covers the newer exchanges. Keep the topics discussed, how
+        the user was feeling, advice or exercises already suggested and anything left open.
+        Stay under 200 words and write in the third person.
+        
+        Current summary:
+        {summary or "(none)"}
+        
+        Newer exchanges:
+        {exchanges}
+        """
+        
+        response = model_router.complete(
+            openai_client,
+            "summary",
+            [
+                {"role": "system", "content": "You summarize therapy conversations concisely. Return only the summary."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0
+        )
+        return response.choices[0].message.content.strip()
+
+    @staticmethod
+    @timed("conversation_summary")
+    def update_conversation_summary(user_id: str, conversations: List[Dict], before: Optional[str] = None) -> bool:
+        """Fold conversations that dropped out of the prompt into the stored summary.
+
+        With before, unsummarized conversations older than it are read from
+        the database as well, oldest first. Conversations already covered by
+        the summary are skipped, so the same rows can be submitted more than
+        once.
+        """
+        try:
+            profile = ProfileManager.get_user_profile(user_id)
+            summarized_through = profile.get('summarized_through')
+            candidates = list(conversations)
+            if before:
+                backlog = ProfileManager.get_unsummarized_conversations(user_id, summarized_through, before)
+                # Newer rows must wait until the backlog before them is summarized
+                candidates = backlog if len(backlog) >= SUMMARY_BACKLOG_LIMIT else backlog + candidates
             
-            if profile.get('preferences'):
-                context_parts.append("\nPreferences:")
-                for k, v in profile['preferences'].items():
-                    context_parts.append(f"- {k}: {v}")
+            through = parse_timestamp(summarized_through)
+            unique = {c.get('id') or c['created_at']: c for c in candidates if c.get('created_at')}
+            pending = sorted(
+                (c for c in unique.values() if through is None or parse_timestamp(c['created_at']) > through),
+                key=lambda c: parse_timestamp(c['created_at'])
+            )
+            if not pending:
+                return True
             
-            if profile.get('goals'):
-                context_parts.append("\nGoals:")
-                for goal in profile['goals']:
-                    context_parts.append(f"- {goal}")
+            summary = ProfileManager.summarize_conversations(
+                profile.get('conversation_summary') or "",
+                pending
+            )
+            result = supabase.table('user_profiles')\
+                .update({
+                    'conversation_summary': summary,
+                    'summarized_through': pending[-1]['created_at']
+                })\
+                .eq('user_id', user_id)\
+                .execute()
             
-            return "\n".join(context_parts)
+            # Other workers drop their copy; this one caches the new profile for the next turn
+            ProfileManager.invalidate_profile(user_id)
+            if result.data:
+                ProfileManager._cache_profile(user_id, result.data[0])
+            return bool(result.data)
         except Exception as e:
-            logger.error(f"Error getting profile context: {str(e)}")
-            return "" 
\ No newline at end of file
+            ProfileManager.invalidate_profile(user_id)
+            metrics.count_error("conversation_summary")
+            logger.error(f"Error updating conversation summary: {str(e)}")
+            return False
+
+    @staticmethod
+    def _recent_relationships(relationships: Dict, max_items: int) -> List[Tuple[str, Any]]:
+        """Most recently discussed people first, with old details trimmed"""
+        def last_discussed(item):
+            details = item[1]
+            return str(details.get('last_discussed') or "") if isinstance(details, dict) else ""
+        
+        recent = sorted(relationships.items(), key=last_discussed, reverse=True)[:max_items]
+        trimmed = []
+        for person, details in recent:
+            if isinstance(details, dict) and isinstance(details.get('previous_details'), list):
+                details = dict(details, previous_details=details['previous_details'][-PREVIOUS_DETAILS_MAX_ITEMS:])
+            trimmed.append((person, details))
+        return trimmed
+
+    @staticmethod
+    def format_profile_context(profile: Dict, max_items: int = PROFILE_SECTION_MAX_ITEMS) -> str:
+        """Format a user profile as a context string for the prompt.
+
+        List sections keep only their max_items most recent entries.
+        """
+        if not profile:
+            return ""
+        
+        context_parts = []
+        
+        if profile.get('personal_info'):
+            context_parts.append("Personal Information:")
+            for k, v in profile['personal_info'].items():
+                context_parts.append(f"- {k}: {v}")
+        
+        if profile.get('relationships'):
+            context_parts.append("\nRelationships:")
+            for person, details in ProfileManager._recent_relationships(profile['relationships'], max_items):
+                context_parts.append(f"- {person}: {details}")
+        
+        if profile.get('important_events'):
+            context_parts.append("\nImportant Life Events:")
+            for event in profile['important_events'][-max_items:]:
+                context_parts.append(f"- {event}")
+        
+        if profile.get('preferences'):
+            context_parts.append("\nPreferences:")
+            for k, v in profile['preferences'].items():
+                context_parts.append(f"- {k}: {v}")
+        
+        if profile.get('goals'):
+            context_parts.append("\nGoals:")
+            for goal in profile['goals'][-max_items:]:
+                context_parts.append(f"- {goal}")
+        
+        return "\n".join(context_parts)
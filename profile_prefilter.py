@@ -0,0 +1,135 @@
+import logging
+import os
+import random
+import re
+import threading
+from typing import Dict, FrozenSet
+
+logger = logging.getLogger(__name__)
+
+# Share of skipped messages still sent to the extractor to measure false skips
+PROFILE_PREFILTER_AUDIT_RATE = float(os.getenv("PROFILE_PREFILTER_AUDIT_RATE", "0.02"))
+
+KINSHIP = (
+    r"mom|mum|mother|dad|father|parents?|sister|brother|siblings?|wife|husband|spouse|partner|"
+    r"boyfriend|girlfriend|fianc[eé]e?|ex|son|daughter|kids?|child(?:ren)?|baby|grandma|grandpa|"
+    r"grandmother|grandfather|grandparents?|aunt|uncle|cousin|niece|nephew|in-laws?|step\w+|"
+    r"friends?|best friend|roommate|boss|manager|coworkers?|colleagues?|classmates?|teacher|"
+    r"neighbou?r|therapist|doctor|pet|dog|cat"
+)
+
+SECTION_PATTERNS = {
+    'personal_info': re.compile(
+        r"\b(?:my name is|call me|i'?m \d+|i am \d+|\d+ years old|i work (?:as|at|in|for)|"
+        r"i'?m an? \w+(?:er|or|ist|ian|ent|ant)\b|i am an? \w+(?:er|or|ist|ian|ent|ant)\b|"
+        r"i live in|i'?m from|i grew up|i study|my job|my (?:pronouns|age|birthday)|"
+        r"i'?m (?:single|married|divorced|retired|unemployed|pregnant|a student))",
+        re.IGNORECASE
+    ),
+    'relationships': re.compile(rf"\b(?:my|our|his|her|their) (?:{KINSHIP})\b", re.IGNORECASE),
+    'important_events': re.compile(
+        r"\b(?:died|passed away|funeral|divorc\w*|married|wedding|engaged|pregnan\w*|gave birth|"
+        r"born|miscarriage|fired|laid off|lost my|new job|quit|promot\w*|graduat\w*|moved|moving|"
+        r"diagnos\w*|hospital\w*|surgery|accident|broke up|break ?up|separated|anniversary|"
+        r"relapse\w*|sober|arrested|evicted|retir\w*)\b",
+        re.IGNORECASE
+    ),
+    'preferences': re.compile(
+        r"\b(?:i (?:really )?(?:like|love|enjoy|prefer|hate|dislike|can'?t stand)|my favou?rite|"
+        r"i'?m (?:into|a fan of)|(?:helps|works for|calms) me|i don'?t (?:like|want|enjoy)|"
+        r"rather you|please don'?t|i find it (?:helpful|easier))\b",
+        re.IGNORECASE
+    ),
+    'goals': re.compile(
+        r"\b(?:i (?:want|wanna|hope|plan|need|intend|wish|would like) to|i'?d like to|"
+        r"my goals?|i'?m (?:trying|hoping|planning|working) (?:to|on)|i'?m going to|"
+        r"resolution|goal is|aim to|dream of)\b",
+        re.IGNORECASE
+    ),
+}
+
+# Capitalized words that aren't names of people, mostly because they start a sentence
+NOT_NAMES = frozenset("""
+i i'm i've i'll i'd im ive ok okay yes no yeah yep nope hi hello hey thanks thank sorry please well
+so but and or because if then now also just maybe actually honestly lately recently sometimes today
+yesterday tomorrow tonight the a an it its it's that that's this there these those they we you he
+she my our your his her their what when where why how who which everything nothing something
+everyone nobody someone anyone all any each every one last next after before since on in at for
+with about to from not never always still even only really very too much many lol um uh oh
+monday tuesday wednesday thursday friday saturday sunday january february march april may june
+july august september october november december christmas easter thanksgiving god lord mr mrs ms
+dr english covid tv work school college life home things stuff people
+""".split())
+
+CAPITALIZED_WORD = re.compile(r"\b[A-Z][a-z]+(?:'[a-z]+)?\b")
+NAMED = re.compile(r"\b(?:named|called|name is|name's)\s+\w+", re.IGNORECASE)
+
+
+def mentions_name(message: str) -> bool:
+    """Whether a message seems to mention a person by name"""
+    if NAMED.search(message):
+        return True
+    return any(word.lower() not in NOT_NAMES for word in CAPITALIZED_WORD.findall(message))
+
+
+class ProfilePrefilter:
+    """Decide locally which profile sections a message could update.
+
+    Messages with no sign of personal facts skip the extraction call. A
+    small random share of them is extracted anyway, and any extracted
+    information is counted as a false skip.
+    """
+
+    def __init__(self, audit_rate: float = PROFILE_PREFILTER_AUDIT_RATE):
+        self.audit_rate = audit_rate
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.skipped = 0
+        self.audited = 0
+        self.false_skips = 0
+        self.section_hits = {section: 0 for section in SECTION_PATTERNS}
+
+    def sections(self, message: str) -> FrozenSet[str]:
+        """Profile sections the message may contain new information for"""
+        found = {section for section, pattern in SECTION_PATTERNS.items() if pattern.search(message)}
+        if mentions_name(message):
+            found.update(('relationships', 'personal_info'))
+
+        with self._lock:
+            self.checked += 1
+            if not found:
+                self.skipped += 1
+            for section in found:
+                self.section_hits[section] += 1
+        return frozenset(found)
+
+    def should_audit(self) -> bool:
+        """Whether to extract from a skipped message anyway"""
+        if random.random() >= self.audit_rate:
+            return False
+        with self._lock:
+            self.audited += 1
+        return True
+
+    def record_audit(self, extracted: Dict):
+        """Count an audited message the extractor did find information in"""
+        if not extracted:
+            return
+        with self._lock:
+            self.false_skips += 1
+        logger.warning(f"Profile prefilter skipped a message with extractable fields {list(extracted)}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "skipped": self.skipped,
+                "skip_rate": self.skipped / self.checked if self.checked else 0.0,
+                "audited": self.audited,
+                "false_skips": self.false_skips,
+                "false_skip_rate": self.false_skips / self.audited if self.audited else 0.0,
+                "section_hits": dict(self.section_hits)
+            }
+
+
+profile_prefilter = ProfilePrefilter()
@@ -0,0 +1,341 @@
+import json
+import logging
+import weakref
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# sqlite:///path/to/cache.db, redis://host:port/db or "none" to disable
+SHARED_CACHE_URL = os.getenv(
+    "SHARED_CACHE_URL",
+    f"sqlite:///{os.path.join(tempfile.gettempdir(), 'thera_ai_cache.sqlite3')}"
+)
+INVALIDATION_CHANNEL = "thera_ai:invalidate"
+
+
+class SharedCache(ABC):
+    """Cache shared by every worker process, with invalidation broadcast.
+
+    A backend has a single invalidation feed per process, so every
+    TieredCache on it registers here and each polled key is handed to all
+    of them rather than to whichever one happened to poll.
+    """
+
+    def __init__(self):
+        self._tiers: "weakref.WeakSet[TieredCache]" = weakref.WeakSet()
+        self._dispatch_lock = threading.Lock()
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def publish_invalidation(self, key: str):
+        """Delete a key and tell every worker to drop its local copy"""
+
+    @abstractmethod
+    def poll_invalidations(self) -> List[str]:
+        """Return keys invalidated by any worker since the last poll"""
+
+    def register(self, tier: "TieredCache"):
+        with self._dispatch_lock:
+            self._tiers.add(tier)
+
+    def dispatch_invalidations(self):
+        """Poll once and drop every invalidated key from the local cache of its namespace.
+
+        Raises if polling fails, after clearing every local cache, since
+        none of them can be trusted without the invalidations.
+        """
+        with self._dispatch_lock:
+            tiers = list(self._tiers)
+            try:
+                keys = self.poll_invalidations()
+            except Exception:
+                for tier in tiers:
+                    tier.local.clear()
+                raise
+            for key in keys:
+                namespace, _, local_key = key.partition(":")
+                for tier in tiers:
+                    if tier.namespace == namespace:
+                        tier.local.invalidate(local_key)
+
+
+class SQLiteCache(SharedCache):
+    """Shared cache in a local SQLite file, for workers on the same host.
+
+    Invalidations are appended to a log table that each process tails.
+    Expired entries are deleted by whichever process writes next once
+    EXPIRED_PURGE_INTERVAL has passed, so the file doesn't grow with every
+    key ever cached.
+    """
+
+    INVALIDATION_RETENTION = 300
+    EXPIRED_PURGE_INTERVAL = 60
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._last_invalidation_id = None
+        self._next_purge = time.time() + self.EXPIRED_PURGE_INTERVAL
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS cache_entries_expires_at
+                ON cache_entries (expires_at)
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_invalidations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._connect().execute(
+            "SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl: float):
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, default=str), now + ttl)
+        )
+        with self._lock:
+            due = now >= self._next_purge
+            if due:
+                self._next_purge = now + self.EXPIRED_PURGE_INTERVAL
+        if due:
+            self.purge_expired(now)
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """Delete expired entries and return how many there were"""
+        cursor = self._connect().execute(
+            "DELETE FROM cache_entries WHERE expires_at <= ?",
+            (time.time() if now is None else now,)
+        )
+        return cursor.rowcount
+
+    def delete(self, key: str):
+        self._connect().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def publish_invalidation(self, key: str):
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            conn.execute(
+                "INSERT INTO cache_invalidations (key, created_at) VALUES (?, ?)",
+                (key, now)
+            )
+            conn.execute(
+                "DELETE FROM cache_invalidations WHERE created_at < ?",
+                (now - self.INVALIDATION_RETENTION,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def poll_invalidations(self) -> List[str]:
+        with self._lock:
+            conn = self._connect()
+            if self._last_invalidation_id is None:
+                # Only invalidations published after this process started matter
+                row = conn.execute("SELECT COALESCE(MAX(id), 0) FROM cache_invalidations").fetchone()
+                self._last_invalidation_id = row[0]
+                return []
+            rows = conn.execute(
+                "SELECT id, key FROM cache_invalidations WHERE id > ? ORDER BY id",
+                (self._last_invalidation_id,)
+            ).fetchall()
+            if rows:
+                self._last_invalidation_id = rows[-1][0]
+            return [key for _, key in rows]
+
+
+class RedisCache(SharedCache):
+    """Shared cache on a Redis-compatible server, invalidated over pub/sub.
+
+    Any client with the redis-py interface can be passed in, such as a
+    fakeredis instance for local testing.
+    """
+
+    def __init__(self, url: Optional[str] = None, client: Any = None, prefix: str = "thera_ai:"):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("The redis package is required for a redis:// SHARED_CACHE_URL")
+            client = redis.Redis.from_url(url)
+        super().__init__()
+        self.client = client
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(INVALIDATION_CHANNEL)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Any, ttl: float):
+        self.client.set(self.prefix + key, json.dumps(value, default=str), px=int(ttl * 1000))
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+    def publish_invalidation(self, key: str):
+        self.client.delete(self.prefix + key)
+        self.client.publish(INVALIDATION_CHANNEL, key)
+
+    def poll_invalidations(self) -> List[str]:
+        keys = []
+        with self._lock:
+            while True:
+                message = self._pubsub.get_message(timeout=0)
+                if message is None:
+                    break
+                if message.get("type") == "message":
+                    data = message["data"]
+                    keys.append(data.decode() if isinstance(data, bytes) else data)
+        return keys
+
+
+class TieredCache:
+    """Per-process LRU cache in front of the shared cache.
+
+    Reads check the local cache first, then the shared one, and writes go to
+    both. Invalidations are broadcast so other workers drop their local copy.
+    """
+
+    def __init__(self, local, shared: Optional[SharedCache], namespace: str):
+        self.local = local
+        self.shared = shared
+        self.namespace = namespace
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+        if shared is not None:
+            shared.register(self)
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _apply_invalidations(self):
+        try:
+            self.shared.dispatch_invalidations()
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"Failed to poll cache invalidations: {str(e)}")
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if self.shared is None:
+            return self.local.get(key)
+
+        self._apply_invalidations()
+        value = self.local.get(key)
+        if value is not None:
+            return value
+
+        try:
+            value = self.shared.get(self._key(key))
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"Shared cache read failed: {str(e)}")
+            return None
+        if value is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        self.local.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self.local.set(key, value)
+        if self.shared is None:
+            return
+        try:
+            self.shared.set(self._key(key), value, self.local.ttl)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"Shared cache write failed: {str(e)}")
+
+    def invalidate(self, key: Hashable):
+        self.local.invalidate(key)
+        if self.shared is None:
+            return
+        try:
+            self.shared.publish_invalidation(self._key(key))
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"Shared cache invalidation failed: {str(e)}")
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self) -> Dict[str, int]:
+        stats = self.local.stats()
+        stats.update({
+            "shared_hits": self.shared_hits,
+            "shared_misses": self.shared_misses,
+            "shared_errors": self.shared_errors
+        })
+        return stats
+
+
+def create_shared_cache(url: str = SHARED_CACHE_URL) -> Optional[SharedCache]:
+    """Build the shared cache backend configured by SHARED_CACHE_URL"""
+    if not url or url.lower() == "none":
+        return None
+    try:
+        if url.startswith("sqlite:///"):
+            return SQLiteCache(url[len("sqlite:///"):])
+        if url.startswith(("redis://", "rediss://", "unix://")):
+            return RedisCache(url)
+        raise ValueError(f"Unsupported SHARED_CACHE_URL: {url}")
+    except Exception as e:
+        logger.error(f"Failed to set up shared cache, using per-process cache only: {str(e)}")
+        return None
+
+
+shared_cache = create_shared_cache()
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import os
+import re
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Sentences synthesized ahead of the one currently being streamed
+TTS_MAX_IN_FLIGHT = int(os.getenv("TTS_MAX_IN_FLIGHT", "3"))
+
+# Shorter fragments are joined with the next sentence to avoid tiny TTS requests
+MIN_SENTENCE_CHARS = int(os.getenv("TTS_MIN_SENTENCE_CHARS", "20"))
+
+SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s+|\n+")
+
+
+async def split_sentences(tokens: AsyncIterator[str],
+                          min_chars: int = MIN_SENTENCE_CHARS) -> AsyncIterator[str]:
+    """Regroup a stream of completion tokens into complete sentences"""
+    buffer = ""
+    async for token in tokens:
+        buffer += token
+        start = 0
+        for match in SENTENCE_END.finditer(buffer):
+            if match.end() - start < min_chars:
+                continue
+            sentence = buffer[start:match.end()].strip()
+            start = match.end()
+            if sentence:
+                yield sentence
+        buffer = buffer[start:]
+    if buffer.strip():
+        yield buffer.strip()
+
+
+async def synthesize_in_order(sentences: AsyncIterator[str],
+                              synthesize: Callable[[str], Awaitable[Optional[bytes]]],
+                              max_in_flight: int = TTS_MAX_IN_FLIGHT) -> AsyncIterator[bytes]:
+    """Synthesize sentences concurrently and yield their audio in order.
+
+    Each sentence is sent to TTS as soon as it is complete, while earlier
+    sentences are still being synthesized or streamed to the client.
+    """
+    pending: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(max(1, max_in_flight))
+
+    async def produce():
+        try:
+            async for sentence in sentences:
+                await slots.acquire()
+                pending.put_nowait(asyncio.ensure_future(synthesize(sentence)))
+        finally:
+            pending.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            task = await pending.get()
+            if task is None:
+                break
+            audio = await task
+            slots.release()
+            if audio:
+                yield audio
+        # Surface errors from the token stream
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+        while not pending.empty():
+            task = pending.get_nowait()
+            if task is not None:
+                task.cancel()
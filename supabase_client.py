@@ -1,16 +1,2 @@
-from supabase import create_client
-from dotenv import load_dotenv
-import os
-
-# Load environment variables
-load_dotenv()
-
-# Get Supabase credentials
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-
-if not supabase_url or not supabase_key:
-    raise ValueError("Missing Supabase credentials. Please check your .env file")
-
-# Initialize Supabase client
-supabase = create_client(supabase_url, supabase_key) 
\ No newline at end of file
+# The Supabase client lives in the shared client registry
+from clients import supabase
@@ -0,0 +1,34 @@
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import app
+from conversation_journal import conversation_journal
+
+
+@pytest.fixture
+def client():
+    # Without the context manager startup doesn't run, so no background tasks start
+    return TestClient(app.app)
+
+
+@pytest.mark.parametrize("method, path, body", [
+    ("post", "/chat", {"session_id": "not-a-uuid", "message": "hi"}),
+    ("post", "/chat/stream", {"session_id": "not-a-uuid", "message": "hi"}),
+    ("post", "/chat/voice", {"session_id": "not-a-uuid", "message": "hi"}),
+    ("get", "/conversations/not-a-uuid", None),
+    ("get", "/conversations/not-a-uuid/search?q=hello", None),
+])
+def test_non_uuid_session_id_is_rejected_before_anything_is_stored(client, method, path, body):
+    depth = conversation_journal.depth()
+    response = getattr(client, method)(path, **({"json": body} if body else {}))
+    assert response.status_code == 400
+    assert response.json() == {"detail": "session_id must be a UUID"}
+    assert conversation_journal.depth() == depth
+
+
+def test_voice_socket_closes_for_non_uuid_session_id(client):
+    with client.websocket_connect("/ws/voice?session_id=not-a-uuid") as websocket:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_bytes()
+    assert closed.value.code == 1008
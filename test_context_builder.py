@@ -0,0 +1,166 @@
+from datetime import datetime, timezone
+
+from context_builder import build_context, summary_backlog_before, summary_due, unsummarized
+from conversation import history_from_rows, parse_timestamp
+
+
+def row(i, created_at, text="hello"):
+    return {"id": f"row-{i}", "created_at": created_at, "user_message": text, "ai_response": text}
+
+
+def test_parse_timestamp_accepts_database_and_journal_formats():
+    expected = datetime(2024, 5, 1, 12, 0, 0, 100000, tzinfo=timezone.utc)
+    assert parse_timestamp("2024-05-01T12:00:00.1+00:00") == expected
+    assert parse_timestamp("2024-05-01 12:00:00.1+00") == expected
+    assert parse_timestamp("2024-05-01T12:00:00.100000") == expected
+    assert parse_timestamp("2024-05-01T12:00:00.1Z") == expected
+    assert parse_timestamp(None) is None
+
+
+def test_history_is_sorted_by_time_not_string():
+    rows = [
+        row(1, "2024-05-01T12:00:00.2+00:00", "second"),
+        # 12:00:00.1 UTC, though it sorts last as a string
+        row(2, "2024-05-01T13:00:00.1+01:00", "first"),
+        row(3, "2024-05-01T12:00:00.3Z", "third"),
+    ]
+    assert [turn.content for turn in history_from_rows(rows)][::2] == ["first", "second", "third"]
+    context, overflow = build_context({}, rows, "hi", "")
+    assert [turn.content for turn in context.history][::2] == ["first", "second", "third"]
+
+
+def test_client_history_without_timestamps_keeps_the_newest_turns():
+    history = [
+        {"user_message": f"message {i} " + "word " * 40, "ai_response": f"reply {i}"}
+        for i in range(10)
+    ]
+    context, overflow = build_context({}, history, "hi", "", budget=300)
+    kept = [turn.content.split(" word")[0] for turn in context.history if turn.role == "user"]
+    assert kept and kept[-1] == "message 9"
+    assert kept == [f"message {i}" for i in range(10 - len(kept), 10)]
+    assert [r["user_message"].split(" word")[0] for r in overflow] == [f"message {i}" for i in range(10 - len(kept))]
+
+
+def test_unsummarized_compares_times_not_strings():
+    profile = {"summarized_through": "2024-05-01T12:00:00.1+00:00"}
+    rows = [
+        # Sorts after the bound as a string, but is 50 ms earlier
+        row(1, "2024-05-01T12:00:00.05+00:00"),
+        row(2, "2024-05-01T12:00:00.2+00:00"),
+        row(3, "2024-05-01T12:00:00.100000"),
+    ]
+    assert [r["id"] for r in unsummarized(profile, rows)] == ["row-2"]
+    assert len(unsummarized({}, rows)) == 3
+
+
+def test_rows_scrolled_out_of_a_full_window_need_summarizing():
+    rows = [row(i, f"2024-05-01T12:{i:02d}:00+00:00") for i in range(10)]
+    context, overflow = build_context({}, rows, "hi", "")
+    # Short exchanges all fit, so nothing overflows the budget...
+    assert overflow == []
+    # ...but older turns beyond the window were never summarized
+    assert summary_backlog_before({}, rows, fetch_limit=10) == "2024-05-01T12:00:00+00:00"
+
+
+def test_no_backlog_when_window_is_not_full_or_already_summarized():
+    rows = [row(i, f"2024-05-01T12:{i:02d}:00+00:00") for i in range(10)]
+    assert summary_backlog_before({}, rows[:5], fetch_limit=10) is None
+    profile = {"summarized_through": "2024-05-01T12:00:00+00:00"}
+    assert summary_backlog_before(profile, rows, fetch_limit=10) is None
+    profile = {"summarized_through": "2024-05-01T11:59:00+00:00"}
+    assert summary_backlog_before(profile, rows, fetch_limit=10) == "2024-05-01T12:00:00+00:00"
+
+
+def test_summary_waits_for_a_batch_of_rows():
+    rows = [row(i, f"2024-05-01T12:{i:02d}:00+00:00") for i in range(15)]
+    newest_first = rows[::-1]
+    older = newest_first[10:]
+    assert [r["id"] for r in summary_due({}, [], older, batch_size=5)] == [f"row-{i}" for i in range(5)]
+    assert summary_due({}, [], older[:4], batch_size=5) == []
+    # Already summarized rows don't count towards the batch
+    profile = {"summarized_through": rows[0]["created_at"]}
+    assert summary_due(profile, [], older, batch_size=5) == []
+    assert len(summary_due(profile, [rows[5]], older, batch_size=5)) == 5
+
+
+def test_established_user_is_summarized_once_per_batch_not_per_turn():
+    profile = {}
+    rows = []
+    updates = 0
+    for turn in range(40):
+        rows.append(row(turn, f"2024-05-01T12:{turn:02d}:00+00:00"))
+        fetched = rows[::-1][:15]
+        context, overflow = build_context(profile, fetched[:10], "hi", "")
+        pending = summary_due(profile, overflow, fetched[10:], batch_size=5)
+        if pending:
+            updates += 1
+            profile = {"summarized_through": pending[-1]["created_at"]}
+    # Rows start leaving the window at turn 10 and the batch first fills at turn 14
+    assert updates == 6
+    assert profile["summarized_through"] == rows[39 - 10]["created_at"]
+
+
+class FakeTable:
+    def __init__(self):
+        self.updates = []
+
+    def update(self, values):
+        self.updates.append(values)
+        return self
+
+    def eq(self, *args):
+        return self
+
+    def execute(self):
+        return type("Result", (), {"data": [dict(self.updates[-1], user_id="user-1")]})()
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.profiles = FakeTable()
+
+    def table(self, name):
+        return self.profiles
+
+
+def summarize_with(monkeypatch, profile, backlog, overflow, before):
+    import profile_manager
+    from profile_manager import ProfileManager
+
+    fake = FakeSupabase()
+    summarized = []
+    monkeypatch.setattr(profile_manager, "supabase", fake)
+    monkeypatch.setattr(ProfileManager, "get_user_profile", staticmethod(lambda user_id: profile))
+    monkeypatch.setattr(ProfileManager, "invalidate_profile", staticmethod(lambda user_id: None))
+    cached = []
+    monkeypatch.setattr(ProfileManager, "_cache_profile", staticmethod(lambda user_id, profile: cached.append(profile)))
+    monkeypatch.setattr(
+        ProfileManager, "get_unsummarized_conversations",
+        staticmethod(lambda user_id, after, before, limit=None: backlog)
+    )
+    monkeypatch.setattr(
+        ProfileManager, "summarize_conversations",
+        staticmethod(lambda summary, rows: summarized.extend(rows) or "summary")
+    )
+    assert ProfileManager.update_conversation_summary("user-1", overflow, before)
+    # The updated profile is cached for the next turn rather than only invalidated
+    assert cached == [dict(fake.profiles.updates[-1], user_id="user-1")]
+    return [r["id"] for r in summarized], fake.profiles.updates
+
+
+def test_summary_folds_in_rows_beyond_the_window(monkeypatch):
+    backlog = [row(0, "2024-05-01T11:00:00+00:00"), row(1, "2024-05-01T11:30:00+00:00")]
+    overflow = [row(2, "2024-05-01T12:00:00+00:00")]
+    ids, updates = summarize_with(monkeypatch, {}, backlog, overflow, "2024-05-01T12:00:00+00:00")
+    assert ids == ["row-0", "row-1", "row-2"]
+    assert updates[0]["summarized_through"] == "2024-05-01T12:00:00+00:00"
+
+
+def test_summary_catches_up_on_a_large_backlog_before_newer_rows(monkeypatch):
+    import profile_manager
+    monkeypatch.setattr(profile_manager, "SUMMARY_BACKLOG_LIMIT", 2)
+    backlog = [row(0, "2024-05-01T11:00:00+00:00"), row(1, "2024-05-01T11:30:00+00:00")]
+    overflow = [row(2, "2024-05-01T12:00:00+00:00")]
+    ids, updates = summarize_with(monkeypatch, {}, backlog, overflow, "2024-05-01T12:00:00+00:00")
+    assert ids == ["row-0", "row-1"]
+    assert updates[0]["summarized_through"] == "2024-05-01T11:30:00+00:00"
@@ -0,0 +1,183 @@
+import time
+import uuid
+
+import pytest
+from postgrest.exceptions import APIError
+
+import conversation_journal
+from conversation import parse_timestamp
+from conversation_journal import ConversationJournal, merge_pending
+
+
+USER = str(uuid.UUID(int=1))
+OTHER_USER = str(uuid.UUID(int=2))
+
+
+class FakeConversations:
+    """The conversations table, honoring upsert with ignore_duplicates"""
+
+    def __init__(self):
+        self.rows = {}
+        self.batches = []
+        self.fail = False
+        self._pending = None
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False, returning=None):
+        assert on_conflict == 'id' and ignore_duplicates
+        self._pending = rows
+        return self
+
+    def execute(self):
+        if self.fail:
+            raise RuntimeError("database unavailable")
+        for row in self._pending:
+            try:
+                uuid.UUID(row['user_id'])
+            except ValueError:
+                raise APIError({"code": "22P02", "message": f"invalid input syntax for type uuid: \"{row['user_id']}\""})
+        self.batches.append([row['id'] for row in self._pending])
+        for row in self._pending:
+            self.rows.setdefault(row['id'], row)
+        return type("Result", (), {"data": []})()
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.conversations = FakeConversations()
+
+    def table(self, name):
+        assert name == 'conversations'
+        return self.conversations
+
+
+@pytest.fixture
+def database(monkeypatch):
+    fake = FakeSupabase()
+    monkeypatch.setattr(conversation_journal, "supabase", fake)
+    return fake.conversations
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "journal.sqlite3")
+
+
+def test_append_writes_utc_timestamps_and_reads_newest_first(database, journal_path):
+    journal = ConversationJournal(journal_path)
+    first = journal.append(USER, "hi", "hello")
+    time.sleep(0.001)
+    second = journal.append(USER, "again", "hello again")
+    journal.append(OTHER_USER, "other", "user")
+
+    assert parse_timestamp(first['created_at']).utcoffset().total_seconds() == 0
+    assert first['created_at'].endswith("+00:00")
+    assert [row['id'] for row in journal.pending(USER)] == [second['id'], first['id']]
+    assert journal.depth() == 3
+    assert database.rows == {}
+
+
+def test_flush_inserts_in_batches_and_empties_journal(database, journal_path):
+    journal = ConversationJournal(journal_path, batch_size=2)
+    ids = [journal.append(USER, f"message {i}", "reply")['id'] for i in range(5)]
+
+    assert journal.flush() == 5
+    assert [len(batch) for batch in database.batches] == [2, 2, 1]
+    assert set(database.rows) == set(ids)
+    assert journal.depth() == 0
+    assert journal.stats()['batches'] == 3
+
+
+def test_claimed_rows_are_skipped_until_the_lease_runs_out(database, journal_path):
+    crashed = ConversationJournal(journal_path)
+    crashed.CLAIM_LEASE = 0.2
+    row = crashed.append(USER, "hi", "hello")
+    # A worker claims the batch and dies before inserting it
+    assert [row_id for row_id, _ in crashed._claim()] == [row['id']]
+
+    survivor = ConversationJournal(journal_path)
+    assert survivor.flush() == 0
+    assert survivor.depth() == 1
+
+    time.sleep(0.25)
+    assert survivor.flush() == 1
+    assert list(database.rows) == [row['id']]
+
+
+def test_replaying_an_inserted_batch_does_not_duplicate_it(database, journal_path):
+    journal = ConversationJournal(journal_path)
+    row = journal.append(USER, "hi", "hello")
+    # Inserted, but the worker died before removing the batch from the journal
+    claimed = journal._claim()
+    database.upsert([r for _, r in claimed], on_conflict='id', ignore_duplicates=True).execute()
+    journal._release([row_id for row_id, _ in claimed], delete=False)
+
+    replayed = ConversationJournal(journal_path)
+    assert replayed.flush() == 1
+    assert len(database.batches) == 2
+    assert list(database.rows) == [row['id']]
+    assert replayed.depth() == 0
+
+
+def test_failed_flush_keeps_rows_for_the_next_attempt(database, journal_path):
+    journal = ConversationJournal(journal_path)
+    row = journal.append(USER, "hi", "hello")
+
+    database.fail = True
+    assert journal.flush() == 0
+    assert journal.errors == 1
+    assert [r['id'] for r in journal.pending(USER)] == [row['id']]
+
+    # The lease is released, so the retry doesn't wait for it to expire
+    database.fail = False
+    assert journal.flush() == 1
+    assert journal.depth() == 0
+
+
+def test_rejected_row_is_dead_lettered_without_blocking_the_rest(database, journal_path):
+    journal = ConversationJournal(journal_path, batch_size=50)
+    journal.append("not-a-uuid", "hi", "hello")
+    time.sleep(0.001)
+    ids = [journal.append(USER, f"message {i}", "reply")['id'] for i in range(200)]
+
+    assert journal.flush() == 200
+    assert set(database.rows) == set(ids)
+    assert journal.depth() == 0
+    assert journal.stats()['dead_lettered'] == 1
+    # Later flushes don't keep retrying it
+    assert journal.flush() == 0
+
+
+def test_outage_during_row_by_row_retry_releases_the_rest(database, journal_path, monkeypatch):
+    journal = ConversationJournal(journal_path)
+    journal.append("not-a-uuid", "hi", "hello")
+    time.sleep(0.001)
+    journal.append(USER, "message", "reply")
+
+    def outage(rows):
+        if len(rows) == 1:
+            raise RuntimeError("database unavailable")
+        return original(rows)
+    original = journal._insert
+    monkeypatch.setattr(journal, "_insert", outage)
+
+    assert journal.flush() == 0
+    # Nothing is dead-lettered for an error that isn't about the data
+    assert journal.stats()['dead_lettered'] == 0
+    assert journal.depth() == 2
+    assert len(journal._claim()) == 2
+
+
+def test_merge_pending_orders_by_time_across_formats():
+    rows = [
+        {"id": "db-2", "created_at": "2024-05-01 12:00:00.2+00"},
+        {"id": "db-1", "created_at": "2024-05-01T12:00:00.05+00:00"},
+    ]
+    pending = [
+        # Also still in the database result, so kept once
+        {"id": "db-2", "created_at": "2024-05-01T12:00:00.200000+00:00"},
+        # Sorts before db-1 as a string, but is later
+        {"id": "journal-1", "created_at": "2024-05-01T12:00:00.100000+00:00"},
+    ]
+    merged = merge_pending(rows, pending, limit=10)
+    assert [row["id"] for row in merged] == ["db-2", "journal-1", "db-1"]
+    assert [row["id"] for row in merge_pending(rows, pending, limit=2)] == ["db-2", "journal-1"]
@@ -0,0 +1,48 @@
+import asyncio
+
+from extraction_queue import ProfileExtractionQueue
+from profile_manager import ProfileManager
+
+
+def test_summaries_between_messages_do_not_split_the_batch(monkeypatch):
+    extractions = []
+    summaries = []
+    monkeypatch.setattr(ProfileManager, "update_profile_from_messages",
+                        staticmethod(lambda user_id, messages, profile: extractions.append(list(messages)) or True))
+    monkeypatch.setattr(ProfileManager, "update_conversation_summary",
+                        staticmethod(lambda user_id, rows, before: summaries.append(before) or True))
+    queue = ProfileExtractionQueue(num_workers=1, batch_window_ms=200, batch_size=8)
+
+    async def scenario():
+        queue.start()
+        # What a busy established user queues: a summary for each turn, then its message
+        for turn in range(4):
+            queue.submit_summary("user-1", [], f"turn {turn}")
+            queue.submit("user-1", f"message {turn}")
+            await asyncio.sleep(0.01)
+        await queue.drain()
+
+    asyncio.run(scenario())
+    assert summaries == ["turn 0", "turn 1", "turn 2", "turn 3"]
+    assert extractions == [["message 0", "message 1", "message 2", "message 3"]]
+    assert queue.stats()["messages_per_batch"] == 4.0
+
+
+def test_other_jobs_still_run_after_pending_messages(monkeypatch):
+    order = []
+    monkeypatch.setattr(ProfileManager, "update_profile_from_messages",
+                        staticmethod(lambda user_id, messages, profile: order.append(("extract", messages)) or True))
+    queue = ProfileExtractionQueue(num_workers=1, batch_window_ms=200, batch_size=8)
+
+    def after(user_id):
+        order.append(("after", user_id))
+        return True
+
+    async def scenario():
+        queue.start()
+        queue.submit("user-1", "message 0")
+        queue._enqueue("user-1", after)
+        await queue.drain()
+
+    asyncio.run(scenario())
+    assert order == [("extract", ["message 0"]), ("after", "user-1")]
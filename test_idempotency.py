@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from idempotency import IdempotencyConflict, IdempotentRequests, fingerprint
+from profile_cache import TTLCache
+from shared_cache import SQLiteCache, TieredCache
+
+
+def make_worker(path):
+    """A worker's idempotency store backed by a shared SQLite cache file"""
+    requests = IdempotentRequests()
+    requests.results = TieredCache(TTLCache(ttl=60), SQLiteCache(path), "idempotency")
+    return requests
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "cache.sqlite3")
+
+
+class Handler:
+    """Counts calls and holds each one until released"""
+
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+        self.release = None
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("upstream failed")
+        return {"response": f"reply {self.calls}"}
+
+
+def test_fingerprint_separates_parts():
+    assert fingerprint("chat", "ab", "c") != fingerprint("chat", "a", "bc")
+    assert fingerprint("chat", b"audio") == fingerprint("chat", "audio")
+
+
+def test_concurrent_duplicates_share_one_execution(cache_path):
+    requests = make_worker(cache_path)
+    handler = Handler()
+    request = fingerprint("chat", "user-1", "hello")
+
+    async def scenario():
+        handler.release = asyncio.Event()
+        calls = [asyncio.ensure_future(requests.run("key-1", request, handler)) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        handler.release.set()
+        return await asyncio.gather(*calls)
+
+    results = asyncio.run(scenario())
+    assert handler.calls == 1
+    assert [response for response, _ in results] == [{"response": "reply 1"}] * 5
+    assert sorted(replayed for _, replayed in results) == [False, True, True, True, True]
+    assert requests.stats() == {"in_flight": 0, "executed": 1, "coalesced": 4, "replayed": 0}
+
+
+def test_completed_response_is_replayed_by_another_worker(cache_path):
+    handler = Handler()
+    request = fingerprint("chat", "user-1", "hello")
+
+    async def scenario():
+        handler.release = asyncio.Event()
+        handler.release.set()
+        first = await make_worker(cache_path).run("key-1", request, handler)
+        second = await make_worker(cache_path).run("key-1", request, handler)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == ({"response": "reply 1"}, False)
+    assert second == ({"response": "reply 1"}, True)
+    assert handler.calls == 1
+
+
+def test_reusing_a_key_for_a_different_request_conflicts(cache_path):
+    requests = make_worker(cache_path)
+    handler = Handler()
+
+    async def scenario():
+        handler.release = asyncio.Event()
+        running = asyncio.ensure_future(requests.run("key-1", fingerprint("hello"), handler))
+        await asyncio.sleep(0.05)
+        # Conflicts with the request still in flight...
+        with pytest.raises(IdempotencyConflict):
+            await requests.run("key-1", fingerprint("goodbye"), handler)
+        handler.release.set()
+        await running
+        # ...and with the stored response once it completes
+        with pytest.raises(IdempotencyConflict):
+            await requests.run("key-1", fingerprint("goodbye"), handler)
+
+    asyncio.run(scenario())
+    assert handler.calls == 1
+
+
+def test_failures_are_not_replayed(cache_path):
+    requests = make_worker(cache_path)
+    handler = Handler(fail=True)
+    request = fingerprint("hello")
+
+    async def scenario():
+        handler.release = asyncio.Event()
+        handler.release.set()
+        with pytest.raises(RuntimeError):
+            await requests.run("key-1", request, handler)
+        handler.fail = False
+        return await requests.run("key-1", request, handler)
+
+    assert asyncio.run(scenario()) == ({"response": "reply 2"}, False)
+    assert handler.calls == 2
@@ -0,0 +1,48 @@
+import re
+
+from metrics import Metrics, MetricsStore
+
+
+def sample(text, name):
+    return float(re.search(rf"^{re.escape(name)} (\S+)$", text, re.M).group(1))
+
+
+def test_scrape_adds_up_every_worker(tmp_path):
+    path = str(tmp_path / "metrics.sqlite3")
+    workers = [Metrics() for _ in range(4)]
+    stores = [MetricsStore(path, registry=registry) for registry in workers]
+    for i, registry in enumerate(workers):
+        for _ in range(i + 1):
+            registry.observe_request("/chat", 0.2, 200)
+        registry.observe_stage("whisper", 0.3, error=i == 0)
+        stores[i].publish()
+
+    # Whichever worker the scrape reaches reports the same totals
+    for store in stores:
+        text = store.render()
+        assert sample(text, 'thera_responses_total{path="/chat",status="200"}') == 10
+        assert sample(text, 'thera_request_duration_seconds_count{path="/chat"}') == 10
+        assert sample(text, 'thera_request_duration_seconds_bucket{path="/chat",le="0.25"}') == 10
+        assert sample(text, 'thera_stage_duration_seconds_count{stage="whisper"}') == 4
+        assert sample(text, 'thera_stage_errors_total{stage="whisper"}') == 1
+
+
+def test_totals_do_not_drop_when_a_worker_is_replaced(tmp_path):
+    path = str(tmp_path / "metrics.sqlite3")
+    old = Metrics()
+    old.observe_request("/chat", 0.1, 200)
+    MetricsStore(path, registry=old).publish()
+
+    replacement = MetricsStore(path, registry=Metrics())
+    text = replacement.render()
+    assert sample(text, 'thera_responses_total{path="/chat",status="200"}') == 1
+
+
+def test_publish_replaces_the_workers_own_snapshot(tmp_path):
+    registry = Metrics()
+    store = MetricsStore(str(tmp_path / "metrics.sqlite3"), registry=registry)
+    registry.observe_request("/chat", 0.1, 200)
+    store.publish()
+    registry.observe_request("/chat", 0.1, 200)
+    text = store.render()
+    assert sample(text, 'thera_responses_total{path="/chat",status="200"}') == 2
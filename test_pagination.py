@@ -0,0 +1,135 @@
+import base64
+import json
+import re
+import uuid
+
+import pytest
+
+import profile_manager
+from conversation import parse_timestamp
+from profile_manager import ProfileManager, decode_cursor, encode_cursor
+
+USER = str(uuid.UUID(int=1))
+KEYSET = re.compile(r'^created_at\.lt\."(.+)",and\(created_at\.eq\."(.+)",id\.lt\.(.+)\)$')
+
+
+def conversation(n, created_at):
+    return {"id": str(uuid.UUID(int=n)), "created_at": created_at, "user_message": f"message {n}"}
+
+
+def key(row):
+    return parse_timestamp(row["created_at"]), row["id"]
+
+
+class FakeQuery:
+    """Enough of a PostgREST query on conversations to run the keyset filter"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.before = None
+        self.count = None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.rows = [row for row in self.rows if row["user_id"] == value]
+        return self
+
+    def or_(self, filters):
+        created_at, tied_at, conversation_id = KEYSET.match(filters).groups()
+        assert created_at == tied_at
+        self.before = (parse_timestamp(created_at), conversation_id)
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def execute(self):
+        rows = [row for row in self.rows if self.before is None or key(row) < self.before]
+        rows.sort(key=key, reverse=True)
+        return type("Result", (), {"data": rows[:self.count]})()
+
+
+class FakeJournal:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def pending(self, user_id):
+        return list(self.rows)
+
+
+@pytest.fixture
+def history(monkeypatch):
+    """Database rows with tied timestamps in the formats Postgres returns"""
+    rows = [
+        conversation(1, "2024-05-01 12:00:00+00"),
+        conversation(2, "2024-05-01 12:00:00.5+00"),
+        conversation(3, "2024-05-01 12:00:00.5+00"),
+        conversation(4, "2024-05-01 12:00:00.5+00"),
+        conversation(5, "2024-05-01 12:00:01.25+00"),
+        conversation(6, "2024-05-01 12:00:02+00"),
+        conversation(7, "2024-05-01 12:00:02+00"),
+    ]
+    for row in rows:
+        row["user_id"] = USER
+    monkeypatch.setattr(profile_manager, "supabase", type("Supabase", (), {
+        "table": lambda self, name: FakeQuery(list(rows))
+    })())
+    monkeypatch.setattr(profile_manager, "conversation_journal", FakeJournal([]))
+    return rows
+
+
+def cursor_for(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def test_cursor_round_trip():
+    row = conversation(9, "2024-05-01T12:00:00.123456+00:00")
+    assert decode_cursor(encode_cursor(row)) == (row["created_at"], row["id"])
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    cursor_for({"created_at": "2024-05-01T12:00:00+00:00"}),
+    cursor_for(["2024-05-01T12:00:00+00:00", "not-a-uuid"]),
+    cursor_for(['2024-05-01T12:00:00",id.gt.(', str(uuid.UUID(int=1))]),
+    cursor_for(["12345", str(uuid.UUID(int=1))]),
+])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_pages_cover_the_history_once_across_tied_timestamps(history):
+    seen = []
+    before = None
+    while True:
+        page = ProfileManager.get_conversation_page(USER, limit=2, before=before)
+        if not page:
+            break
+        seen.extend(row["id"] for row in page)
+        before = decode_cursor(encode_cursor(page[-1]))
+
+    expected = [row["id"] for row in sorted(history, key=key, reverse=True)]
+    assert seen == expected
+
+
+def test_pending_rows_respect_the_cursor(history, monkeypatch):
+    boundary = history[2]
+    monkeypatch.setattr(profile_manager, "conversation_journal", FakeJournal([
+        # Newer than the cursor: already shown on an earlier page
+        conversation(20, "2024-05-01T12:00:03.000000+00:00"),
+        # Same instant as the cursor with a higher id: also already shown
+        conversation(21, "2024-05-01T12:00:00.500000+00:00"),
+        # Same instant with a lower id: belongs after the cursor
+        conversation(0, "2024-05-01T12:00:00.500000+00:00"),
+    ]))
+    before = decode_cursor(encode_cursor(boundary))
+
+    page = ProfileManager.get_conversation_page(USER, limit=10, before=before)
+    assert [row["id"] for row in page] == [history[1]["id"], str(uuid.UUID(int=0)), history[0]["id"]]
@@ -0,0 +1,117 @@
+import pytest
+
+from profile_cache import TTLCache
+from shared_cache import RedisCache, SharedCache, SQLiteCache, TieredCache
+
+
+def make_worker(backend):
+    """The profile and conversation caches of one worker process"""
+    return (
+        TieredCache(TTLCache(), backend, "profile"),
+        TieredCache(TTLCache(), backend, "conversations")
+    )
+
+
+def sqlite_backends(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    return SQLiteCache(path), SQLiteCache(path)
+
+
+def redis_backends(tmp_path):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return (
+        RedisCache(client=fakeredis.FakeRedis(server=server)),
+        RedisCache(client=fakeredis.FakeRedis(server=server))
+    )
+
+
+@pytest.fixture(params=[sqlite_backends, redis_backends], ids=["sqlite", "redis"])
+def backends(request, tmp_path):
+    return request.param(tmp_path)
+
+
+def test_invalidation_reaches_namespace_that_polls_second(backends):
+    backend_a, backend_b = backends
+    profiles_a, conversations_a = make_worker(backend_a)
+    profiles_b, conversations_b = make_worker(backend_b)
+
+    conversations_b.set("user-1", {"rows": ["old"]})
+    profiles_b.set("user-1", {"profile": "old"})
+    # Start worker B's invalidation feed before A publishes
+    assert conversations_b.get("user-1") == {"rows": ["old"]}
+
+    conversations_a.invalidate("user-1")
+    # The profile lookup polls first and must not swallow the conversations key
+    assert profiles_b.get("user-1") == {"profile": "old"}
+    assert conversations_b.get("user-1") is None
+
+
+def test_invalidation_only_drops_its_own_namespace(backends):
+    backend_a, backend_b = backends
+    profiles_a, _ = make_worker(backend_a)
+    profiles_b, conversations_b = make_worker(backend_b)
+
+    conversations_b.set("user-1", {"rows": ["kept"]})
+    profiles_b.set("user-1", {"profile": "old"})
+    conversations_b.get("user-1")
+
+    profiles_a.invalidate("user-1")
+    assert conversations_b.get("user-1") == {"rows": ["kept"]}
+    assert profiles_b.get("user-1") is None
+
+
+def test_write_is_visible_to_other_worker(backends):
+    backend_a, backend_b = backends
+    profiles_a, _ = make_worker(backend_a)
+    profiles_b, _ = make_worker(backend_b)
+
+    profiles_a.set("user-1", {"profile": "new"})
+    assert profiles_b.get("user-1") == {"profile": "new"}
+    assert profiles_b.shared_hits == 1
+
+
+def test_failed_poll_clears_every_local_cache(tmp_path):
+    backend = SQLiteCache(str(tmp_path / "cache.sqlite3"))
+    profiles, conversations = make_worker(backend)
+    profiles.set("user-1", {"profile": "cached"})
+    conversations.set("user-1", {"rows": []})
+
+    def broken_poll():
+        raise RuntimeError("backend down")
+    backend.poll_invalidations = broken_poll
+
+    profiles.get("user-1")
+    assert profiles.shared_errors == 1
+    assert conversations.local.get("user-1") is None
+
+
+def test_shared_cache_is_abstract():
+    with pytest.raises(TypeError):
+        SharedCache()
+
+
+def test_expired_entries_are_purged_on_a_later_write(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.sqlite3")
+    backend = SQLiteCache(path)
+    now = [1000.0]
+    monkeypatch.setattr("shared_cache.time.time", lambda: now[0])
+    backend._next_purge = now[0] + backend.EXPIRED_PURGE_INTERVAL
+
+    for i in range(100):
+        backend.set(f"idempotency:key-{i}", {"response": i}, 10)
+    backend.set("profile:user-1", {"profile": "kept"}, 600)
+
+    def rows():
+        return backend._connect().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+    now[0] += 30
+    backend.set("transcripts:a", "text", 10)
+    # Expired, but not yet purged until the interval has passed
+    assert rows() == 102
+
+    now[0] += backend.EXPIRED_PURGE_INTERVAL
+    backend.set("transcripts:b", "text", 10)
+    assert rows() == 2
+    assert backend.get("profile:user-1") == {"profile": "kept"}
+    assert backend.get("transcripts:b") == "text"
@@ -0,0 +1,97 @@
+import numpy as np
+
+from voice_stream import (
+    MAX_CHUNK_SECONDS, RING_BUFFER_SECONDS, VAD_PREROLL_MS,
+    EnergyVAD, RingBuffer, UtteranceSegmenter, pcm16_to_float
+)
+
+RATE = 8000
+
+
+def tone(seconds, rate=RATE):
+    t = np.arange(int(seconds * rate)) / rate
+    return (0.5 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+
+
+def silence(seconds, rate=RATE):
+    return np.zeros(int(seconds * rate), dtype=np.float32)
+
+
+def feed_in_packets(segmenter, samples, packet=160):
+    events = []
+    for offset in range(0, len(samples), packet):
+        events.extend(segmenter.feed(samples[offset:offset + packet]))
+    return events
+
+
+def summary(events):
+    return [(kind, len(samples)) for kind, samples in events]
+
+
+def test_pcm16_to_float_drops_a_trailing_odd_byte():
+    data = np.array([0, 16384, -32768], dtype="<i2").tobytes() + b"\x01"
+    assert pcm16_to_float(data).tolist() == [0.0, 0.5, -1.0]
+
+
+def test_ring_buffer_reads_by_absolute_position_across_the_wrap():
+    ring = RingBuffer(8)
+    ring.write(np.arange(6, dtype=np.float32))
+    ring.write(np.arange(6, 11, dtype=np.float32))
+    assert (ring.start, ring.end) == (3, 11)
+    assert ring.read(5, 10).tolist() == [5, 6, 7, 8, 9]
+    # Positions that were overwritten or not written yet are clipped
+    assert ring.read(0, 20).tolist() == list(range(3, 11))
+    assert len(ring.read(12, 15)) == 0
+
+
+def test_ring_buffer_keeps_the_tail_of_an_oversized_write():
+    ring = RingBuffer(4)
+    ring.write(np.array([1], dtype=np.float32))
+    ring.write(np.arange(10, dtype=np.float32))
+    assert ring.end == 11
+    assert ring.read(0, 11).tolist() == [6, 7, 8, 9]
+
+
+def test_vad_flags_speech_above_the_noise_floor():
+    vad = EnergyVAD()
+    frames = np.stack([silence(0.02), silence(0.02), tone(0.02), silence(0.02)])
+    assert vad.classify(frames).tolist() == [False, False, True, False]
+
+
+def test_utterance_ends_after_a_long_pause():
+    segmenter = UtteranceSegmenter(RATE)
+    events = feed_in_packets(segmenter, np.concatenate([silence(1), tone(1), silence(1)]))
+    assert [kind for kind, _ in events] == ["end"]
+    preroll = RATE * VAD_PREROLL_MS // 1000
+    # The pre-roll, the speech and the pause that ended it
+    assert len(events[0][1]) == preroll + RATE + RATE * 800 // 1000
+
+
+def test_long_speech_is_cut_into_chunks_at_the_maximum():
+    segmenter = UtteranceSegmenter(RATE)
+    events = feed_in_packets(segmenter, np.concatenate([silence(0.5), tone(MAX_CHUNK_SECONDS + 2)]))
+    assert [kind for kind, _ in events] == ["chunk"]
+    assert len(events[0][1]) == int(MAX_CHUNK_SECONDS * RATE)
+
+
+def test_frame_longer_than_the_ring_buffer_matches_streaming():
+    audio = silence(RING_BUFFER_SECONDS + 1)
+    for start in range(1, RING_BUFFER_SECONDS, 4):
+        audio[start * RATE:(start + 2) * RATE] = tone(2)
+
+    at_once = UtteranceSegmenter(RATE).feed(audio)
+    streamed = feed_in_packets(UtteranceSegmenter(RATE), audio)
+    assert summary(at_once) == summary(streamed)
+    assert len([kind for kind, _ in at_once if kind == "end"]) == 7
+    for (_, a), (_, b) in zip(at_once, streamed):
+        assert np.array_equal(a, b)
+
+
+def test_flush_ends_the_utterance_with_the_audio_so_far():
+    segmenter = UtteranceSegmenter(RATE)
+    segmenter.feed(np.concatenate([silence(0.5), tone(0.5)]))
+    [(kind, samples)] = segmenter.flush()
+    assert kind == "end"
+    assert len(samples) == RATE * VAD_PREROLL_MS // 1000 + RATE // 2
+    assert not segmenter.in_speech
+    assert summary(segmenter.flush()) == [("end", 0)]
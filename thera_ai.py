@@ -1,29 +1,14 @@
-from dotenv import load_dotenv
 import os
-from elevenlabs.client import ElevenLabs
-from openai import OpenAI
 import json
 import logging
 from typing import Dict
+from clients import elevenlabs_client as client, openai_client
+from model_router import model_router
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
-# Initialize API keys
-elevenlabs_api_key = os.getenv("ELEVENLABS_API_KEY")
-openai_api_key = os.getenv("OPENAI_API_KEY")
-
-if not openai_api_key:
-    raise ValueError("Missing OpenAI API key. Please check your .env file.")
-
-# Set up API clients
-client = ElevenLabs(api_key=elevenlabs_api_key)
-openai_client = OpenAI()
-
 class TherapistAI:
     def __init__(self):
         self.openai = openai_client
@@ -101,10 +86,10 @@ class TherapistAI:
                 {"role": "user", "content": prompt}
             ]
             
-            response = self.openai.chat.completions.create(
-                model="gpt-4-0125-preview",
-                messages=messages,
-                max_tokens=500,
+            response = model_router.complete(
+                self.openai,
+                "chat",
+                messages,
                 temperature=0.5,  # Lower temperature for more consistent, professional responses
                 presence_penalty=0.3,  # Moderate presence penalty to maintain focus
                 frequency_penalty=0.3,  # Prevent repetition while maintaining consistency
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "thera_ai_tts"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+TTS_CACHE_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+
+
+class TTSCache:
+    """Content-addressed cache of synthesized audio.
+
+    Audio is stored on disk as one file per key and evicted least recently
+    used first once the directory exceeds max_bytes. Hot entries are kept as
+    memory-mapped views of their files, so hits don't copy the audio.
+    """
+
+    def __init__(self, directory: str = TTS_CACHE_DIR, max_bytes: int = TTS_CACHE_MAX_BYTES,
+                 memory_bytes: int = TTS_CACHE_MEMORY_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self._hot: "OrderedDict[str, memoryview]" = OrderedDict()
+        self._hot_size = 0
+        self._disk_size = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(text: str, voice_id: str, model_id: str, output_format: str,
+                 voice_settings: Dict[str, Any]) -> str:
+        payload = json.dumps({
+            "text": text,
+            "voice_id": voice_id,
+            "model_id": model_id,
+            "output_format": output_format,
+            "voice_settings": voice_settings
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def get_path(self, key: str) -> Optional[str]:
+        """Path of the cached file for key, marking it recently used"""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get(self, key: str) -> Optional[memoryview]:
+        with self._lock:
+            audio = self._hot.get(key)
+            if audio is not None:
+                self._hot.move_to_end(key)
+                self.hits += 1
+                return audio
+
+        path = self.get_path(key)
+        if path is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            with open(path, "rb") as f:
+                audio = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (FileNotFoundError, ValueError):
+            # Evicted in the meantime, or an empty file
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self._remember(key, audio)
+        return audio
+
+    def put(self, key: str, audio: bytes) -> Optional[str]:
+        """Store audio under key and return the path it was written to"""
+        if not audio:
+            return None
+        path = self.path(key)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write TTS cache entry: {str(e)}")
+            return None
+
+        with self._lock:
+            if self._disk_size is not None:
+                self._disk_size += len(audio)
+            over_budget = self._disk_size is None or self._disk_size > self.max_bytes
+        if over_budget:
+            self._evict()
+        return path
+
+    def _remember(self, key: str, audio: memoryview):
+        if key in self._hot:
+            self._hot_size -= len(self._hot.pop(key))
+        self._hot[key] = audio
+        self._hot_size += len(audio)
+        while self._hot_size > self.memory_bytes and len(self._hot) > 1:
+            _, old = self._hot.popitem(last=False)
+            self._hot_size -= len(old)
+
+    def _evict(self):
+        """Delete least recently used files until the directory fits max_bytes.
+
+        Other workers share the directory, so usage is recomputed from disk.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".mp3"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path, entry.name[:-4]))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path, key in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self._lock:
+                self.evictions += 1
+                if key in self._hot:
+                    self._hot_size -= len(self._hot.pop(key))
+
+        with self._lock:
+            self._disk_size = total
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memory_entries": len(self._hot),
+                "memory_bytes": self._hot_size,
+                "disk_bytes": self._disk_size or 0
+            }
+
+
+tts_cache = TTSCache()
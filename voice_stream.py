@@ -0,0 +1,184 @@
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Silence that closes a transcription chunk, and silence that ends the utterance
+CHUNK_PAUSE_MS = int(os.getenv("VOICE_CHUNK_PAUSE_MS", "300"))
+END_OF_UTTERANCE_MS = int(os.getenv("VOICE_END_OF_UTTERANCE_MS", "800"))
+
+# Chunks are cut at pauses once they are this long, and forcibly at the maximum
+MIN_CHUNK_SECONDS = float(os.getenv("VOICE_MIN_CHUNK_SECONDS", "2"))
+MAX_CHUNK_SECONDS = float(os.getenv("VOICE_MAX_CHUNK_SECONDS", "10"))
+
+# Sample rates accepted from streaming clients; the ring buffer is sized from it
+MIN_STREAM_SAMPLE_RATE = 8000
+MAX_STREAM_SAMPLE_RATE = 48000
+
+VAD_FRAME_MS = 20
+VAD_PREROLL_MS = 200
+VAD_THRESHOLD_RATIO = 3.0
+VAD_MIN_RMS = 0.01
+RING_BUFFER_SECONDS = 30
+
+
+def pcm16_to_float(data: bytes) -> np.ndarray:
+    """Convert little-endian 16-bit PCM bytes to float32 samples in [-1, 1]"""
+    usable = len(data) - len(data) % 2
+    return np.frombuffer(data[:usable], dtype="<i2").astype(np.float32) / 32768.0
+
+
+class RingBuffer:
+    """Fixed-size sample buffer addressed by absolute sample position"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=np.float32)
+        self.end = 0
+
+    @property
+    def start(self) -> int:
+        return max(0, self.end - self.capacity)
+
+    def write(self, samples: np.ndarray):
+        total = len(samples)
+        if total >= self.capacity:
+            samples = samples[-self.capacity:]
+        count = len(samples)
+        index = (self.end + total - count) % self.capacity
+        first = min(count, self.capacity - index)
+        self._data[index:index + first] = samples[:first]
+        self._data[:count - first] = samples[first:]
+        self.end += total
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        start = max(start, self.start)
+        stop = min(stop, self.end)
+        if stop <= start:
+            return np.zeros(0, dtype=np.float32)
+        return self._data[np.arange(start, stop) % self.capacity]
+
+
+class EnergyVAD:
+    """Frame-level voice activity detection against an adaptive noise floor"""
+
+    def __init__(self, threshold_ratio: float = VAD_THRESHOLD_RATIO, min_rms: float = VAD_MIN_RMS):
+        self.threshold_ratio = threshold_ratio
+        self.min_rms = min_rms
+        self.noise_floor: Optional[float] = None
+
+    def classify(self, frames: np.ndarray) -> np.ndarray:
+        """Return a boolean speech flag for each row of (n_frames, frame_size)"""
+        rms = np.sqrt(np.mean(np.square(frames), axis=1))
+        voiced = np.zeros(len(rms), dtype=bool)
+        for i, level in enumerate(rms):
+            if self.noise_floor is None:
+                self.noise_floor = min(level, self.min_rms)
+            voiced[i] = level > max(self.noise_floor * self.threshold_ratio, self.min_rms)
+            if not voiced[i]:
+                self.noise_floor = 0.95 * self.noise_floor + 0.05 * level
+        return voiced
+
+
+class UtteranceSegmenter:
+    """Split a live audio stream into transcription chunks and utterances.
+
+    feed() returns ("chunk", samples) events at short pauses while the user
+    is still talking, and an ("end", samples) event once they stop. The
+    samples of an event hold the audio since the previous event, or are
+    empty if that stretch was silent.
+    """
+
+    def __init__(self, sample_rate: int):
+        self.sample_rate = sample_rate
+        self.frame_size = sample_rate * VAD_FRAME_MS // 1000
+        self.ring = RingBuffer(sample_rate * RING_BUFFER_SECONDS)
+        self.vad = EnergyVAD()
+        self._processed = 0
+        self._reset()
+
+    def _reset(self):
+        self.in_speech = False
+        self.chunk_start = 0
+        self.chunk_voiced = False
+        self.silent_frames = 0
+
+    def _frames(self, ms: float) -> int:
+        return int(ms // VAD_FRAME_MS)
+
+    def _emit(self, kind: str, stop: int) -> Tuple[str, np.ndarray]:
+        if self.chunk_voiced:
+            samples = self.ring.read(self.chunk_start, stop)
+        else:
+            samples = np.zeros(0, dtype=np.float32)
+        self.chunk_start = stop
+        self.chunk_voiced = False
+        return kind, samples
+
+    def feed(self, samples: np.ndarray) -> List[Tuple[str, np.ndarray]]:
+        """Process newly received samples and return the events they complete.
+
+        Input is processed in slices small enough that the unprocessed
+        samples and the chunk still being collected stay in the ring buffer,
+        however much audio a client sends at once.
+        """
+        preroll = self.sample_rate * VAD_PREROLL_MS // 1000
+        step = self.ring.capacity - int(MAX_CHUNK_SECONDS * self.sample_rate) - preroll - 2 * self.frame_size
+        step = max(self.frame_size, step)
+        events = []
+        for offset in range(0, len(samples), step):
+            events.extend(self._feed(samples[offset:offset + step]))
+        return events
+
+    def _feed(self, samples: np.ndarray) -> List[Tuple[str, np.ndarray]]:
+        self.ring.write(samples)
+        frame_count = (self.ring.end - self._processed) // self.frame_size
+        if frame_count == 0:
+            return []
+
+        frames = self.ring.read(self._processed, self._processed + frame_count * self.frame_size)
+        voiced = self.vad.classify(frames.reshape(frame_count, self.frame_size))
+
+        events = []
+        max_chunk = int(MAX_CHUNK_SECONDS * self.sample_rate)
+        min_chunk = int(MIN_CHUNK_SECONDS * self.sample_rate)
+        for is_speech in voiced:
+            frame_start = self._processed
+            self._processed += self.frame_size
+            position = self._processed
+
+            if not self.in_speech:
+                if is_speech:
+                    preroll = self.sample_rate * VAD_PREROLL_MS // 1000
+                    self.in_speech = True
+                    self.chunk_start = max(frame_start - preroll, self.ring.start)
+                    self.chunk_voiced = True
+                    self.silent_frames = 0
+                continue
+
+            if is_speech:
+                self.silent_frames = 0
+                self.chunk_voiced = True
+            else:
+                self.silent_frames += 1
+
+            chunk_length = position - self.chunk_start
+            if self.silent_frames >= self._frames(END_OF_UTTERANCE_MS):
+                events.append(self._emit("end", position))
+                self._reset()
+            elif self.chunk_voiced and (
+                chunk_length >= max_chunk
+                or (self.silent_frames >= self._frames(CHUNK_PAUSE_MS) and chunk_length >= min_chunk)
+            ):
+                events.append(self._emit("chunk", position))
+
+        return events
+
+    def flush(self) -> List[Tuple[str, np.ndarray]]:
+        """End the current utterance immediately, e.g. when the client says so"""
+        if not self.in_speech:
+            return [("end", np.zeros(0, dtype=np.float32))]
+        event = self._emit("end", self.ring.end)
+        self._processed = self.ring.end
+        self._reset()
+        return [event]